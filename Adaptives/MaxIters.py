@@ -2,4 +2,35 @@ from .AbstractAdaptive import AbstractAdaptive
 
 
 class MaxIters(AbstractAdaptive):
-    pass
+    def __init__(self, adaptive, max_iters):
+        """
+        Caps any adaptive algorithm at **max_iters** iterations. Algorithm is
+        terminated when either wrapped one ends or the cap is reached.
+        Everything else (get_curr_val(), get_jump_status(), ...) is taken from
+        the wrapped algorithm.
+
+        * :param **adaptive**: Wrapped adaptive algorithm.
+        * :param **max_iters**: Max no of iterations.
+        """
+        assert max_iters > 0, 'Illegal init value'
+        self.adaptive = adaptive
+        self.max_iters = max_iters
+        self.iters = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        if self.iters >= self.max_iters:
+            raise StopIteration()
+        val = next(self.adaptive)
+        self.iters += 1
+        return val
+
+    def set_corr(self, corr):
+        self.adaptive.set_corr(corr)
+
+    def __getattr__(self, item):
+        if item == 'adaptive':  # not set yet, e.g. while unpickling
+            raise AttributeError(item)
+        return getattr(self.adaptive, item)
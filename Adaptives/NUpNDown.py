@@ -2,7 +2,8 @@ from .AbstractAdaptive import AbstractAdaptive
 
 
 class NUpNDown(AbstractAdaptive):
-    def __init__(self, n_up=3, n_down=1, max_revs=8, start_val=10, step_up=1, step_down=1):
+    def __init__(self, n_up=3, n_down=1, max_revs=8, start_val=10, step_up=1, step_down=1, min_revs=2,
+                 max_se=None):
         """
         This class will be returning some value in any iteration.
         At start it will be **start_val**.
@@ -12,6 +13,10 @@ class NUpNDown(AbstractAdaptive):
         decreased by **step**.
         If swipe (change between series of up's of series of down's)
         will be detected **max_revs** times, algorithm will be terminated.
+        Values at which swipes happened give a running threshold estimate,
+        see get_threshold_estimate(). With **max_se**, algorithm is also
+        terminated as soon as at least **min_revs** swipes were detected
+        and standard error of that estimate isn't above **max_se**.
 
         * :param **n_up**: No of set_corr(True) before inc value.
         * :param **n_down**: No of set_corr(False) before dec value.
@@ -19,16 +24,21 @@ class NUpNDown(AbstractAdaptive):
         * :param **start_val**: Initial value.
         * :param **step_up**: Values of inc with n_up.
         * :param **step_down**: Values of dec with n_down.
+        * :param **min_revs**: No of swipes before **max_se** rule may end alg, at least 2.
+        * :param **max_se**: Standard error of threshold estimate small enough to end alg, None to never end early.
         """
 
         # Some vals must be positive, check if that true.
         assert all(map(lambda x: x > 0, [n_up, n_down, max_revs, step_up])), 'Illegal init value'
+        assert min_revs >= 2 and (max_se is None or max_se >= 0), 'Illegal init value'
         self.n_up = n_up
         self.n_down = n_down
         self.max_revs = max_revs
         self.curr_val = start_val
         self.step_up = step_up
         self.step_down = step_down
+        self.min_revs = min_revs
+        self.max_se = max_se
 
         self.jumps = 0
         self.no_corr_in_a_row = 0
@@ -37,6 +47,9 @@ class NUpNDown(AbstractAdaptive):
         self.revs_count = 0
         self.set_corr_flag = True
         self.switch_in_last_trail_flag = False
+        # Running (Welford) mean and sum of squared deviations of values at swipes.
+        self.revs_mean = 0.0
+        self.revs_m2 = 0.0
 
     def __iter__(self):
         return self
@@ -49,7 +62,7 @@ class NUpNDown(AbstractAdaptive):
         self.set_corr_flag = False
 
         # check if it's time to stop alg.
-        if self.revs_count < self.max_revs:
+        if self.revs_count < self.max_revs and not self.is_stable():
             return self.curr_val
         else:
             raise StopIteration()
@@ -67,6 +80,7 @@ class NUpNDown(AbstractAdaptive):
 
         self.set_corr_flag = True  # set_corr are used, set flag.
         self.switch_in_last_trail_flag = False
+        val = self.curr_val  # value tested in this iteration
         jump = 0
 
         # increase no of corr or incorr ans in row.
@@ -95,6 +109,9 @@ class NUpNDown(AbstractAdaptive):
                 self.revs_count += 1
                 self.last_jump_dir = jump
                 self.switch_in_last_trail_flag = True
+                delta = val - self.revs_mean
+                self.revs_mean += delta / self.revs_count
+                self.revs_m2 += delta * (val - self.revs_mean)
             # clear counters after jump
             self.no_incorr_in_a_row = 0
             self.no_corr_in_a_row = 0
@@ -104,3 +121,23 @@ class NUpNDown(AbstractAdaptive):
 
     def get_curr_val(self):
         return self.curr_val
+
+    def get_threshold_estimate(self):
+        """
+        Mean of values at which swipes happened and its standard error. Costs O(1).
+
+        :return: (mean, se), mean is None before first swipe and se is None before second one.
+        """
+        if not self.revs_count:
+            return None, None
+        if self.revs_count < 2:
+            return self.revs_mean, None
+        return self.revs_mean, (self.revs_m2 / (self.revs_count - 1) / self.revs_count) ** 0.5
+
+    def is_stable(self):
+        """
+        :return: True if threshold estimate is precise enough to end alg, see **max_se**.
+        """
+        if self.max_se is None or self.revs_count < self.min_revs:
+            return False
+        return self.get_threshold_estimate()[1] <= self.max_se
@@ -0,0 +1,202 @@
+import numpy as np
+
+from .AbstractAdaptive import AbstractAdaptive
+
+
+class NUpNDownBatch(AbstractAdaptive):
+    def __init__(self, size, n_up=3, n_down=1, max_revs=8, start_val=10, step_up=1, step_down=1, min_revs=2,
+                 max_se=None):
+        """
+        Vectorized counterpart of NUpNDown, holding **size** independent
+        staircases as NumPy arrays. Every staircase follows exactly the
+        same rules as NUpNDown, so given the same sequence of answers
+        it returns the same sequence of values.
+        Iteration returns an array of current values for all staircases and
+        stops when every staircase reached its **max_revs**. Staircases
+        that already finished ignore further answers, see **active**.
+        Early stopping on a precise threshold estimate also works as in NUpNDown.
+
+        * :param **size**: No of staircases.
+        * :param **n_up**: No of set_corr(True) before inc value. Scalar or array of **size**.
+        * :param **n_down**: No of set_corr(False) before dec value. Scalar or array of **size**.
+        * :param **max_revs**: No of swipes before end of alg. Scalar or array of **size**.
+        * :param **start_val**: Initial value. Scalar or array of **size**.
+        * :param **step_up**: Values of inc with n_up. Scalar or array of **size**.
+        * :param **step_down**: Values of dec with n_down. Scalar or array of **size**.
+        * :param **min_revs**: No of swipes before **max_se** rule may end alg. Scalar or array of **size**.
+        * :param **max_se**: Standard error of threshold estimate small enough to end alg, None to never end early.
+          Scalar or array of **size**.
+        """
+        assert size > 0, 'Illegal init value'
+
+        def as_array(val):
+            return np.array(np.broadcast_to(val, (size,)))
+
+        self.size = size
+        self.n_up = as_array(n_up).astype(np.int64)
+        self.n_down = as_array(n_down).astype(np.int64)
+        self.max_revs = as_array(max_revs).astype(np.int64)
+        self.step_up = as_array(step_up)
+        self.step_down = as_array(step_down)
+        self.curr_val = as_array(start_val)
+        self.min_revs = as_array(min_revs).astype(np.int64)
+        self.max_se = as_array(np.inf if max_se is None else max_se).astype(np.float64)
+        self.early_stop = bool(np.isfinite(self.max_se).any())
+        # Some vals must be positive, check if that true.
+        assert all(map(lambda x: np.all(x > 0), [self.n_up, self.n_down, self.max_revs, self.step_up])), \
+            'Illegal init value'
+        assert np.all(self.min_revs >= 2) and np.all(self.max_se >= 0), 'Illegal init value'
+        # Values must keep its type after mixed scalar steps, as it's in scalar version.
+        self.curr_val = self.curr_val.astype(np.result_type(self.curr_val, self.step_up, self.step_down))
+
+        self.no_corr_in_a_row = np.zeros(size, dtype=np.int64)
+        self.no_incorr_in_a_row = np.zeros(size, dtype=np.int64)
+        self.last_jump_dir = np.zeros(size, dtype=np.int64)
+        self.revs_count = np.zeros(size, dtype=np.int64)
+        self.switch_in_last_trail_flag = np.zeros(size, dtype=bool)
+        # Running (Welford) mean and sum of squared deviations of values at swipes.
+        self.revs_mean = np.zeros(size, dtype=np.float64)
+        self.revs_m2 = np.zeros(size, dtype=np.float64)
+        self.active = self.revs_count < self.max_revs
+        self.set_corr_flag = True
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # Set_corr wasn't used after last iteration. That's quite bad.
+        if not self.set_corr_flag:
+            raise Exception(" class.set_corr() must be used at least once "
+                            "in any iteration!")
+        self.set_corr_flag = False
+
+        # check if it's time to stop alg.
+        if self.active.any():
+            return self.curr_val
+        else:
+            raise StopIteration()
+
+    def set_corr(self, corr):
+        """
+        This func determine changes in values returned by next, for all active staircases at once.
+
+        :param **corr**: Boolean array of correctness in last iteration, one per staircase.
+
+        :return: None
+        """
+        corr = np.asarray(corr)
+        assert corr.dtype == bool and corr.shape == (self.size,), 'Correctness must be a boolean array of batch size'
+
+        self.set_corr_flag = True  # set_corr are used, set flag.
+        active = self.active
+
+        # increase no of corr or incorr ans in row. Counters of finished staircases are never read again.
+        self.no_corr_in_a_row += 1
+        self.no_corr_in_a_row *= corr
+        self.no_incorr_in_a_row += 1
+        self.no_incorr_in_a_row *= ~corr
+
+        # check if it's time to change returned value
+        jump_up = (self.no_corr_in_a_row == self.n_up) & active
+        jump_down = (self.no_incorr_in_a_row == self.n_down) & active
+        val = self.curr_val.copy()  # values tested in this iteration
+        self.curr_val -= self.step_up * jump_up
+        self.curr_val += self.step_down * jump_down
+        jump = jump_up.view(np.int8) - jump_down.view(np.int8)
+
+        # check if jump was also a switch
+        jumped = jump_up | jump_down
+        switch = jumped & (self.last_jump_dir != 0) & (jump != self.last_jump_dir)
+        self.revs_count += switch
+        self.switch_in_last_trail_flag = switch
+        if switch.any():
+            delta = np.where(switch, val - self.revs_mean, 0.0)
+            self.revs_mean += delta / np.maximum(self.revs_count, 1)
+            self.revs_m2 += delta * (val - self.revs_mean)
+        np.copyto(self.last_jump_dir, jump, where=jumped)
+        # clear counters after jump
+        not_jumped = ~jumped
+        self.no_corr_in_a_row *= not_jumped
+        self.no_incorr_in_a_row *= not_jumped
+
+        np.less(self.revs_count, self.max_revs, out=self.active)
+        if self.early_stop:
+            self.active &= ~self.is_stable()
+
+    def get_jump_status(self):
+        return self.last_jump_dir, self.switch_in_last_trail_flag, self.revs_count
+
+    def get_curr_val(self):
+        return self.curr_val
+
+    def get_threshold_estimate(self):
+        """
+        Mean of values at which swipes happened and its standard error, for all staircases.
+
+        :return: (mean, se) arrays, mean is nan before first swipe and se is nan before second one.
+        """
+        with np.errstate(divide='ignore', invalid='ignore'):
+            mean = np.where(self.revs_count > 0, self.revs_mean, np.nan)
+            se = np.sqrt(self.revs_m2 / (self.revs_count - 1) / self.revs_count)
+        se[self.revs_count < 2] = np.nan
+        return mean, se
+
+    def is_stable(self):
+        """
+        :return: Boolean array, True where threshold estimate is precise enough to end alg, see **max_se**.
+        """
+        se = self.get_threshold_estimate()[1]
+        return (self.revs_count >= self.min_revs) & (se <= self.max_se)
+
+
+def simulate(batch, observer, rng=None, max_trials=10000):
+    """
+    Run all staircases of a batch against a simulated observer until every one of them finishes.
+
+    * :param **batch**: NUpNDownBatch to run.
+    * :param **observer**: Object with respond(stim_time, rng) returning boolean array,
+      e.g. misc.observer.PsychometricObserver.
+    * :param **rng**: numpy.random.Generator, fresh default one if None.
+    * :param **max_trials**: Safety cap on no of iterations, staircases still active after it are left unfinished.
+
+    :return: Array with no of trials run by every staircase.
+    """
+    rng = np.random.default_rng() if rng is None else rng
+    no_trials = np.zeros(batch.size, dtype=np.int64)
+    for _, val in zip(range(max_trials), batch):
+        no_trials += batch.active
+        batch.set_corr(observer.respond(val, rng))
+    return no_trials
+
+
+if __name__ == '__main__':
+    import argparse
+    import time
+
+    from misc.observer import PsychometricObserver
+
+    parser = argparse.ArgumentParser(description='Simulate a batch of NUpNDown staircases.')
+    parser.add_argument('--size', type=int, default=1000000)
+    parser.add_argument('--n-up', type=int, default=2)
+    parser.add_argument('--n-down', type=int, default=1)
+    parser.add_argument('--max-revs', type=int, default=14)
+    parser.add_argument('--start-val', type=int, default=20)
+    parser.add_argument('--threshold', type=float, default=10.0)
+    parser.add_argument('--slope', type=float, default=2.0)
+    parser.add_argument('--min-revs', type=int, default=2)
+    parser.add_argument('--max-se', type=float, default=None)
+    parser.add_argument('--seed', type=int, default=None)
+    args = parser.parse_args()
+
+    start = time.perf_counter()
+    staircases = NUpNDownBatch(args.size, n_up=args.n_up, n_down=args.n_down, max_revs=args.max_revs,
+                               start_val=args.start_val, min_revs=args.min_revs, max_se=args.max_se)
+    trials = simulate(staircases, PsychometricObserver(threshold=args.threshold, slope=args.slope),
+                      np.random.default_rng(args.seed))
+    elapsed = time.perf_counter() - start
+    print('Staircases: {}, time: {:.2f} s'.format(args.size, elapsed))
+    print('Trials per staircase: mean {:.1f}, max {}'.format(trials.mean(), trials.max()))
+    print('Final value: mean {:.2f}, sd {:.2f}'.format(staircases.curr_val.mean(), staircases.curr_val.std()))
+    estimate, se = staircases.get_threshold_estimate()
+    print('Threshold estimate: mean {:.2f}, sd {:.2f}, mean se {:.2f}'.format(np.nanmean(estimate),
+                                                                           np.nanstd(estimate), np.nanmean(se)))
@@ -1,5 +1,25 @@
-from .AbstractAdaptive import AbstractAdaptive
+from .NUpNDown import NUpNDown
 
 
-class NUpNDownMaxIters(AbstractAdaptive):
-    pass
\ No newline at end of file
+class NUpNDownMaxIters(NUpNDown):
+    def __init__(self, n_up=3, n_down=1, max_revs=8, start_val=10, step_up=1, step_down=1, min_revs=2,
+                 max_se=None, max_iters=None):
+        """
+        NUpNDown that is also terminated after **max_iters** iterations,
+        so a staircase that keeps wandering can't lengthen a session indefinitely.
+
+        * :param **max_iters**: Max no of iterations, None for no cap.
+        * Other params as in NUpNDown.
+        """
+        assert max_iters is None or max_iters > 0, 'Illegal init value'
+        super().__init__(n_up=n_up, n_down=n_down, max_revs=max_revs, start_val=start_val, step_up=step_up,
+                         step_down=step_down, min_revs=min_revs, max_se=max_se)
+        self.max_iters = max_iters
+        self.iters = 0
+
+    def __next__(self):
+        if self.max_iters is not None and self.iters >= self.max_iters:
+            raise StopIteration()
+        val = super().__next__()
+        self.iters += 1
+        return val
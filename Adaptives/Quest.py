@@ -0,0 +1,173 @@
+import numpy as np
+
+from .AbstractAdaptive import AbstractAdaptive
+
+
+class Quest(AbstractAdaptive):
+    def __init__(self, start_val=10, max_trials=40, min_val=1, max_val=60, prior_sd=10.0, guess=0.25, target=0.707,
+                 thresholds=None, slopes=(0.5, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0), lapses=(0.0, 0.02, 0.05),
+                 min_trials=10, max_se=None):
+        """
+        Bayesian adaptive procedure (QUEST / Psi method). Keeps a posterior over
+        threshold, slope and lapse rate of a logistic psychometric function
+        p = guess + (1 - guess - lapse) / (1 + exp(-(x - threshold) / slope))
+        on a grid. Every set_corr() multiplies it by a likelihood of an answer,
+        and every next value is the integer from **min_val**..**max_val** with
+        the lowest expected entropy of the posterior after the next answer.
+        Algorithm is terminated after **max_trials** iterations, or, with
+        **max_se**, as soon as posterior sd of threshold is at most **max_se**
+        after at least **min_trials** iterations.
+
+        * :param **start_val**: Initial value and center of a gaussian prior over threshold.
+        * :param **max_trials**: No of iterations before end of alg.
+        * :param **min_val**: Smallest value that may be returned.
+        * :param **max_val**: Largest value that may be returned.
+        * :param **prior_sd**: Sd of a prior over threshold.
+        * :param **guess**: Chance level, 1 / no of letters for the saccade task.
+        * :param **target**: Accuracy at which get_curr_val() estimates the value, 0.707 is where 2-up-1-down
+          NUpNDown converges.
+        * :param **thresholds**: Grid of thresholds, every 0.25 from **min_val** to **max_val** if None.
+        * :param **slopes**: Grid of slopes. A single one fixes it.
+        * :param **lapses**: Grid of lapse rates. A single one fixes it.
+        * :param **min_trials**: No of iterations before **max_se** rule may end alg.
+        * :param **max_se**: Posterior sd of threshold small enough to end alg, None to never end early.
+        """
+        assert max_trials > 0 and min_val < max_val and prior_sd > 0, 'Illegal init value'
+        assert 0 <= guess < target < 1, 'Illegal init value'
+        if thresholds is None:
+            thresholds = np.arange(min_val, max_val + 0.125, 0.25)
+        self.thresholds = np.asarray(thresholds, dtype=float)
+        self.slopes = np.asarray(slopes, dtype=float)
+        self.lapses = np.asarray(lapses, dtype=float)
+        assert np.all(self.slopes > 0) and np.all(guess + self.lapses < target), 'Illegal init value'
+        self.max_trials = max_trials
+        self.min_trials = min_trials
+        self.max_se = max_se
+        self.values = np.arange(min_val, max_val + 1)
+        self.guess = guess
+        self.target = target
+
+        self._build_tables()
+
+        self.posterior = np.exp(-0.5 * ((self.grid_thresholds - start_val) / prior_sd) ** 2)
+        self.posterior /= self.posterior.sum()
+
+        self.curr_val = int(np.clip(start_val, min_val, max_val))
+        self.no_trials = 0
+        self.last_jump_dir = 0
+        self.revs_count = 0
+        self.switch_in_last_trail_flag = False
+        self.set_corr_flag = True
+
+    def _build_tables(self):
+        # Grid axes: (threshold, slope, lapse), flattened for fast products.
+        thr, slope, lapse = np.meshgrid(self.thresholds, self.slopes, self.lapses, indexing='ij')
+        thr, slope, lapse = thr.ravel(), slope.ravel(), lapse.ravel()
+        # Likelihood of a correct answer for every (value, grid point).
+        self.p_corr = self.guess + (1 - self.guess - lapse) / (1 + np.exp(-(self.values[:, None] - thr) / slope))
+        self.p_incorr = 1 - self.p_corr
+        # Value reaching **target** accuracy at every grid point, for get_curr_val().
+        q = (self.target - self.guess) / (1 - self.guess - lapse)
+        self.target_vals = thr + slope * np.log(q / (1 - q))
+        self.grid_thresholds = thr
+
+    def __getstate__(self):
+        # Tables are large (values x grid points) and depend only on init values, so they are built again on load.
+        state = self.__dict__.copy()
+        for table in _TABLES:
+            del state[table]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._build_tables()
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        # Set_corr wasn't used after last iteration. That's quite bad.
+        if not self.set_corr_flag:
+            raise Exception(" class.set_corr() must be used at least once "
+                            "in any iteration!")
+        self.set_corr_flag = False
+
+        # check if it's time to stop alg.
+        if self.no_trials < self.max_trials and not self.is_stable():
+            return self.curr_val
+        else:
+            raise StopIteration()
+
+    def set_corr(self, corr):
+        """
+        Update posterior with an answer to the last value and choose the next one.
+
+        :param **corr**: Correctness in last iteration.
+
+        :return: None
+        """
+        assert isinstance(corr, bool), 'Correctness must be a boolean value'
+
+        self.set_corr_flag = True
+        self.no_trials += 1
+        idx = self.curr_val - self.values[0]
+        self.posterior *= self.p_corr[idx] if corr else self.p_incorr[idx]
+        self.posterior /= self.posterior.sum()
+
+        next_val = int(self.values[np.argmin(self.expected_entropy())])
+        # Same bookkeeping as in NUpNDown: 1 is a decrease of value, -1 an increase.
+        jump = int(np.sign(self.curr_val - next_val))
+        self.switch_in_last_trail_flag = False
+        if jump:
+            if self.last_jump_dir and jump != self.last_jump_dir:
+                self.revs_count += 1
+                self.switch_in_last_trail_flag = True
+            self.last_jump_dir = jump
+        self.curr_val = next_val
+
+    def expected_entropy(self):
+        """
+        :return: Expected entropy of posterior after the next answer, for every value in **values**.
+        """
+        corr = self.p_corr * self.posterior
+        incorr = self.p_incorr * self.posterior
+        p = corr.sum(axis=1)
+        # Entropy of a normalized a / p is -(sum a log a) / p + log p, weighted by p and summed over answers.
+        return (p * np.log(p) + (1 - p) * np.log(1 - p)
+                - _xlogx(corr).sum(axis=1) - _xlogx(incorr).sum(axis=1))
+
+    def get_jump_status(self):
+        return self.last_jump_dir, self.switch_in_last_trail_flag, self.revs_count
+
+    def get_curr_val(self):
+        """
+        :return: Posterior mean of a value reaching **target** accuracy, rounded to a legal value.
+        """
+        val = np.dot(self.posterior, self.target_vals)
+        return int(np.clip(np.rint(val), self.values[0], self.values[-1]))
+
+    def get_threshold_estimate(self):
+        """
+        :return: (mean, sd) of posterior over threshold.
+        """
+        mean = np.dot(self.posterior, self.grid_thresholds)
+        var = np.dot(self.posterior, (self.grid_thresholds - mean) ** 2)
+        return float(mean), float(np.sqrt(var))
+
+    def is_stable(self):
+        """
+        :return: True if threshold estimate is precise enough to end alg, see **max_se**.
+        """
+        if self.max_se is None or self.no_trials < self.min_trials:
+            return False
+        return self.get_threshold_estimate()[1] <= self.max_se
+
+
+_TABLES = ('p_corr', 'p_incorr', 'target_vals', 'grid_thresholds')
+
+
+def _xlogx(a):
+    out = np.zeros_like(a)
+    np.log(a, out=out, where=a > 0)
+    out *= a
+    return out
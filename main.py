@@ -7,19 +7,34 @@ Fill free to use, but remember to cite.
 """
 from __future__ import annotations
 
+import argparse
 import atexit
-import codecs
-import csv
-import random
+import os
+import socket
 from datetime import datetime
 from os.path import join
-from typing import List, Tuple, Any
+from typing import List, Tuple, Any, Dict, Iterator
 
+import numpy as np
 import yaml
-from psychopy import visual, event, logging, gui, core
 
-from Adaptives.NUpNDown import NUpNDown
-from misc.screen_misc import get_screen_res, get_frame_rate
+from Adaptives.AbstractAdaptive import AbstractAdaptive
+from Adaptives.NUpNDownMaxIters import NUpNDownMaxIters
+from Adaptives.Quest import Quest
+from misc.aggregator import AggregatorSink
+from misc import backend, durations, frame_timing, timeline, trial_record
+from misc.assets import AssetManager
+from misc.frame_timing import FrameTimer
+from misc.gaze import GazeTracker
+from misc.journal import Journal
+from misc.pipeline import IdleScheduler
+from misc.responses import ResponseCollector
+from misc.results_writer import ResultsWriter
+from misc.schedule import Trial, block_trials, build_schedule, exp_blocks_order, new_seed, save_schedule, shown_trial
+from misc.backend import visual, event, logging, gui, core
+from misc.checkpoint import SessionState, checkpoint_path, load_checkpoint, save_checkpoint
+from misc.stim_cache import StimulusCache
+from misc.trial_record import PART_ID_MAX_LEN, TrialRecord
 
 __author__ = "Bartek Kroczek"
 __copyright__ = "Copyright 2022, Cognitive Processes Labolatory at Jagiellonian University, Cracow, Poland"
@@ -32,37 +47,58 @@ __status__ = "Preparation"
 
 # GLOBALS
 
-LAST_STIM = ''
-RESULTS = list()
-RESULTS.append(['PART_ID', 'Block_no', 'Trial_no', 'Block_type', 'Trial_type', 'CSI', 'Stim_letter', 'Key_pressed',
-                'letter_choose', 'Rt', 'Corr', 'Stimulus Time', 'Level', 'Reversal', 'Revs_count'])
+RESULTS_HEADER = trial_record.HEADER
+RESULTS: ResultsWriter | None = None  # Rows are streamed to disk as soon as they're appended
+GAZE: GazeTracker | None = None  # Eye-tracker input, if GAZE_SOURCE is set
+JOURNAL: Journal | None = None  # Binary journal of every flip and event, if JOURNAL is on
+AGGREGATOR: AggregatorSink | None = None  # Rows are also sent to an aggregation server, if AGGREGATOR is set
 
 
 @atexit.register
 def save_beh_results() -> None:
-    now = datetime.now()
-    path = join('results', f'{PART_ID}_{now.strftime("%d-%m-%Y_%H-%M-%S")}_beh.csv')
-    with open(path, 'w', encoding='utf-8') as beh_file:
-        beh_writer = csv.writer(beh_file)
-        beh_writer.writerows(RESULTS)
+    if GAZE is not None:
+        GAZE.close()
+    if JOURNAL is not None:
+        JOURNAL.close()
+    if AGGREGATOR is not None:
+        AGGREGATOR.close()
+    if RESULTS is not None:
+        logging.flush()
+        RESULTS.close()
+
+
+def sync_results() -> None:
+    """
+    Push buffered log messages to results writer and make it fsync everything written so far,
+    and write dirty journal pages to disk. Rows of a block are also sent to an aggregation server.
+    Only the journal is written on the calling thread: it blocks until a block's worth of records (up to a few MB
+    at 240 Hz) is synced. Meant for block boundaries, before an instruction screen.
+
+    Returns:
+        None.
+    """
     logging.flush()
+    RESULTS.sync()
+    if JOURNAL is not None:
+        JOURNAL.flush()
+    if AGGREGATOR is not None:
+        AGGREGATOR.send()
 
 
-def show_image(win: visual.Window, file_name: str, size: List[int, int], key: str = 'f7') -> None:
+def show_image(win: visual.Window, assets: AssetManager, name: str, key: str = 'f7') -> None:
     """
 
     Args:
         win: psychopy.visual.window object. Main procedure window.
-        file_name: Name of a picture to display.
-        size: X and Y dim size for picture, in Pixels.
+        assets: Preloaded session assets.
+        name: File name of a picture (from images directory) to display.
         key: Which key terminate image and moves procedures forward.
 
     Returns:
         None.
 
     """
-    image = visual.ImageStim(win=win, image=file_name, interpolate=True, size=size)
-    image.draw()
+    assets.image(name).draw()
     win.flip()
     clicked = event.waitKeys(keyList=[key, 'return', 'space'])
     if clicked[0] == key:
@@ -71,31 +107,6 @@ def show_image(win: visual.Window, file_name: str, size: List[int, int], key: st
     win.flip()
 
 
-def read_text_from_file(file_name: str, insert: str = '') -> str:
-    """
-    Method that read message from text file, and optionally add some dynamically generate info
-    Args:
-        file_name: Name of a file to display
-        insert: Addon
-
-    Returns:
-        String contains message to display on screen.
-    """
-
-    if not isinstance(file_name, str):
-        abort_with_error('Problem with file reading, filename must be a string')
-    msg = list()
-    with codecs.open(file_name, encoding='utf-8', mode='r') as data_file:
-        for line in data_file:
-            if not line.startswith('#'):  # if not commented line
-                if line.startswith('<--insert-->'):
-                    if insert:
-                        msg.append(insert)
-                else:
-                    msg.append(line)
-    return ''.join(msg)
-
-
 def check_exit(key: str = 'f7') -> None:
     """
     Check if user wants to terminate a procedure.
@@ -110,21 +121,20 @@ def check_exit(key: str = 'f7') -> None:
         abort_with_error('Experiment finished by user! {} pressed.'.format(key))
 
 
-def show_info(win: visual.Window, file_name: str, insert: str = '', key: str = 'f7') -> None:
+def show_info(win: visual.Window, assets: AssetManager, name: str, insert: str = '', key: str = 'f7') -> None:
     """
     Display info on screen.
     Args:
         key: Key that terminates procedure
         win: Procedure main window.
-        file_name: String contains name of a file to display.
+        assets: Preloaded session assets.
+        name: File name of a message (from messages directory) to display.
         insert: Optional msg to add into message.
 
     Returns:
         None.
     """
-    msg = read_text_from_file(file_name, insert=insert)
-    msg = visual.TextStim(win, color='black', text=msg, height=20, wrapWidth=SCREEN_RES['width'])
-    msg.draw()
+    assets.message(name, insert=insert).draw()
     win.flip()
     clicked = event.waitKeys(keyList=['f7', 'return', 'space'])
     if clicked[0] == key:
@@ -146,217 +156,453 @@ def abort_with_error(err: str) -> None:
 
 
 def main():
-    global PART_ID  # PART_ID is used in case of error on @atexit, that's why it must be global
+    # All are used in case of error on @atexit, that's why they must be global
+    global PART_ID, RESULTS, GAZE, JOURNAL, AGGREGATOR
     # === Dialog popup ===
-    info = {'IDENTYFIKATOR': '', u'P\u0141EC': ['M', "K"], 'WIEK': '20'}
+    info = {'IDENTYFIKATOR': '', u'P\u0141EC': ['M', "K"], 'WIEK': '20', 'WZNOWIENIE': False}
     dictDlg = gui.DlgFromDict(dictionary=info, title='Saccade task.')
     if not dictDlg.OK:
         abort_with_error('Info dialog terminated.')
 
     # === Procedure init ===
     PART_ID = info['IDENTYFIKATOR'] + info[u'P\u0141EC'] + info['WIEK']
-    logging.LogFile(join('results', PART_ID + '.log'), level=logging.INFO)  # errors logging
-
-    clock: core.Clock = core.Clock()
+    if len(PART_ID) > PART_ID_MAX_LEN:  # binary results keep that many characters
+        abort_with_error('Participant id {} too long, at most {} characters with sex and age.'.format(
+            PART_ID, PART_ID_MAX_LEN))
+    os.makedirs('results', exist_ok=True)
+    session_name = f'{PART_ID}_{datetime.now().strftime("%d-%m-%Y_%H-%M-%S")}'
     conf: dict = yaml.load(open('config.yaml', encoding='utf-8'), Loader=yaml.SafeLoader)
+    timeline.check_timeline(conf['TRIAL_TIMELINE'])
+    RESULTS = ResultsWriter(join('results', f'{session_name}_beh.csv'),
+                            header=RESULTS_HEADER, log_path=join('results', PART_ID + '.log'),
+                            binary_path=join('results', f'{session_name}_beh.bin') if conf['BINARY_RESULTS'] else None)
+    logging.LogFile(RESULTS.log_stream(), level=logging.INFO)  # errors logging
+    checkpoint = checkpoint_path('results', PART_ID)
+    if info['WZNOWIENIE']:  # continue an interrupted session from its last saved trial
+        if not os.path.exists(checkpoint):
+            abort_with_error('No checkpoint to resume: {}'.format(checkpoint))
+        state = load_checkpoint(checkpoint)
+        logging.info('RESUMED: session {}, trial {}'.format(state.session, state.trial_no))
+    else:
+        state = SessionState(PART_ID, session_name, new_seed() if conf['SEED'] is None else conf['SEED'])
+    if conf['AGGREGATOR']:
+        AGGREGATOR = AggregatorSink(conf['AGGREGATOR'], station=socket.gethostname(), session=session_name,
+                                    spool_dir=join('results', 'spool'))
+        logging.info('AGGREGATOR: {}'.format(conf['AGGREGATOR']))
+
+    schedule = build_schedule(conf, state.seed)
+    save_schedule(join('results', f'{session_name}_schedule.npz'), schedule, state.seed)
+    logging.info('SEED: {}'.format(state.seed))
+    key_map = dict(zip(conf['REACTION_KEYS'], conf['STIM_LETTERS']))
 
     win = visual.Window(list(SCREEN_RES.values()), fullscr=True, monitor='testMonitor', units='pix',
                         screen=0, color=conf['BACKGROUND_COLOR'])
     event.Mouse(visible=False, newPos=None, win=win)  # Make mouse invisible
-    FRAME_RATE: int = get_frame_rate(win)
-    if FRAME_RATE != conf['FRAME_RATE']:
+    FRAME_RATE: int = backend.frame_rate(win)
+    if FRAME_RATE not in conf['FRAME_RATES']:
         dlg = gui.Dlg(title="Critical error")
         dlg.addText('Wrong no of frames detected: {}. Experiment terminated.'.format(FRAME_RATE))
         dlg.show()
         return None
+    if state.frame_rate not in (None, FRAME_RATE):  # staircase values are in frames
+        abort_with_error('Session started at {} Hz can\'t be resumed at {} Hz.'.format(state.frame_rate, FRAME_RATE))
+    state.frame_rate = FRAME_RATE
+    conf = durations.frames_config(conf, FRAME_RATE)
 
     logging.info('FRAME RATE: {}'.format(FRAME_RATE))
+    frame_timer = FrameTimer(win, FRAME_RATE, budget=conf['FRAME_BUDGET'])
+    if conf['JOURNAL']:
+        JOURNAL = Journal(join('results', f'{session_name}_journal.bin'),
+                          meta=dict(part_id=PART_ID, session=session_name, letters=list(conf['STIM_LETTERS']),
+                                    keys=conf['REACTION_KEYS'], frame_rate=FRAME_RATE,
+                                    frame_budget=conf['FRAME_BUDGET']))
+    responses = backend.responses(conf['REACTION_KEYS'], measure=conf['MEASURE_RESPONSE_LATENCY'])
+    if conf['GAZE_SOURCE']:
+        GAZE = GazeTracker(conf, clock=core.getTime)
+        logging.info('GAZE SOURCE: {}'.format(conf['GAZE_SOURCE']))
     logging.info('SCREEN RES: {}'.format(SCREEN_RES.values()))
 
     # === stimuli preparation ===
-    fix_cross = visual.TextStim(win, text='+', height=100, color=conf['FIX_CROSS_COLOR'])
-    que = visual.Circle(win, radius=conf['QUE_RADIUS'], fillColor=conf['QUE_COLOR'], lineColor=conf['QUE_COLOR'])
-    stim = visual.TextStim(win, text='', height=conf['STIM_SIZE'], color=conf['STIM_COLOR'])
-    mask = visual.ImageStim(win, image=join('images', 'mask4.png'), size=(conf['STIM_SIZE'], conf['STIM_SIZE']))
-    separator = [' ' * conf['REACTION_KEYS_SEP']] * len(conf['REACTION_KEYS'])
-    question_frame = visual.TextStim(win, text="".join(["".join(x) for x in zip(conf['STIM_LETTERS'], separator)]),
-                                     height=30,
-                                     pos=(100, -300), color=conf['FIX_CROSS_COLOR'], wrapWidth=10000)
-    question_label = visual.TextStim(win, text="".join(["".join(x) for x in zip(conf['REACTION_KEYS'], separator)]),
-                                     height=30, pos=(100, -330), color=conf['FIX_CROSS_COLOR'], wrapWidth=10000)
-    trial_no = 1
-
-    show_info(win, join('.', 'messages', 'hello.txt'))
-    show_info(win, join('.', 'messages', 'before_training.txt'))
+    assets = AssetManager(win, SCREEN_RES)
+    stims = StimulusCache(win, conf, assets)
+    logging.info('STIMULUS CACHE: {}'.format(stims.stats()))
+    pipeline = IdleScheduler(core.wait)
+
+    show_info(win, assets, 'hello.txt')
+    show_info(win, assets, 'before_training.txt')
 
     # === Training ===
     for block_no, (no_trials, stim_time, block_type) in enumerate(conf['TRAINING_BLOCKS'], start=1):
-        show_info(win, join('.', 'messages', f'before_{block_type}_block.txt'))
-        for _ in range(no_trials):
-            csi = random.choice(conf['CSI_POSSIBLE'])
-            key_pressed, rt, stim_letter, choice, corr = run_trial(win, conf, block_type, fix_cross, csi, que, stim,
-                                                                   clock, question_frame, question_label, mask,
-                                                                   stim_time)
-            RESULTS.append(
-                [PART_ID, block_no, trial_no, block_type, 'train', csi, stim_letter, key_pressed, choice, rt, corr,
-                 stim_time, '-', '-', '-'])
-            show_feedback(win, corr)
-            trial_no += 1
+        if state.is_completed('train', block_no):
+            continue
+        show_info(win, assets, f'before_{block_type}_block.txt')
+        plan, _ = block_plan(state, schedule, 'train', block_no, stim_time)
+        run_block(win, conf, stims, plan, responses, key_map, frame_timer, pipeline, state, checkpoint)
+        finish_block(state, checkpoint)
 
     # === Adaptively stim times ===
-    start_stim_times = dict()
-    for block_type in conf['ADAPTIVE_BLOCKS']:
-        adaptive = NUpNDown(start_val=conf[f'START_STIM_TIME_{block_type}'], max_revs=conf['MAX_REVS_TRAIN'],
-                            n_up=conf['N_UP'], n_down=conf['N_DOWN'])
-        show_info(win, join('.', 'messages', f'before_{block_type}_block.txt'))
-        for stim_time in adaptive:
-            csi = random.choice(conf['CSI_POSSIBLE'])
-            key_pressed, rt, stim_letter, choice, corr = run_trial(win, conf, block_type, fix_cross, csi, que, stim,
-                                                                   clock, question_frame, question_label, mask,
-                                                                   stim_time)
-            adaptive.set_corr(corr)
-            level, reversal, revs_count = map(int, adaptive.get_jump_status())
-            RESULTS.append(
-                [PART_ID, '-', trial_no, block_type, 'adaptive', csi, stim_letter, key_pressed, choice, rt, corr,
-                 stim_time, level, reversal, revs_count])
-            show_feedback(win, corr)
-
-            trial_no += 1
-        start_stim_times[block_type] = adaptive.get_curr_val()
+    for block_no, block_type in enumerate(conf['ADAPTIVE_BLOCKS'], start=1):
+        if state.is_completed('adaptive', block_no):
+            continue
+        show_info(win, assets, f'before_{block_type}_block.txt')
+        plan, adaptive = block_plan(state, schedule, 'adaptive', block_no,
+                                    adaptive=make_adaptive(conf, conf[f'START_STIM_TIME_{block_type}'], stage='TRAIN'))
+        run_block(win, conf, stims, plan, responses, key_map, frame_timer, pipeline, state, checkpoint, adaptive)
+        state.start_stim_times[block_type] = adaptive.get_curr_val()
+        finish_block(state, checkpoint)
 
     # == Experiment
-    show_info(win, join('.', 'messages', 'before_experiment.txt'))
-    exp_blocks = random.choice(conf['EXP_BLOCKS'])  # Half of participants starts wth PS and the other ones with AS
+    if not state.is_completed('intra_train', 1):
+        show_info(win, assets, 'before_experiment.txt')
+    exp_blocks = exp_blocks_order(schedule)  # Half of participants starts wth PS and the other ones with AS
     for block_no, block_type in enumerate(exp_blocks, start=1):
-        show_info(win, join('.', 'messages', f'before_{block_type}_block.txt'))
-        # -- Intra block training --
-        for _ in range(conf['INTRA_BLOCK_TRAINING']):
-            csi: int = random.choice(conf['CSI_POSSIBLE'])
-            stim_time: int = int(1.5 * start_stim_times[block_type])
-            key_pressed, rt, stim_letter, choice, corr = run_trial(win, conf, block_type, fix_cross, csi, que, stim,
-                                                                   clock, question_frame, question_label, mask,
-                                                                   stim_time)
-            RESULTS.append(
-                [PART_ID, block_no, trial_no, block_type, 'intra_train', csi, stim_letter, key_pressed, choice, rt,
-                 corr, stim_time, '-', '-', '-'])
-            show_feedback(win, corr)
-            trial_no += 1
-            # jitter after trial
-            wait_time_in_secs: float = random.choice(range(*conf['REST_TIME_RANGE'])) / conf['FRAME_RATE']
-            core.wait(wait_time_in_secs)
+        if state.is_completed('exp', block_no):
+            continue
+        show_info(win, assets, f'before_{block_type}_block.txt')
+        if not state.is_completed('intra_train', block_no):
+            # -- Intra block training --
+            stim_time: int = int(1.5 * state.start_stim_times[block_type])
+            plan, _ = block_plan(state, schedule, 'intra_train', block_no, stim_time)
+            run_block(win, conf, stims, plan, responses, key_map, frame_timer, pipeline, state, checkpoint, iti=True)
+            finish_block(state, checkpoint)
         # -- The actual experiment --
-        stim_time_adaptation = NUpNDown(start_val=start_stim_times[block_type], max_revs=conf['MAX_REVS_EXP'],
-                                        n_up=conf['N_UP'], n_down=conf['N_DOWN'])
-        for stim_time in stim_time_adaptation:
-            csi = random.choice(conf['CSI_POSSIBLE'])
-            key_pressed, rt, stim_letter, choice, corr = run_trial(win, conf, block_type, fix_cross, csi, que, stim,
-                                                                   clock, question_frame, question_label, mask,
-                                                                   stim_time)
-            stim_time_adaptation.set_corr(corr)
-            level, reversal, revs_count = map(int, stim_time_adaptation.get_jump_status())
-            RESULTS.append(
-                [PART_ID, block_no, trial_no, block_type, 'exp', csi, stim_letter, key_pressed, choice, rt, corr,
-                 stim_time, level, reversal, revs_count])
-            trial_no += 1
-            # jitter after trial
-            wait_time_in_secs: float = random.choice(range(*conf['REST_TIME_RANGE'])) / conf['FRAME_RATE']
-            core.wait(wait_time_in_secs)
-        show_image(win, join('images', 'break.jpg'), size=[SCREEN_RES['width'], SCREEN_RES['height']])
+        plan, stim_time_adaptation = block_plan(state, schedule, 'exp', block_no,
+                                                adaptive=make_adaptive(conf, state.start_stim_times[block_type],
+                                                                       stage='EXP'))
+        run_block(win, conf, stims, plan, responses, key_map, frame_timer, pipeline, state, checkpoint,
+                  stim_time_adaptation, feedback=False, iti=True)
+        finish_block(state, checkpoint)
+        show_image(win, assets, 'break.jpg')
 
     # === Cleaning time ===
-    logging.flush()
-    show_info(win, join('.', 'messages', 'end.txt'))
+    frame_timer.save_histogram(join('results', f'{session_name}_frames.csv'))
+    logging.info('DROPPED FRAMES: {}'.format(frame_timer.dropped_total()))
+    logging.info('STIMULUS CACHE: {}'.format(stims.stats()))
+    if conf['MEASURE_RESPONSE_LATENCY']:
+        logging.info('RESPONSE LATENCY: {}'.format(responses.latency_stats()))
+    responses.close()
+    pipeline.close()
+    if JOURNAL is not None:
+        JOURNAL.close()
+        JOURNAL = None
+    if GAZE is not None:
+        logging.info('GAZE SAMPLES: {}'.format(GAZE.stream.no_samples))
+        GAZE.close()
+        GAZE = None
+    sync_results()
+    os.remove(checkpoint)  # finished session can't be resumed
+    show_info(win, assets, 'end.txt')
     win.close()
+    if AGGREGATOR is not None:
+        AGGREGATOR.close()
+        logging.info('AGGREGATOR: {} batches sent, {} left in spool'.format(AGGREGATOR.no_sent,
+                                                                           AGGREGATOR.no_pending))
+        AGGREGATOR = None
+        logging.flush()
+    RESULTS.close()
 
 
-def show_feedback(win: visual.Window, corr: bool, text_color: str = 'black') -> None:
+def make_adaptive(conf: Dict, start_val: int, stage: str) -> AbstractAdaptive:
+    """
+    Adaptive procedure of stim time selected with ADAPTIVE_METHOD.
+
+    Args:
+        conf: Procedure configuration, durations in frames.
+        start_val: Initial stim time, in frames.
+        stage: 'TRAIN' for adaptive training blocks, 'EXP' for experimental ones (may stop early).
+
+    Returns:
+        NUpNDownMaxIters or Quest.
+    """
+    max_se = conf['STOP_MAX_SE'] if stage == 'EXP' else None
+    if conf['ADAPTIVE_METHOD'] == 'Quest':
+        scale = conf['FRAME_RATE'] / 60  # grids of Quest are meant for 60 Hz frames
+        max_val = int(round(60 * scale))
+        return Quest(start_val=start_val, max_trials=conf[f'QUEST_TRIALS_{stage}'], max_val=max_val,
+                     prior_sd=10 * scale, thresholds=np.arange(1, max_val + scale / 8, scale / 4),
+                     slopes=[slope * scale for slope in (0.5, 1.0, 1.5, 2.0, 3.0, 4.0, 6.0)],
+                     guess=1 / len(conf['STIM_LETTERS']), max_se=max_se)
+    elif conf['ADAPTIVE_METHOD'] == 'NUpNDown':
+        return NUpNDownMaxIters(start_val=start_val, max_revs=conf[f'MAX_REVS_{stage}'], n_up=conf['N_UP'],
+                                n_down=conf['N_DOWN'], step_up=conf['STAIR_STEP'], step_down=conf['STAIR_STEP'],
+                                min_revs=conf['STOP_MIN_REVS'], max_se=max_se,
+                                max_iters=conf[f'MAX_TRIALS_{stage}'])
+    raise ValueError('Unknown ADAPTIVE_METHOD: {}'.format(conf['ADAPTIVE_METHOD']))
+
+
+def save_trial(trial: Trial, trial_no: int, stim_time: int, outcome: Tuple, frame_timer: FrameTimer,
+               adaptive: AbstractAdaptive | None = None, gap: Tuple[float, float, float] | None = None) -> bool:
+    """
+    Append a result row of a trial just run, in every phase of a procedure.
+
+    Args:
+        trial: Planned trial.
+        trial_no: No of a trial in a session.
+        stim_time: Stimulus time it was run with, in frames.
+        outcome: Values returned by run_trial().
+        frame_timer: Frame timer that recorded the trial. Durations are converted to ms with its frame rate.
+        adaptive: Adaptive procedure that chose stim_time, if any. It's updated with the answer here.
+        gap: IdleScheduler.last_gap of idle windows before the trial, if any.
+
+    Returns:
+        Correctness of the answer.
+    """
+    key_pressed, rt, stim_letter, choice, corr, keys = outcome
+    frame_rate = frame_timer.frame_rate
+    csi = durations.to_frames(trial.csi, frame_rate)
+    record = TrialRecord(part_id=PART_ID, block_no=None if trial.trial_type == 'adaptive' else trial.block_no,
+                         trial_no=trial_no, block_type=trial.block_type, trial_type=trial.trial_type, csi=csi,
+                         csi_ms=durations.to_ms(csi, frame_rate), stim_letter=stim_letter, key_pressed=key_pressed,
+                         letter_choose=choice, rt=rt, corr=corr, stim_time=stim_time,
+                         stim_time_ms=durations.to_ms(stim_time, frame_rate), frame_rate=frame_rate)
+    if gap is not None:
+        record.idle_ms, record.idle_used_ms, record.late_work_ms = gap
+    for field, val in zip(trial_record.TIMING_FIELDS, frame_timer.trial_summary()):
+        setattr(record, field, None if val != val else val)  # nan duration is unknown
+    if GAZE is not None:
+        times, phases = frame_timer.trial_flips()
+        cue_flips = np.flatnonzero(phases == frame_timing.QUE)
+        if len(cue_flips):
+            for field, val in GAZE.annotate(times[cue_flips[0]], trial.que_side, trial.block_type).items():
+                setattr(record, field, val)
+    if adaptive is not None:
+        adaptive.set_corr(corr)
+        record.level, record.reversal, record.revs_count = map(int, adaptive.get_jump_status())
+        record.thr_est, record.thr_se = (None if val is None else round(val, 3)
+                                         for val in adaptive.get_threshold_estimate())
+    RESULTS.append(record)
+    if AGGREGATOR is not None:
+        AGGREGATOR.append(record)
+    if JOURNAL is not None:
+        times, phases = frame_timer.trial_flips()
+        JOURNAL.trial_start(trial_no, times[0], trial.trial_type, record.block_no, trial.block_type, csi,
+                            stim_letter, stim_time)
+        JOURNAL.flips(trial_no, times, phases, frame_timer.trial_work())
+        stim_onset = times[np.argmax(phases == frame_timing.STIM)]
+        for key, key_rt in keys:
+            JOURNAL.key(trial_no, stim_onset + key_rt, key, key_rt)
+        JOURNAL.response(trial_no, times[-1], key_pressed, choice, rt, corr)
+        if adaptive is not None:
+            JOURNAL.stair(trial_no, times[-1], record.level, record.reversal, record.revs_count,
+                          int(adaptive.get_curr_val()), record.thr_est, record.thr_se)
+    return corr
+
+
+def show_feedback(win: visual.Window, stims: StimulusCache, corr: bool, pipeline: IdleScheduler) -> None:
     """
 
     Args:
-        text_color: Color of a feedback letters.
         win: Current psychopy window.
+        stims: Session stimuli, with feedback messages.
         corr: Trial correctness.
+        pipeline: Runs deferred work while feedback is shown.
 
     Returns:
         Nothing.
     """
-    feedb = "Poprawnie" if corr else "Niepoprawnie"
-    feedb = visual.TextStim(win, text=feedb, height=50, color=text_color)
-    feedb.draw()
+    stims.feedback(corr).draw()
     win.flip()
-    core.wait(1)
+    pipeline.idle(1)
     win.flip()
 
 
-def run_trial(win: visual.Window, conf: dict, block_type: str, fix_cross, csi: int, que, stim, clock: core.Clock,
-              question_frame: visual.TextStim, question_label: visual.TextStim, mask, stim_time: int
-              ) -> Tuple[str | Any, float | Any, Any, str | Any, bool]:
-    global LAST_STIM
-    que_pos = random.choice([-conf['STIM_SHIFT'], conf['STIM_SHIFT']])  # Que on left or right side of a screen
-    if block_type == 'AS':  # stim and mask on the opposite side of que
-        stim.pos = [-que_pos, 0]
-        mask.pos = [-que_pos, 0]
-    elif block_type == 'PS':  # stim, mask and que on this same side of a screen
-        stim.pos = [que_pos, 0]
-        mask.pos = [que_pos, 0]
-    else:
-        raise ValueError('Only prosaccadic and antysaccadic trials suported.')
-
-    stim.text = random.choice(conf['STIM_LETTERS'].replace(LAST_STIM, ''))
-    LAST_STIM = stim.text
-
-    for _ in range(conf['FIX_CROSS_TIME']):
-        fix_cross.draw()
-        win.flip()
+def prepare_trial(win: visual.Window, conf: dict, stims: StimulusCache, responses: ResponseCollector, trial: Trial,
+                  stim_time: int) -> timeline.Timeline:
+    """
+    Everything a trial needs before its first frame, done ahead of time.
 
-    for _ in range(csi):
-        win.flip()
+    Args:
+        win: Current psychopy window.
+        conf: Procedure config.
+        stims: Session stimuli.
+        responses: Response collector, used by timeline actions.
+        trial: Planned trial.
+        stim_time: Stimulus time, in frames.
 
-    for _ in range(conf['QUE_FREQ']):  # que is not static, it is blinking and moving on a screen
-        if _ % 2 == 0:
-            que.pos = [que_pos + conf['QUE_SHIFT'], 0]
-        else:
-            que.pos = [que_pos - conf['QUE_SHIFT'], 0]
-        for _ in range(conf['QUE_SPEED']):
-            que.draw()
-            win.flip()
+    Returns:
+        Compiled trial timeline.
+    """
+    que_pos = trial.que_side * conf['STIM_SHIFT']  # Que on left or right side of a screen
+    if trial.block_type == 'AS':  # stim and mask on the opposite side of que
+        stim_pos = -que_pos
+    elif trial.block_type == 'PS':  # stim, mask and que on this same side of a screen
+        stim_pos = que_pos
+    else:
+        raise ValueError('Only prosaccadic and antysaccadic trials suported.')
 
-    win.callOnFlip(clock.reset)
-    event.clearEvents()
+    ctx = timeline.TrialContext(win, conf, stims, responses, que_pos, stim_pos, trial.letter,
+                                conf['MASK_IMAGES'][trial.mask])
+    csi = durations.to_frames(trial.csi, conf['FRAME_RATE'])  # schedule is in ms
+    return timeline.compile_trial(conf['TRIAL_TIMELINE'], ctx, dict(csi=csi, stim_time=stim_time))
 
-    for _ in range(stim_time):
-        stim.draw()
-        win.flip()
 
-    reaction: List = []  # Prev errors from zero iterations of a loop below
-    for _ in range(conf['MASK_TIME']):
-        reaction = event.getKeys(keyList=list(conf['REACTION_KEYS']), timeStamped=clock)
-        if reaction:
-            break
-        mask.draw()
-        win.flip()
+def run_trial(win: visual.Window, conf: dict, stims: StimulusCache, trial: Trial, trial_timeline: timeline.Timeline,
+              responses: ResponseCollector, key_map: Dict[str, str], frame_timer: FrameTimer
+              ) -> Tuple[str | Any, float | Any, Any, str | Any, bool, List[Tuple[str, float]]]:
+    stim_letter = trial.letter
+    frame_timer.start_trial()
+    reaction: List = trial_timeline.run(frame_timer, responses.get_keys)
 
     if not reaction:
-        question_frame.draw()
-        question_label.draw()
-        win.flip()
-        reaction = event.waitKeys(keyList=list(conf['REACTION_KEYS']), maxWait=conf['REACTION_TIME'] / 60,
-                                  timeStamped=clock)
+        stims.question_frame.draw()
+        stims.question_label.draw()
+        frame_timer.flip(frame_timing.RESP)
+        reaction = responses.wait_keys(max_wait=conf['REACTION_TIME'] / 1000)
     if reaction:
         key_pressed, rt = reaction[0]
-        choice = dict(zip(conf['REACTION_KEYS'], conf['STIM_LETTERS']))[key_pressed]
-        corr = stim.text == choice
+        choice = key_map[key_pressed]
+        corr = stim_letter == choice
     else:
         key_pressed = 'no_key'
         rt = -1.0
         corr = False
         choice = 'no_letter'
-    win.flip()
+    frame_timer.flip(frame_timing.RESP)
+    for frame, phase, work_ms in frame_timer.overruns():
+        logging.warning('Frame overrun: trial frame {} ({}), {} ms of work'.format(frame, phase, work_ms))
 
-    return key_pressed, rt, stim.text, choice, corr
+    return key_pressed, rt, stim_letter, choice, corr, reaction or []
 
 
-if __name__ == '__main__':
+def block_plan(state: SessionState, schedule: np.ndarray, trial_type: str, block_no: int, stim_time: int = None,
+               adaptive: AbstractAdaptive | None = None) -> Tuple[Iterator[Tuple[Trial, int]], AbstractAdaptive | None]:
+    """
+    Trials of a block still to be run. A block interrupted in a resumed session continues where it stopped.
+
+    Args:
+        state: Session state.
+        schedule: Session schedule.
+        trial_type: Trial type of a block.
+        block_no: No of a block within its trial type.
+        stim_time: Stim time of every trial, for blocks without adaptive procedure.
+        adaptive: Fresh adaptive procedure choosing stim times.
+
+    Returns:
+        (trial, stim time) pairs, for run_block(), and adaptive procedure, restored from a checkpoint if resumed.
+    """
+    done, adaptive = state.start_block(trial_type, block_no, adaptive)
+    trials = block_trials(schedule, trial_type, block_no)
+
+    def plan() -> Iterator[Tuple[Trial, int]]:
+        # staircase may outlive its pool of trials
+        stim_times = enumerate(adaptive, start=done) if adaptive is not None else \
+            ((idx, stim_time) for idx in range(done, len(trials)))
+        for idx, val in stim_times:
+            trial = shown_trial(trials, idx, state.last_letter)  # no letter repeats across blocks either
+            state.last_letter = trial.letter
+            yield trial, val
+
+    return plan(), adaptive
+
+
+def finish_block(state: SessionState, checkpoint: str) -> None:
+    """
+    Mark the current block completed in a checkpoint and sync results.
+
+    Args:
+        state: Session state.
+        checkpoint: Checkpoint file.
+
+    Returns:
+        None.
+    """
+    state.end_block()
+    save_checkpoint(checkpoint, state)
+    sync_results()
+
+
+def run_block(win: visual.Window, conf: dict, stims: StimulusCache, plan: Iterator[Tuple[Trial, int]],
+              responses: ResponseCollector, key_map: Dict[str, str], frame_timer: FrameTimer, pipeline: IdleScheduler,
+              state: SessionState, checkpoint: str, adaptive: AbstractAdaptive | None = None, feedback: bool = True,
+              iti: bool = False) -> None:
+    """
+    Run trials of one block. Saving a trial, a checkpoint and preparing the next trial are deferred to feedback
+    and jitter windows.
+
+    Args:
+        win: Current psychopy window.
+        conf: Procedure config, durations in frames.
+        stims: Session stimuli.
+        plan: (trial, stim time) pairs. Pulled only after the previous answer was saved, as a staircase needs it.
+        responses: Response collector.
+        key_map: Reaction key -> letter.
+        frame_timer: Frame timer.
+        pipeline: Idle scheduler of a session.
+        state: Session state, numbers trials and is checkpointed after every one.
+        checkpoint: Checkpoint file.
+        adaptive: Adaptive procedure behind the plan, if any. It's updated with every answer.
+        feedback: Show feedback after every trial.
+        iti: Wait a jitter of a trial after it.
+
+    Returns:
+        None.
+    """
+    upcoming = None
+
+    def prepare_next() -> None:
+        nonlocal upcoming
+        upcoming = next(plan, None)
+        if upcoming is not None:
+            upcoming += (prepare_trial(win, conf, stims, responses, *upcoming),)
+
+    pipeline.defer(prepare_next)
+    while True:
+        pipeline.drain()  # fixation starts with nothing pending
+        if upcoming is None:
+            return
+        trial, stim_time, trial_timeline = upcoming
+        outcome = run_trial(win, conf, stims, trial, trial_timeline, responses, key_map, frame_timer)
+        pipeline.defer(save_trial, trial, state.trial_no, stim_time, outcome, frame_timer, adaptive, pipeline.last_gap)
+        pipeline.defer(state.trial_done, state.trial_no)
+        pipeline.defer(save_checkpoint, checkpoint, state)  # before the next value is drawn from adaptive
+        pipeline.defer(logging.flush)
+        pipeline.defer(prepare_next)
+        if feedback:
+            show_feedback(win, stims, outcome[4], pipeline)
+        if iti:
+            pipeline.idle(trial.jitter / 1000)
+
+
+def run(session_backend=None) -> None:
+    """
+    Run a whole procedure on a given backend.
+
+    Args:
+        session_backend: Display/input backend, see misc.backend. Real psychopy one if None.
+
+    Returns:
+        None.
+    """
+    global PART_ID, SCREEN_RES
+    if session_backend is not None:
+        backend.use(session_backend)
     PART_ID = ''
-    SCREEN_RES = get_screen_res()
+    SCREEN_RES = backend.screen_res()
     main()
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--headless', action='store_true',
+                        help='Run without display, keyboard and dialogs, on a simulated participant.')
+    parser.add_argument('--real-time', action='store_true',
+                        help='Headless only. Use wall clock instead of virtual one; flips still do not wait.')
+    parser.add_argument('--frame-rate', type=int, default=60, help='Headless only. Simulated frame rate.')
+    parser.add_argument('--threshold', type=float, default=166.7,
+                        help='Headless only. Stimulus time (in ms) at the middle of participant psychometric '
+                             'function.')
+    parser.add_argument('--part-id', default='headless', help='Headless only. Participant identifier.')
+    parser.add_argument('--resume', action='store_true', help='Headless only. Resume an interrupted session.')
+    args = parser.parse_args()
+    if args.headless:
+        from misc.headless import HeadlessBackend, SimulatedParticipant
+        from misc.observer import PsychometricObserver
+
+        conf = yaml.load(open('config.yaml', encoding='utf-8'), Loader=yaml.SafeLoader)
+        observer = PsychometricObserver(threshold=args.threshold * args.frame_rate / 1000,  # in frames
+                                        slope=2.0 * args.frame_rate / 60)
+        participant = SimulatedParticipant(dict(zip(conf['STIM_LETTERS'], conf['REACTION_KEYS'])), observer=observer)
+        run(HeadlessBackend(participant, frame_rate=args.frame_rate, virtual_clock=not args.real_time,
+                            part_id=args.part_id, resume=args.resume))
+    else:
+        run()
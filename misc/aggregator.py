@@ -0,0 +1,284 @@
+"""
+Collecting results of many stations in one place: an asyncio aggregation server and a client sink.
+
+    python -m misc.aggregator serve --port 5555 --db aggregate.sqlite
+    python -m misc.aggregator export --db aggregate.sqlite --out aggregated
+
+Stations with AGGREGATOR (host:port) in config.yaml send rows of every block
+as one batch, a line of JSON. The server stores rows in SQLite, ignoring
+ones it already has (same PART_ID and Trial_no), and acks a batch after
+commit. The sink spools every batch to results/spool before sending and
+removes it only on ack, so batches survive disconnects, server restarts and
+crashes of a station, and are sent again later, also by next sessions.
+Everything network related is done on a sink thread, a procedure never waits.
+
+export writes one <session>_beh.csv per session, ready for misc.ingest.
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import csv
+import glob
+import json
+import os
+import queue
+import socket
+import sqlite3
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from os.path import join, basename
+from typing import List, Optional, Tuple
+
+from misc.trial_record import COLUMNS, FIELDS, HEADER, MISSING_CSV, TrialRecord
+
+_BATCH, _CLOSE = range(2)
+_SQL_TYPES = {'?': 'INTEGER', 'i': 'INTEGER', 'f': 'REAL', 'U': 'TEXT'}
+
+
+def parse_address(address: str) -> Tuple[str, int]:
+    """
+    Args:
+        address: host:port
+
+    Returns:
+        (host, port)
+    """
+    host, _, port = address.rpartition(':')
+    return host or 'localhost', int(port)
+
+
+class AggregatorSink(object):
+    """
+    Client side. Rows appended during a block are sent as one batch on send(), by a background thread.
+    """
+
+    def __init__(self, address: str, station: str, session: str, spool_dir: str, retry: float = 2.0,
+                 timeout: float = 5.0):
+        """
+        Args:
+            address: host:port of an aggregation server.
+            station: Name of this station, stored with its rows.
+            session: Session name, stored with its rows.
+            spool_dir: Directory of batches not acked yet.
+            retry: Interval of reconnection attempts while some batches are waiting, in seconds.
+            timeout: Max wait for a connection or an ack, in seconds.
+        """
+        self.address = parse_address(address)
+        self.station = station
+        self.session = session
+        self.spool_dir = spool_dir
+        self.retry = retry
+        self.timeout = timeout
+        self.no_sent = 0  # Batches acked by a server
+        self.no_pending = 0  # Batches still waiting in a spool
+        os.makedirs(spool_dir, exist_ok=True)
+        self._rows: List[TrialRecord] = list()
+        self._no_batches = 0
+        self._queue: queue.Queue = queue.Queue()
+        self._sock: Optional[socket.socket] = None
+        self._thread = threading.Thread(target=self._run, name='AggregatorSink', daemon=True)
+        self._thread.start()
+
+    def append(self, record: TrialRecord) -> None:
+        """
+        Add a row to the current batch. Never blocks.
+
+        Args:
+            record: Trial record, not changed afterwards.
+        """
+        self._rows.append(record)
+
+    def send(self) -> None:
+        """
+        Schedule sending of rows appended since last call, as one batch. Never blocks.
+        """
+        if self._rows:
+            self._no_batches += 1
+            self._queue.put((_BATCH, (self._no_batches, self._rows)))
+            self._rows = list()
+
+    def close(self, wait: float = 2.0) -> None:
+        """
+        Send remaining rows and stop. Batches not acked within wait stay spooled for a next session.
+
+        Args:
+            wait: Max time of a last sending attempt, in seconds.
+        """
+        if not self._thread.is_alive():
+            return
+        self.send()
+        self._queue.put((_CLOSE, wait))
+        self._thread.join()
+
+    def _spool(self, batch_no: int, records: List[TrialRecord]) -> str:
+        batch_id = '{}_{:04d}'.format(self.session, batch_no)
+        rows = [[getattr(record, field) for field in FIELDS] for record in records]
+        msg = dict(batch=batch_id, station=self.station, session=self.session, header=HEADER, rows=rows)
+        path = join(self.spool_dir, batch_id + '.json')
+        with open(path + '.tmp', 'w', encoding='utf-8') as spool_file:
+            spool_file.write(json.dumps(msg, default=lambda val: val.item()) + '\n')  # numpy scalars
+            spool_file.flush()
+            os.fsync(spool_file.fileno())
+        os.replace(path + '.tmp', path)
+        return path
+
+    def _send_pending(self, pending: List[str], timeout: float) -> List[str]:
+        try:
+            for path in list(pending):
+                try:
+                    with open(path, 'rb') as spool_file:
+                        batch = spool_file.read()
+                except FileNotFoundError:  # Already sent by another session sharing a spool
+                    pending.remove(path)
+                    continue
+                if self._sock is None:
+                    self._sock = socket.create_connection(self.address, timeout=timeout)
+                    self._reader = self._sock.makefile('rb')
+                self._sock.sendall(batch)
+                ack = json.loads(self._reader.readline())
+                if ack.get('ack') != basename(path)[:-len('.json')]:
+                    raise ValueError('Unexpected reply: {}'.format(ack))
+                pending.remove(path)
+                self.no_sent += 1
+                try:
+                    os.remove(path)
+                except FileNotFoundError:
+                    pass
+        except (OSError, ValueError):  # Server unreachable, disconnected or confused, retried later
+            if self._sock is not None:
+                self._sock.close()
+                self._sock = None
+        self.no_pending = len(pending)
+        return pending
+
+    def _run(self) -> None:
+        pending = sorted(glob.glob(join(self.spool_dir, '*.json')))  # Also left by earlier sessions
+        while True:
+            try:
+                kind, payload = self._queue.get(timeout=self.retry if pending else None)
+            except queue.Empty:
+                kind, payload = None, None
+            if kind == _BATCH:
+                pending.append(self._spool(*payload))
+            elif kind == _CLOSE:
+                self._send_pending(pending, timeout=payload)
+                break
+            pending = self._send_pending(pending, timeout=self.timeout)
+        if self._sock is not None:
+            self._sock.close()
+
+
+class AggregatorServer(object):
+    """
+    Server side. Every connection is one station, sending batches and waiting for acks.
+    Batches are stored by a single writer thread, off the event loop.
+    """
+
+    def __init__(self, db_path: str):
+        """
+        Args:
+            db_path: SQLite file with results, created if needed.
+        """
+        # Inserts and commits (WAL fsyncs) run on one writer thread, the event loop keeps serving other stations
+        self._writer = ThreadPoolExecutor(max_workers=1, thread_name_prefix='AggregatorWriter')
+        self.db = sqlite3.connect(db_path, check_same_thread=False)  # used by the writer thread only after init
+        self.db.execute('PRAGMA journal_mode=WAL')
+        columns = ', '.join('"{}" {}'.format(column, _SQL_TYPES[dtype[0]]) for column, _, dtype, _ in COLUMNS)
+        self.db.execute('CREATE TABLE IF NOT EXISTS results (station TEXT, session TEXT, {}, '
+                        'PRIMARY KEY ("PART_ID", "Trial_no"))'.format(columns))
+        self.db.commit()
+        self.no_rows = 0
+
+    def store(self, msg: dict) -> int:
+        """
+        Args:
+            msg: Batch sent by AggregatorSink.
+
+        Returns:
+            No of new rows.
+        """
+        header = [column for column in msg['header'] if column in HEADER]  # Columns of other versions are dropped
+        idx = [msg['header'].index(column) for column in header]
+        sql = 'INSERT OR IGNORE INTO results (station, session, {}) VALUES ({})'.format(
+            ', '.join('"{}"'.format(column) for column in header), ', '.join('?' * (len(header) + 2)))
+        before = self.db.total_changes
+        self.db.executemany(sql, ([msg['station'], msg['session']] + [row[i] for i in idx] for row in msg['rows']))
+        self.db.commit()
+        new = self.db.total_changes - before
+        self.no_rows += new
+        return new
+
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+        peer = writer.get_extra_info('peername')
+        print('Connected: {}'.format(peer))
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                msg = json.loads(line)
+                # Stored on the writer thread, acked only after its commit
+                new = await asyncio.get_running_loop().run_in_executor(self._writer, self.store, msg)
+                print('{} batch {}: {} rows, {} new'.format(msg['station'], msg['batch'], len(msg['rows']), new))
+                writer.write(json.dumps(dict(ack=msg['batch'], new=new)).encode() + b'\n')
+                await writer.drain()
+        except (ConnectionError, ValueError, KeyError, sqlite3.Error) as err:
+            print('Dropped {}: {!r}'.format(peer, err))  # Station sends a batch again on a next connection
+        finally:
+            writer.close()
+        print('Disconnected: {}'.format(peer))
+
+    async def serve(self, host: str, port: int) -> None:
+        server = await asyncio.start_server(self.handle, host, port, limit=2 ** 24)  # Batch is one long line
+        print('Listening on {}'.format(', '.join(str(sock.getsockname()) for sock in server.sockets)))
+        async with server:
+            await server.serve_forever()
+
+
+def export(db_path: str, out_dir: str) -> List[str]:
+    """
+    Args:
+        db_path: SQLite file of a server.
+        out_dir: Directory for CSV files.
+
+    Returns:
+        Paths of written files, one per session.
+    """
+    os.makedirs(out_dir, exist_ok=True)
+    db = sqlite3.connect(db_path)
+    columns = ', '.join('"{}"'.format(column) for column in HEADER)
+    flags = [dtype == '?' for _, _, dtype, _ in COLUMNS]  # SQLite keeps booleans as integers
+    paths = list()
+    for session, in db.execute('SELECT DISTINCT session FROM results ORDER BY session').fetchall():
+        path = join(out_dir, '{}_beh.csv'.format(session))
+        with open(path, 'w', encoding='utf-8', newline='') as beh_file:
+            writer = csv.writer(beh_file)
+            writer.writerow(HEADER)
+            for row in db.execute('SELECT {} FROM results WHERE session = ? ORDER BY "Trial_no"'.format(columns),
+                                  (session,)):
+                writer.writerow(MISSING_CSV if val is None else bool(val) if flag else val
+                                for val, flag in zip(row, flags))
+        paths.append(path)
+    db.close()
+    return paths
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Aggregation of results of many stations.')
+    commands = parser.add_subparsers(dest='command', required=True)
+    serve_cmd = commands.add_parser('serve', help='Run aggregation server.')
+    serve_cmd.add_argument('--host', default='0.0.0.0')
+    serve_cmd.add_argument('--port', type=int, default=5555)
+    serve_cmd.add_argument('--db', default='aggregate.sqlite')
+    export_cmd = commands.add_parser('export', help='Write stored results as one CSV per session.')
+    export_cmd.add_argument('--db', default='aggregate.sqlite')
+    export_cmd.add_argument('--out', default='aggregated')
+    args = parser.parse_args()
+    if args.command == 'serve':
+        try:
+            asyncio.run(AggregatorServer(args.db).serve(args.host, args.port))
+        except KeyboardInterrupt:
+            pass
+    else:
+        print('\n'.join(export(args.db, args.out)))
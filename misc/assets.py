@@ -0,0 +1,110 @@
+"""
+Messages and images loaded once at startup and served from memory for the rest of a session.
+"""
+from __future__ import annotations
+
+import codecs
+import glob
+import time
+from os.path import join, basename
+from typing import Any, Dict, List, Tuple
+
+from misc import backend
+from misc.backend import visual, logging
+
+INSERT_MARK = '<--insert-->'
+IMAGE_EXTENSIONS = ('*.png', '*.jpg', '*.jpeg', '*.bmp')
+
+
+def read_message(file_name: str) -> List[str]:
+    """
+    Read message from text file, skipping commented lines.
+
+    Args:
+        file_name: Name of a file to read.
+
+    Returns:
+        Parts of a message between <--insert--> marks. Joining them with an
+        insert gives a message with dynamically generated info.
+    """
+    parts = ['']
+    with codecs.open(file_name, encoding='utf-8', mode='r') as data_file:
+        for line in data_file:
+            if not line.startswith('#'):  # if not commented line
+                if line.startswith(INSERT_MARK):
+                    parts.append('')
+                else:
+                    parts[-1] += line
+    return parts
+
+
+class AssetManager(object):
+    """
+    Pre-renders every message from messages/ and every image from images/.
+
+    Messages with an <--insert--> mark are rendered without an insert up front,
+    versions with an insert are rendered on first request and kept.
+    Images are decoded once; the raw decoded images are also available for
+    other stimuli, e.g. masks.
+    """
+
+    def __init__(self, win: visual.Window, screen_res: Dict[str, int], messages_dir: str = 'messages',
+                 images_dir: str = 'images'):
+        """
+        Args:
+            win: Procedure main window.
+            screen_res: Dict with screen width and height, used for text wrapping and full screen images.
+            messages_dir: Directory with *.txt messages.
+            images_dir: Directory with images.
+        """
+        self.win = win
+        self.screen_res = screen_res
+        start = time.perf_counter()
+        self._messages: Dict[str, List[str]] = {basename(path): read_message(path)
+                                                for path in sorted(glob.glob(join(messages_dir, '*.txt')))}
+        self.images: Dict[str, Any] = dict()
+        for pattern in IMAGE_EXTENSIONS:
+            for path in sorted(glob.glob(join(images_dir, pattern))):
+                self.images[basename(path)] = backend.load_image(path)
+        self._texts: Dict[Tuple[str, str], visual.TextStim] = {(name, ''): self._render_message(name, '')
+                                                               for name in self._messages}
+        self._image_stims: Dict[str, visual.ImageStim] = dict()
+        for name in self.images:
+            if not name.startswith('mask'):  # masks are small stimuli, see StimulusCache
+                self.image(name)
+        self.load_time = time.perf_counter() - start
+        logging.info('ASSETS: {} messages, {} images loaded in {:.0f} ms'.format(
+            len(self._messages), len(self.images), self.load_time * 1000))
+
+    def message(self, name: str, insert: str = '') -> visual.TextStim:
+        """
+        Args:
+            name: File name of a message, e.g. 'hello.txt'.
+            insert: Optional msg to add into message.
+
+        Returns:
+            Ready to draw message.
+        """
+        stim = self._texts.get((name, insert))
+        if stim is None:
+            stim = self._texts[(name, insert)] = self._render_message(name, insert)
+        return stim
+
+    def image(self, name: str) -> visual.ImageStim:
+        """
+        Args:
+            name: File name of an image, e.g. 'break.jpg'.
+
+        Returns:
+            Ready to draw full screen image.
+        """
+        stim = self._image_stims.get(name)
+        if stim is None:
+            stim = self._image_stims[name] = visual.ImageStim(win=self.win, image=self.images[name], interpolate=True,
+                                                              size=[self.screen_res['width'],
+                                                                    self.screen_res['height']])
+        return stim
+
+    def _render_message(self, name: str, insert: str) -> visual.TextStim:
+        msg = insert.join(self._messages[name])
+        return visual.TextStim(self.win, color='black', text=msg, height=20, wrapWidth=self.screen_res['width'])
@@ -0,0 +1,128 @@
+"""
+Pluggable display/input backend.
+
+Procedure code imports psychopy-like namespaces from here:
+
+    from misc.backend import visual, event, logging, gui, core
+
+Each of them forwards attribute access to the backend selected with use().
+When no backend was selected, the real psychopy one is used.
+"""
+from __future__ import annotations
+
+from collections import OrderedDict
+from typing import Any
+
+
+class PsychopyBackend(object):
+    """
+    Real display, keyboard and dialogs, i.e. plain psychopy.
+    """
+
+    def __init__(self):
+        from psychopy import visual, event, logging, gui, core
+
+        self.visual, self.event, self.logging, self.gui, self.core = visual, event, logging, gui, core
+
+    def screen_res(self) -> OrderedDict:
+        from misc.screen_misc import get_screen_res
+
+        return get_screen_res()
+
+    def frame_rate(self, win) -> int:
+        from misc.screen_misc import get_frame_rate
+
+        return get_frame_rate(win)
+
+    def responses(self, key_list, measure: bool = False):
+        from misc.responses import ResponseCollector
+
+        return ResponseCollector(key_list, measure=measure)
+
+    def load_image(self, path: str) -> Any:
+        from PIL import Image
+
+        image = Image.open(path)
+        image.load()  # decode now, not on first use
+        return image
+
+
+_current = None
+
+
+def use(backend) -> None:
+    """
+    Select backend for the rest of a process.
+
+    Args:
+        backend: PsychopyBackend, misc.headless.HeadlessBackend or any object with the same API.
+    """
+    global _current
+    _current = backend
+
+
+def current():
+    """
+    Returns:
+        Selected backend, psychopy one if nothing was selected.
+    """
+    if _current is None:
+        use(PsychopyBackend())
+    return _current
+
+
+def screen_res() -> OrderedDict:
+    """
+    Returns:
+        OrderedDict with width and height of a screen, in pixels.
+    """
+    return current().screen_res()
+
+
+def frame_rate(win) -> int:
+    """
+    Args:
+        win: Procedure main window.
+
+    Returns:
+        Frame rate of a window, in frames per second.
+    """
+    return current().frame_rate(win)
+
+
+def responses(key_list, measure: bool = False):
+    """
+    Args:
+        key_list: Reaction keys.
+        measure: Record latency of reading key presses.
+
+    Returns:
+        Response collector with API of misc.responses.ResponseCollector.
+    """
+    return current().responses(key_list, measure=measure)
+
+
+def load_image(path: str) -> Any:
+    """
+    Args:
+        path: Path of image file.
+
+    Returns:
+        Decoded image, accepted as ImageStim image by a current backend.
+    """
+    return current().load_image(path)
+
+
+class _Namespace(object):
+    def __init__(self, name: str):
+        self._name = name
+
+    def __getattr__(self, item: str) -> Any:
+        return getattr(getattr(current(), self._name), item)
+
+
+visual = _Namespace('visual')
+event = _Namespace('event')
+logging = _Namespace('logging')
+gui = _Namespace('gui')
+core = _Namespace('core')
@@ -0,0 +1,221 @@
+"""
+Benchmarks of procedure overheads, runnable without a display.
+
+    python -m misc.benchmark --out bench.json
+    python -m misc.benchmark --baseline bench.json --tolerance 0.25
+
+Measures Python time per frame of every trial phase (on a headless backend
+without vsync, so an interval between flips is pure Python work), staircase
+steps per second, results writing throughput and startup time of main.py.
+With --baseline, exits with status 1 if any metric is worse than baseline
+by more than a tolerance.
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+from os.path import join, dirname, abspath
+from typing import Callable, Dict
+
+import numpy as np
+import yaml
+
+from Adaptives.NUpNDown import NUpNDown
+from Adaptives.NUpNDownBatch import NUpNDownBatch
+from misc import backend, durations, frame_timing, trial_record
+from misc.headless import HeadlessBackend, SimulatedParticipant
+from misc.results_writer import ResultsWriter
+from misc.trial_record import RECORD_DTYPE, TrialRecord
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+
+def _metric(value: float, unit: str, higher_is_better: bool) -> dict:
+    return dict(value=value, unit=unit, higher_is_better=higher_is_better)
+
+
+def _best_of(repeats: int, fun: Callable[[], float]) -> float:
+    return min(fun() for _ in range(repeats))
+
+
+def bench_trial_phases(conf: dict, no_trials: int = 200) -> Dict[str, dict]:
+    """
+    Python time per frame of every trial phase, in microseconds.
+    """
+    import main
+
+    participant = SimulatedParticipant(dict(zip(conf['STIM_LETTERS'], conf['REACTION_KEYS'])),
+                                       rng=np.random.default_rng(0))
+    backend.use(HeadlessBackend(participant, frame_rate=conf['FRAME_RATE'], virtual_clock=False))
+    from misc.assets import AssetManager
+    from misc.frame_timing import FrameTimer
+    from misc.schedule import build_schedule, block_trials
+    from misc.stim_cache import StimulusCache
+
+    win = backend.visual.Window()
+    backend.event.Mouse(win=win)
+    assets = AssetManager(win, backend.screen_res(), messages_dir=join(ROOT, 'messages'),
+                          images_dir=join(ROOT, 'images'))
+    stims = StimulusCache(win, conf, assets)
+    frame_timer = FrameTimer(win, conf['FRAME_RATE'], budget=conf['FRAME_BUDGET'])
+    responses = backend.responses(conf['REACTION_KEYS'])
+    key_map = dict(zip(conf['REACTION_KEYS'], conf['STIM_LETTERS']))
+    trials = block_trials(build_schedule(conf, seed=0), 'exp', 1)
+
+    sums = np.zeros(len(frame_timing.PHASES))
+    counts = np.zeros(len(frame_timing.PHASES))
+    for idx in range(no_trials):
+        trial = trials[idx % len(trials)]
+        trial_timeline = main.prepare_trial(win, conf, stims, responses, trial, 10)
+        main.run_trial(win, conf, stims, trial, trial_timeline, responses, key_map, frame_timer)
+        times, phases = frame_timer.trial_flips()
+        np.add.at(sums, phases[:-1], np.diff(times))
+        np.add.at(counts, phases[:-1], 1)
+    return {'frame_us_{}'.format(frame_timing.PHASES[phase]): _metric(sums[phase] / counts[phase] * 1e6, 'us', False)
+            for phase in frame_timing.TIMED_PHASES if counts[phase]}
+
+
+def bench_staircase(steps: int = 200000, batch_size: int = 100000, batch_steps: int = 100) -> Dict[str, dict]:
+    """
+    Steps per second of NUpNDown and NUpNDownBatch (counted per staircase).
+    """
+    corr = (np.random.default_rng(0).random(steps) < 0.7).tolist()
+
+    def scalar() -> float:
+        adaptive = NUpNDown(n_up=2, n_down=1, max_revs=10 ** 9, start_val=10 ** 6)
+        start = time.perf_counter()
+        for answer, _ in zip(corr, adaptive):
+            adaptive.set_corr(answer)
+        return time.perf_counter() - start
+
+    batch_corr = np.random.default_rng(0).random((batch_steps, batch_size)) < 0.7
+
+    def batch() -> float:
+        adaptive = NUpNDownBatch(batch_size, n_up=2, n_down=1, max_revs=10 ** 9, start_val=10 ** 6)
+        start = time.perf_counter()
+        for answers, _ in zip(batch_corr, adaptive):
+            adaptive.set_corr(answers)
+        return time.perf_counter() - start
+
+    return dict(staircase_steps_per_s=_metric(steps / _best_of(3, scalar), 'steps/s', True),
+                batch_staircase_steps_per_s=_metric(batch_size * batch_steps / _best_of(3, batch), 'steps/s', True))
+
+
+def bench_results_writer(no_rows: int = 20000) -> Dict[str, dict]:
+    """
+    Trial records per second written as CSV and binary (and fsynced on close) by ResultsWriter,
+    and cost of creating and appending a record on the procedure side.
+    """
+    fields = dict(part_id='PART01M20', block_no=1, trial_no=1, block_type='PS', trial_type='exp', csi=33,
+                  csi_ms=550.0, stim_letter='x', key_pressed='left', letter_choose='x', rt=0.53421, corr=True,
+                  stim_time=12, stim_time_ms=200.0, frame_rate=60, level=1, reversal=0, revs_count=3,
+                  thr_est=11.5, thr_se=0.42, stim_dur_ms=200.1, dropped_fix=0, dropped_csi=0, dropped_que=0,
+                  dropped_stim=0, dropped_mask=0, overrun_frames=0)
+    append_times = list()
+
+    def write() -> float:
+        with tempfile.TemporaryDirectory() as tmp:
+            start = time.perf_counter()
+            writer = ResultsWriter(join(tmp, 'beh.csv'), trial_record.HEADER, binary_path=join(tmp, 'beh.bin'))
+            for _ in range(no_rows):
+                writer.append(TrialRecord(**fields))
+            append_times.append(time.perf_counter() - start)
+            writer.close()  # Raises if a writer failed, its rows/s would be meaningless
+            elapsed = time.perf_counter() - start
+            assert os.path.getsize(join(tmp, 'beh.bin')) == no_rows * RECORD_DTYPE.itemsize, 'Rows not written'
+            return elapsed
+
+    best = _best_of(3, write)
+    return dict(results_rows_per_s=_metric(no_rows / best, 'rows/s', True),
+                results_append_us=_metric(min(append_times) / no_rows * 1e6, 'us', False))
+
+
+def bench_startup() -> Dict[str, dict]:
+    """
+    Wall time of importing main.py and of a whole headless session, both in fresh interpreters.
+    """
+    env = dict(os.environ, PYTHONPATH=ROOT)
+    with tempfile.TemporaryDirectory() as tmp:
+        for name in ('messages', 'images'):
+            shutil.copytree(join(ROOT, name), join(tmp, name))
+        shutil.copy(join(ROOT, 'config.yaml'), tmp)
+
+        def run(*args: str) -> float:
+            start = time.perf_counter()
+            subprocess.run([sys.executable, *args], cwd=tmp, env=env, check=True, stdout=subprocess.DEVNULL)
+            return time.perf_counter() - start
+
+        return dict(import_main_s=_metric(_best_of(3, lambda: run('-c', 'import main')), 's', False),
+                    headless_session_s=_metric(_best_of(3, lambda: run(join(ROOT, 'main.py'), '--headless')), 's',
+                                               False))
+
+
+def compare(metrics: Dict[str, dict], baseline: Dict[str, dict], tolerance: float) -> list:
+    """
+    Args:
+        metrics: Current results.
+        baseline: Stored results.
+        tolerance: Allowed relative worsening, e.g. 0.25 for 25 %.
+
+    Returns:
+        List of (name, baseline value, current value, relative change) of regressed metrics.
+    """
+    regressions = list()
+    for name, base in baseline.items():
+        if name not in metrics:
+            continue
+        current = metrics[name]['value']
+        change = (current - base['value']) / base['value']
+        worse = -change if base['higher_is_better'] else change
+        if worse > tolerance:
+            regressions.append((name, base['value'], current, change))
+    return regressions
+
+
+def main() -> int:
+    parser = argparse.ArgumentParser(description='Benchmarks of procedure overheads.')
+    parser.add_argument('--out', help='Write results as JSON to this file.')
+    parser.add_argument('--baseline', help='JSON file from previous run to compare against.')
+    parser.add_argument('--tolerance', type=float, default=0.25, help='Allowed relative worsening of a metric.')
+    parser.add_argument('--skip-startup', action='store_true', help='Skip benchmarks spawning new interpreters.')
+    args = parser.parse_args()
+
+    conf = yaml.load(open(join(ROOT, 'config.yaml'), encoding='utf-8'), Loader=yaml.SafeLoader)
+    metrics = dict()
+    metrics.update(bench_trial_phases(durations.frames_config(conf, conf['FRAME_RATES'][0])))
+    metrics.update(bench_staircase())
+    metrics.update(bench_results_writer())
+    if not args.skip_startup:
+        metrics.update(bench_startup())
+
+    report = dict(meta=dict(date=datetime.now().isoformat(timespec='seconds'), python=platform.python_version(),
+                            machine=platform.node(), numpy=np.__version__),
+                  metrics=metrics)
+    for name, metric in metrics.items():
+        print('{:<32}{:>16.3f} {}'.format(name, metric['value'], metric['unit']))
+    if args.out:
+        with open(args.out, 'w', encoding='utf-8') as out_file:
+            json.dump(report, out_file, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding='utf-8') as baseline_file:
+            baseline = json.load(baseline_file)['metrics']
+        regressions = compare(metrics, baseline, args.tolerance)
+        for name, base, current, change in regressions:
+            print('REGRESSION {}: {:.3f} -> {:.3f} ({:+.0%})'.format(name, base, current, change))
+        if regressions:
+            return 1
+        print('No regressions against {}.'.format(args.baseline))
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
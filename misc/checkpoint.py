@@ -0,0 +1,104 @@
+"""
+Session checkpoints, so an interrupted session can be resumed from its last saved trial.
+
+SessionState keeps everything a procedure needs to continue: the seed of
+its schedule (the schedule is built again from it), trial no, completed
+blocks, progress and adaptive procedure of the current block, stim times
+found by adaptive training blocks and the letter shown last. It's pickled
+after every trial, in an idle window, into results/<PART_ID>_checkpoint.pkl,
+replacing the old file atomically. A crash while writing leaves the previous checkpoint intact.
+"""
+from __future__ import annotations
+
+import os
+import pickle
+from typing import Dict, List, Optional, Tuple
+
+from Adaptives.AbstractAdaptive import AbstractAdaptive
+
+
+class SessionState(object):
+    """
+    Progress of a session. Blocks are identified by (trial type, block no), as in a schedule.
+    """
+
+    def __init__(self, part_id: str, session: str, seed: int):
+        """
+        Args:
+            part_id: Participant id.
+            session: Name of a session that started it, its files are in results/.
+            seed: Seed of a session schedule.
+        """
+        self.part_id = part_id
+        self.session = session
+        self.seed = seed
+        self.frame_rate: Optional[int] = None  # of a display, stim times of staircases are in its frames
+        self.trial_no = 1  # No of a next trial
+        self.completed: List[Tuple[str, int]] = list()
+        self.block: Optional[Tuple[str, int]] = None
+        self.done = 0  # Trials of the current block done
+        self.adaptive: Optional[AbstractAdaptive] = None  # of the current block
+        self.start_stim_times: Dict[str, int] = dict()
+        self.last_letter = ''  # of the last trial shown, a next one mustn't repeat it
+
+    def is_completed(self, trial_type: str, block_no: int) -> bool:
+        return (trial_type, block_no) in self.completed
+
+    def start_block(self, trial_type: str, block_no: int,
+                    adaptive: Optional[AbstractAdaptive] = None) -> Tuple[int, Optional[AbstractAdaptive]]:
+        """
+        Args:
+            trial_type: Trial type of a block, see misc.schedule.
+            block_no: No of a block within its trial type.
+            adaptive: Fresh adaptive procedure of a block, if any.
+
+        Returns:
+            No of trials of a block done so far and its adaptive procedure. Both come from a checkpoint
+            if a block was interrupted, so it continues where it stopped.
+        """
+        if self.block != (trial_type, block_no):
+            self.block, self.done, self.adaptive = (trial_type, block_no), 0, adaptive
+        return self.done, self.adaptive
+
+    def trial_done(self, trial_no: int) -> None:
+        """
+        Args:
+            trial_no: No of a trial just saved.
+        """
+        self.trial_no = trial_no + 1
+        self.done += 1
+
+    def end_block(self) -> None:
+        self.completed.append(self.block)
+        self.block, self.done, self.adaptive = None, 0, None
+
+
+def checkpoint_path(results_dir: str, part_id: str) -> str:
+    return os.path.join(results_dir, f'{part_id}_checkpoint.pkl')
+
+
+def save_checkpoint(path: str, state: SessionState) -> None:
+    """
+    Write a checkpoint atomically: to a temporary file first, then renamed over the old one.
+
+    Args:
+        path: Checkpoint file.
+        state: Session state.
+    """
+    with open(path + '.tmp', 'wb') as tmp_file:
+        pickle.dump(state, tmp_file, protocol=pickle.HIGHEST_PROTOCOL)
+        tmp_file.flush()
+        os.fsync(tmp_file.fileno())
+    os.replace(path + '.tmp', path)
+
+
+def load_checkpoint(path: str) -> SessionState:
+    """
+    Args:
+        path: Checkpoint file.
+
+    Returns:
+        Session state saved last.
+    """
+    with open(path, 'rb') as checkpoint_file:
+        return pickle.load(checkpoint_file)
@@ -0,0 +1,57 @@
+"""
+Durations in config.yaml are in milliseconds; a display shows them in whole frames of its refresh rate.
+
+frames_config() converts a config once the refresh rate of a display is
+measured, so trial code keeps working in frames, the finest resolution a
+display has. Trial values of a schedule (CSI, jitter) stay in milliseconds,
+a schedule doesn't depend on a display.
+"""
+from __future__ import annotations
+
+# Config keys with a duration in ms, in frames after frames_config()
+FRAME_KEYS = ('FIX_CROSS_TIME', 'QUE_SPEED', 'MASK_TIME', 'START_STIM_TIME_AS', 'START_STIM_TIME_PS')
+
+
+def to_frames(ms: float, frame_rate: float) -> int:
+    """
+    Args:
+        ms: Duration, in milliseconds.
+        frame_rate: Refresh rate of a display, frames per second.
+
+    Returns:
+        Nearest no of frames, at least one.
+    """
+    return max(1, int(round(ms * frame_rate / 1000)))
+
+
+def to_ms(frames: int, frame_rate: float) -> float:
+    """
+    Args:
+        frames: No of frames.
+        frame_rate: Refresh rate of a display, frames per second.
+
+    Returns:
+        Nominal duration of that many frames, in milliseconds.
+    """
+    return round(frames * 1000 / frame_rate, 3)
+
+
+def frames_config(conf: dict, frame_rate: int) -> dict:
+    """
+    Args:
+        conf: Procedure config, durations in ms.
+        frame_rate: Measured refresh rate, one of FRAME_RATES.
+
+    Returns:
+        Copy of a config with FRAME_RATE set, durations of FRAME_KEYS and TRAINING_BLOCKS in frames,
+        STAIR_STEP in frames (one frame if null) and STOP_MAX_SE in (fractional) frames.
+    """
+    conf = dict(conf, FRAME_RATE=frame_rate)
+    for key in FRAME_KEYS:
+        conf[key] = to_frames(conf[key], frame_rate)
+    conf['TRAINING_BLOCKS'] = [[no_trials, to_frames(stim_time, frame_rate), block_type]
+                               for no_trials, stim_time, block_type in conf['TRAINING_BLOCKS']]
+    conf['STAIR_STEP'] = 1 if conf['STAIR_STEP'] is None else to_frames(conf['STAIR_STEP'], frame_rate)
+    if conf['STOP_MAX_SE'] is not None:
+        conf['STOP_MAX_SE'] = conf['STOP_MAX_SE'] * frame_rate / 1000
+    return conf
@@ -0,0 +1,162 @@
+"""
+Per-flip timing of trial phases, with dropped frames detection.
+"""
+from __future__ import annotations
+
+import csv
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+FIX, CSI, QUE, STIM, MASK, RESP = range(6)
+PHASES = ('fix', 'csi', 'que', 'stim', 'mask', 'resp')
+TIMED_PHASES = (FIX, CSI, QUE, STIM, MASK)  # Phases with fixed no of frames, dropped frames are counted for them
+HEADER = ['Stim_dur_ms'] + ['Dropped_{}'.format(PHASES[phase]) for phase in TIMED_PHASES] + ['Overrun_frames']
+
+HIST_BIN_MS = 1  # Width of a bin of a frame interval histogram
+HIST_MAX_MS = 200  # Longer intervals land in the last bin
+
+
+class FrameTimer(object):
+    """
+    Flips a window and records timestamp of every flip together with a trial phase.
+
+    Timestamps are written into preallocated arrays, so recording costs one
+    function call and a few item assignments per frame. Use flip(phase) instead
+    of win.flip() inside a trial, and trial_summary() after it.
+
+    Time between return of one flip and call of the next one is Python work
+    spent on a frame. Frames where it's over **budget** of a refresh interval
+    are overruns, see overruns(); they are dropped (or close to it) whatever
+    the display does.
+    """
+
+    def __init__(self, win, frame_rate: float, capacity: int = 4096, budget: float = 1.0):
+        """
+        Args:
+            win: psychopy.visual.Window, or anything with flip() returning a flip timestamp in seconds.
+            frame_rate: Expected frame rate, in frames per second.
+            capacity: Max no of flips recorded in one trial, later flips are shown but not recorded.
+            budget: Fraction of a refresh interval Python work on a frame may take.
+        """
+        self.win = win
+        self.frame_rate = frame_rate
+        self.frame_time = 1.0 / frame_rate
+        self.capacity = capacity
+        self.budget = budget
+        self._times = np.zeros(capacity, dtype=np.float64)
+        self._phases = np.zeros(capacity, dtype=np.int8)
+        self._work = np.zeros(capacity, dtype=np.float64)
+        self._flipped = time.perf_counter()  # When the last flip returned
+        self._n = 0
+        self.histogram = np.zeros(HIST_MAX_MS // HIST_BIN_MS + 1, dtype=np.int64)
+
+    def start_trial(self) -> None:
+        self._n = 0
+        self._flipped = time.perf_counter()
+
+    def flip(self, phase: int) -> float:
+        """
+        Args:
+            phase: One of FIX, CSI, QUE, STIM, MASK, RESP, phase to which displayed frame belongs.
+
+        Returns:
+            Timestamp of the flip.
+        """
+        called = time.perf_counter()
+        t = self.win.flip()
+        n = self._n
+        if n < self.capacity:
+            self._times[n] = t
+            self._phases[n] = phase
+            self._work[n] = called - self._flipped
+            self._n = n + 1
+        self._flipped = time.perf_counter()
+        return t
+
+    def trial_flips(self) -> Tuple[np.ndarray, np.ndarray]:
+        """
+        Returns:
+            (timestamps, phases) of flips recorded since start_trial(), views valid until the next trial.
+        """
+        return self._times[:self._n], self._phases[:self._n]
+
+    def trial_work(self) -> np.ndarray:
+        """
+        Returns:
+            Python work before every flip recorded since start_trial(), in seconds; a view like in trial_flips().
+        """
+        return self._work[:self._n]
+
+    def overruns(self) -> List[Tuple[int, str, float]]:
+        """
+        Returns:
+            (frame no, phase name, Python work in ms) of every frame of a current trial that overran its budget.
+            Response frames are skipped, as they follow waiting for a key.
+        """
+        n = self._n
+        over = np.flatnonzero((self._work[:n] > self.budget * self.frame_time) & (self._phases[:n] != RESP))
+        return [(int(i), PHASES[self._phases[i]], round(float(self._work[i]) * 1000, 3)) for i in over]
+
+    def trial_summary(self) -> List[float | int]:
+        """
+        Summarise flips recorded since start_trial() and add their intervals to session histogram.
+
+        Returns:
+            Values for HEADER columns: actual stimulus duration in ms (nan if
+            unknown), no of dropped frames in every timed phase and no of overrun frames.
+        """
+        times, phases = self.trial_flips()
+        stim_dur, dropped = summarise_flips(times, phases, self.frame_time)
+        intervals = np.diff(times)[phases[:-1] != RESP]  # After response screen flip it's waiting for a key
+        bins = np.minimum((intervals * 1000 / HIST_BIN_MS).astype(np.int64), len(self.histogram) - 1)
+        self.histogram += np.bincount(bins, minlength=len(self.histogram))
+        return [stim_dur] + [int(dropped[phase]) for phase in TIMED_PHASES] + [len(self.overruns())]
+
+    def save_histogram(self, path: str) -> None:
+        """
+        Save session histogram of intervals between consecutive flips as CSV.
+
+        Args:
+            path: Output file path.
+        """
+        with open(path, 'w', encoding='utf-8', newline='') as hist_file:
+            hist_writer = csv.writer(hist_file)
+            hist_writer.writerow(['Interval_from_ms', 'Interval_to_ms', 'Count'])
+            for i, count in enumerate(self.histogram):
+                upper = (i + 1) * HIST_BIN_MS if i < len(self.histogram) - 1 else 'inf'
+                hist_writer.writerow([i * HIST_BIN_MS, upper, int(count)])
+
+    def dropped_total(self) -> int:
+        """
+        Returns:
+            No of frames dropped in a whole session, estimated from histogram.
+        """
+        edges = np.arange(len(self.histogram)) * HIST_BIN_MS / 1000 + HIST_BIN_MS / 2000
+        late = np.maximum(np.round(edges / self.frame_time) - 1, 0)
+        return int((late * self.histogram).sum())
+
+
+def summarise_flips(times: np.ndarray, phases: np.ndarray, frame_time: float):
+    """
+    Args:
+        times: Flip timestamps in seconds.
+        phases: Phase of every flip.
+        frame_time: Expected interval between flips, in seconds.
+
+    Returns:
+        (stimulus duration in ms, array of dropped frames indexed by phase).
+        Interval after a flip is attributed to the phase of that flip, as its frame stays on screen.
+    """
+    dropped = np.zeros(len(PHASES), dtype=np.int64)
+    if len(times) < 2:
+        return float('nan'), dropped
+    late = np.maximum(np.round(np.diff(times) / frame_time).astype(np.int64) - 1, 0)
+    np.add.at(dropped, phases[:-1], late)
+
+    stim_dur = float('nan')
+    stim_flips = np.flatnonzero(phases == STIM)
+    if len(stim_flips) and stim_flips[-1] + 1 < len(times):
+        stim_dur = round(float(times[stim_flips[-1] + 1] - times[stim_flips[0]]) * 1000, 3)
+    return stim_dur, dropped
@@ -0,0 +1,274 @@
+"""
+Eye-tracker samples collected on a background thread, with velocity-threshold saccade detection.
+
+A source (tracker bridge on a UDP socket, or a file replayed in real time)
+delivers (timestamp, x, y) samples; timestamps must be on the procedure
+clock (core.getTime), x and y in pixels from the screen center.
+GazeStream moves them into a GazeBuffer ring on its own thread, and trial
+code only takes snapshots of the buffer after a trial, so the frame loop
+never waits for a tracker or for detection.
+
+GAZE_SOURCE in config.yaml selects a source:
+
+    udp:<host>:<port>  datagrams of little-endian float64 (t, x, y) triples
+    replay:<path>      .npy array or CSV (t, x, y columns) of recorded samples
+"""
+from __future__ import annotations
+
+import socket
+import threading
+import time
+from typing import Callable, Dict, Optional
+
+import numpy as np
+
+SACCADE_DTYPE = np.dtype([('onset', 'f8'), ('offset', 'f8'), ('dx', 'f4'), ('dy', 'f4'), ('peak_velocity', 'f4')])
+
+
+class GazeBuffer(object):
+    """
+    Ring buffer of (t, x, y) samples for one writer and one reader thread, without locks.
+
+    The writer fills samples first and publishes them by moving a counter, so a
+    reader never sees half-written samples. A reader copies a snapshot and
+    drops samples the writer may have overwritten meanwhile.
+    """
+
+    def __init__(self, capacity: int = 2 ** 16):
+        """
+        Args:
+            capacity: Max no of samples kept, 2 ** 16 is half a minute at 2 kHz.
+        """
+        self.capacity = capacity
+        self._data = np.zeros((capacity, 3), dtype=np.float64)
+        self._written = 0  # Only writer moves it
+
+    def __len__(self) -> int:
+        return min(self._written, self.capacity)
+
+    def extend(self, samples: np.ndarray) -> None:
+        """
+        Writer side.
+
+        Args:
+            samples: Array of shape (n, 3), ordered by time.
+        """
+        samples = samples[-self.capacity:]
+        n = len(samples)
+        start = self._written % self.capacity
+        first = min(n, self.capacity - start)
+        self._data[start:start + first] = samples[:first]
+        self._data[:n - first] = samples[first:]
+        self._written += n
+
+    def since(self, t0: float) -> np.ndarray:
+        """
+        Reader side.
+
+        Args:
+            t0: Timestamp of the oldest sample of interest.
+
+        Returns:
+            Copy of samples with timestamps from t0 on, shape (n, 3).
+        """
+        written = self._written
+        oldest = max(0, written - self.capacity)
+        snapshot = self._data[np.arange(oldest, written) % self.capacity]
+        overwritten = self._written - self.capacity - oldest  # by writer while copying
+        if overwritten > 0:
+            snapshot = snapshot[overwritten:]
+        return snapshot[np.searchsorted(snapshot[:, 0], t0):]
+
+
+class UdpSource(object):
+    """
+    Samples sent by a tracker bridge as UDP datagrams of float64 (t, x, y) triples.
+    """
+
+    def __init__(self, host: str, port: int, timeout: float = 0.01):
+        """
+        Args:
+            host: Address to listen on.
+            port: Port to listen on.
+            timeout: Max wait for the first datagram of a read(), in seconds.
+        """
+        self.timeout = timeout
+        self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+        self._sock.bind((host, port))
+
+    def read(self) -> np.ndarray:
+        chunks = list()
+        try:
+            self._sock.settimeout(self.timeout)
+            chunks.append(self._sock.recv(65536))
+            self._sock.setblocking(False)
+            while True:  # drain everything already waiting
+                chunks.append(self._sock.recv(65536))
+        except (socket.timeout, BlockingIOError):
+            pass
+        if not chunks:
+            return np.empty((0, 3))
+        data = b''.join(chunk[:len(chunk) - len(chunk) % 24] for chunk in chunks)
+        return np.frombuffer(data, dtype='<f8').reshape(-1, 3)
+
+    def close(self) -> None:
+        self._sock.close()
+
+
+class ReplaySource(object):
+    """
+    Recorded samples played back in real time, shifted so that the first one lands at the first read().
+    """
+
+    def __init__(self, path: str, clock: Callable[[], float], poll_interval: float = 0.001):
+        """
+        Args:
+            path: .npy array or CSV with header, columns t, x, y.
+            clock: Procedure clock.
+            poll_interval: Sleep between reads, in seconds.
+        """
+        if path.endswith('.npy'):
+            self._samples = np.load(path).astype(np.float64)
+        else:
+            self._samples = np.loadtxt(path, delimiter=',', skiprows=1, usecols=(0, 1, 2), ndmin=2)
+        self._clock = clock
+        self.poll_interval = poll_interval
+        self._next = 0
+        self._shift = None
+
+    def read(self) -> np.ndarray:
+        time.sleep(self.poll_interval)
+        now = self._clock()
+        if self._shift is None:
+            self._shift = now - self._samples[0, 0]
+        end = np.searchsorted(self._samples[:, 0], now - self._shift, side='right')
+        chunk = self._samples[self._next:end].copy()
+        chunk[:, 0] += self._shift
+        self._next = end
+        return chunk
+
+    def close(self) -> None:
+        pass
+
+
+def open_source(spec: str, clock: Callable[[], float]):
+    """
+    Args:
+        spec: GAZE_SOURCE, see module docstring.
+        clock: Procedure clock.
+
+    Returns:
+        Source with read() and close() methods.
+    """
+    kind, _, rest = spec.partition(':')
+    if kind == 'udp':
+        host, _, port = rest.rpartition(':')
+        return UdpSource(host, int(port))
+    elif kind == 'replay':
+        return ReplaySource(rest, clock)
+    raise ValueError('Unknown GAZE_SOURCE: {}'.format(spec))
+
+
+class GazeStream(object):
+    """
+    Background thread moving samples from a source into a buffer.
+    """
+
+    def __init__(self, source, buffer: GazeBuffer):
+        self.source = source
+        self.buffer = buffer
+        self.no_samples = 0
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, name='GazeStream', daemon=True)
+        self._thread.start()
+
+    def close(self) -> None:
+        self._stop.set()
+        self._thread.join()
+        self.source.close()
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            samples = self.source.read()
+            if len(samples):
+                self.buffer.extend(samples)
+                self.no_samples += len(samples)
+
+
+def detect_saccades(samples: np.ndarray, velocity_threshold: float, min_duration: float) -> np.ndarray:
+    """
+    Velocity-threshold (I-VT) saccade detection.
+
+    Args:
+        samples: Array of (t, x, y) rows, ordered by time.
+        velocity_threshold: Gaze speed above which samples belong to a saccade, in pixels per second.
+        min_duration: Shorter runs of fast samples are noise, in seconds.
+
+    Returns:
+        Structured array with SACCADE_DTYPE, one row per saccade.
+    """
+    if len(samples) < 3:
+        return np.zeros(0, dtype=SACCADE_DTYPE)
+    t, x, y = samples[:, 0], samples[:, 1], samples[:, 2]
+    speed = np.hypot(np.gradient(x, t), np.gradient(y, t))
+    fast = np.concatenate(([0], (speed > velocity_threshold).view(np.int8), [0]))
+    edges = np.diff(fast)
+    onsets, offsets = np.flatnonzero(edges == 1), np.flatnonzero(edges == -1) - 1
+    keep = t[offsets] - t[onsets] >= min_duration
+    onsets, offsets = onsets[keep], offsets[keep]
+
+    saccades = np.zeros(len(onsets), dtype=SACCADE_DTYPE)
+    saccades['onset'] = t[onsets]
+    saccades['offset'] = t[offsets]
+    saccades['dx'] = x[offsets] - x[onsets]
+    saccades['dy'] = y[offsets] - y[onsets]
+    if len(onsets):
+        bounds = np.column_stack((onsets, offsets + 1)).ravel()
+        saccades['peak_velocity'] = np.maximum.reduceat(np.append(speed, 0), bounds)[::2]
+    return saccades
+
+
+class GazeTracker(object):
+    """
+    Gaze input of a session: stream of samples and per-trial saccade measures.
+    """
+
+    def __init__(self, conf: dict, clock: Callable[[], float]):
+        """
+        Args:
+            conf: Procedure config, GAZE_* keys.
+            clock: Procedure clock, same one as flip timestamps.
+        """
+        px_per_deg = conf['GAZE_PX_PER_DEG']
+        self.velocity_threshold = conf['GAZE_VELOCITY_THRESHOLD'] * px_per_deg
+        self.min_amplitude = conf['GAZE_MIN_AMPLITUDE'] * px_per_deg
+        self.min_duration = conf['GAZE_MIN_SACCADE_MS'] / 1000
+        self.buffer = GazeBuffer()
+        self.stream = GazeStream(open_source(conf['GAZE_SOURCE'], clock), self.buffer)
+
+    def annotate(self, cue_onset: float, que_side: int, block_type: str) -> Dict[str, Optional[float | int]]:
+        """
+        Measure the first saccade after cue onset. Meant for the time after a trial, not for its frame loop.
+
+        Args:
+            cue_onset: Flip timestamp of the first cue frame.
+            que_side: -1 if cue was on the left, 1 if on the right.
+            block_type: 'PS' (saccade toward cue is correct) or 'AS' (away from cue is correct).
+
+        Returns:
+            Values of TrialRecord fields: gaze_samples, sacc_latency_ms, sacc_dir (1 toward cue, -1 away)
+            and sacc_corr (1 or 0). Saccade fields are None if no saccade was made.
+        """
+        samples = self.buffer.since(cue_onset)
+        saccades = detect_saccades(samples, self.velocity_threshold, self.min_duration)
+        saccades = saccades[np.abs(saccades['dx']) >= self.min_amplitude]
+        values = dict(gaze_samples=len(samples), sacc_latency_ms=None, sacc_dir=None, sacc_corr=None)
+        if len(saccades):
+            first = saccades[0]
+            direction = 1 if np.sign(first['dx']) == np.sign(que_side) else -1
+            values.update(sacc_latency_ms=round(float(first['onset'] - cue_onset) * 1000, 1), sacc_dir=direction,
+                          sacc_corr=int(direction == (1 if block_type == 'PS' else -1)))
+        return values
+
+    def close(self) -> None:
+        self.stream.close()
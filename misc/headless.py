@@ -0,0 +1,334 @@
+"""
+Headless backend: no display, no keyboard, no dialogs, a simulated participant instead.
+
+Flips don't wait for vsync. With a virtual clock (default) time advances by
+exactly one frame per flip and waits are skipped, so a whole session runs
+as fast as Python can go, with timing identical to an ideal display.
+"""
+from __future__ import annotations
+
+import sys
+import time
+from collections import OrderedDict, defaultdict
+from types import SimpleNamespace
+from typing import Any, Dict, List, Optional, Tuple
+
+import numpy as np
+
+from misc.observer import PsychometricObserver
+
+
+class SimulatedParticipant(object):
+    """
+    Answers letter questions like an observer with a psychometric function over stimulus duration in frames.
+    """
+
+    def __init__(self, key_map: Dict[str, str], observer: Optional[PsychometricObserver] = None,
+                 rng: Optional[np.random.Generator] = None, rt_mean: float = 0.6, rt_sd: float = 0.15,
+                 min_rt: float = 0.15):
+        """
+        Args:
+            key_map: Reaction key for every letter.
+            observer: Psychometric function of a participant, default one if None.
+            rng: Source of randomness, fresh default one if None.
+            rt_mean: Mean reaction time, in seconds from stimulus onset.
+            rt_sd: Standard deviation of reaction time.
+            min_rt: Reaction times are never shorter than that.
+        """
+        self.key_map = key_map
+        self.observer = PsychometricObserver() if observer is None else observer
+        self.rng = np.random.default_rng() if rng is None else rng
+        self.rt_mean, self.rt_sd, self.min_rt = rt_mean, rt_sd, min_rt
+
+    def respond(self, letter: Optional[str], frames: int) -> Tuple[str, float]:
+        """
+        Args:
+            letter: Letter that was shown, None if no letter was shown.
+            frames: No of frames it was shown.
+
+        Returns:
+            (pressed key, reaction time in seconds).
+        """
+        keys = list(self.key_map.values())
+        if letter is not None and self.observer.respond(frames, self.rng):
+            key = self.key_map[letter]
+        else:  # guessing, may still be a lucky one
+            key = keys[self.rng.integers(len(keys))]
+        rt = max(self.min_rt, self.rng.normal(self.rt_mean, self.rt_sd))
+        return key, float(rt)
+
+
+class HeadlessBackend(object):
+    """
+    Backend with the same API as misc.backend.PsychopyBackend, see module docstring.
+    """
+
+    def __init__(self, participant: SimulatedParticipant, frame_rate: int = 60,
+                 screen_res: Tuple[int, int] = (1920, 1080), virtual_clock: bool = True,
+                 part_id: str = 'headless', resume: bool = False, log_stream=None):
+        """
+        Args:
+            participant: Simulated participant answering trials.
+            frame_rate: Reported (and, with virtual clock, simulated) frame rate.
+            screen_res: Reported screen resolution.
+            virtual_clock: Advance time by a frame per flip and skip waits, instead of using a wall clock.
+            part_id: Value filled into IDENTYFIKATOR field of a dialog.
+            resume: Value filled into WZNOWIENIE (resume a session) field of a dialog.
+            log_stream: Optional stream for echoing log messages, e.g. sys.stderr.
+        """
+        self.participant = participant
+        self._frame_rate = frame_rate
+        self._frame_time = 1.0 / frame_rate
+        self._screen_res = screen_res
+        self.virtual_clock = virtual_clock
+        self.part_id = part_id
+        self.resume = resume
+        self._now = 0.0
+        self.no_flips = 0
+
+        self.visual = SimpleNamespace(Window=self._make_window, TextStim=_Stim, ImageStim=_Stim, Circle=_Stim)
+        self.event = _Event(self)
+        self.logging = _Logging(self, log_stream)
+        self.gui = SimpleNamespace(DlgFromDict=self._dlg_from_dict, Dlg=_Dlg)
+        self.core = SimpleNamespace(Clock=lambda: _Clock(self), wait=self.wait, getTime=self.now)
+
+    def now(self) -> float:
+        return self._now if self.virtual_clock else time.perf_counter()
+
+    def wait(self, secs: float, hogCPUperiod: float = 0) -> None:
+        if self.virtual_clock:
+            self._now += secs
+
+    def advance_frame(self) -> None:
+        if self.virtual_clock:
+            self._now += self._frame_time
+
+    def screen_res(self) -> OrderedDict:
+        return OrderedDict(width=self._screen_res[0], height=self._screen_res[1])
+
+    def frame_rate(self, win) -> int:
+        return self._frame_rate
+
+    def responses(self, key_list, measure: bool = False) -> _Responses:
+        return _Responses(self, key_list)
+
+    def load_image(self, path: str) -> Any:
+        return path  # nothing is ever rendered, no need to decode
+
+    def _make_window(self, *args, **kwargs) -> _Window:
+        return _Window(self)
+
+    def _dlg_from_dict(self, dictionary: dict, title: str = '', **kwargs) -> SimpleNamespace:
+        for key, val in dictionary.items():
+            if isinstance(val, list):  # choice field, first option is selected
+                dictionary[key] = val[0]
+        dictionary['IDENTYFIKATOR'] = self.part_id
+        if 'WZNOWIENIE' in dictionary:
+            dictionary['WZNOWIENIE'] = self.resume
+        return SimpleNamespace(OK=True)
+
+
+class _Window(object):
+    def __init__(self, backend: HeadlessBackend):
+        self.backend = backend
+        self.letter_frames: Dict[str, int] = defaultdict(int)  # Frames every text was drawn since clearEvents
+        self._on_flip: List[Tuple[Any, tuple, dict]] = list()
+
+    def flip(self, clearBuffer: bool = True) -> float:
+        self.backend.advance_frame()
+        self.backend.no_flips += 1
+        if self._on_flip:
+            for fun, args, kwargs in self._on_flip:
+                fun(*args, **kwargs)
+            self._on_flip = list()
+        return self.backend.now()
+
+    def callOnFlip(self, function, *args, **kwargs) -> None:
+        self._on_flip.append((function, args, kwargs))
+
+    def clearBuffer(self) -> None:
+        pass
+
+    def getActualFrameRate(self, *args, **kwargs) -> float:
+        return float(self.backend.frame_rate(self))
+
+    def close(self) -> None:
+        pass
+
+
+class _Stim(object):
+    def __init__(self, win: _Window, text: str = '', pos=(0, 0), **kwargs):
+        self.win = win
+        self.text = text
+        self.pos = pos
+
+    def draw(self) -> None:
+        if self.text:
+            self.win.letter_frames[self.text] += 1
+
+
+class _Clock(object):
+    def __init__(self, backend: HeadlessBackend):
+        self.backend = backend
+        self._start = backend.now()
+
+    def getTime(self) -> float:
+        return self.backend.now() - self._start
+
+    def reset(self, newT: float = 0.0) -> None:
+        self._start = self.backend.now() + newT
+
+
+class _Event(object):
+    def __init__(self, backend: HeadlessBackend):
+        self.backend = backend
+        self._win: Optional[_Window] = None
+        self._trial_start = 0.0
+        self._response: Optional[Tuple[str, float]] = None  # (key, absolute time)
+        self._answered = False
+
+    def Mouse(self, win: _Window = None, **kwargs) -> None:
+        self._win = win
+
+    def clearEvents(self, eventType: str = None) -> None:
+        """
+        Called just before stimulus onset in a trial, so it starts a new simulated response.
+        """
+        if self._win is not None:
+            self._win.letter_frames.clear()
+        self._trial_start = self.backend.now()
+        self._response = None
+        self._answered = False
+
+    def getKeys(self, keyList: List[str] = None, timeStamped=False) -> List:
+        response = self._pending(keyList)
+        if response is None or response[1] > self.backend.now():
+            return []
+        return self._emit(response[0], timeStamped)
+
+    def waitKeys(self, maxWait: float = float('inf'), keyList: List[str] = None, timeStamped=False) -> List | None:
+        if not self._is_response(keyList):  # info screens etc., participant moves on at once
+            return [next(key for key in keyList if key != 'f7')] if keyList else ['space']
+        response = self._pending(keyList)
+        if response is None:
+            self.backend.wait(maxWait)
+            return None
+        key, when = response
+        if when - self.backend.now() > maxWait:
+            self.backend.wait(maxWait)
+            return None
+        self.backend.wait(max(0.0, when - self.backend.now()))
+        return self._emit(key, timeStamped)
+
+    def _is_response(self, keyList: List[str] | None) -> bool:
+        return bool(keyList) and set(keyList) <= set(self.backend.participant.key_map.values())
+
+    def _pending(self, keyList: List[str] | None) -> Tuple[str, float] | None:
+        if self._answered or not self._is_response(keyList):
+            return None
+        if self._response is None:
+            frames = self._win.letter_frames if self._win is not None else dict()
+            shown = [(n, text) for text, n in frames.items() if text in self.backend.participant.key_map]
+            n, letter = max(shown) if shown else (0, None)
+            key, rt = self.backend.participant.respond(letter, n)
+            self._response = (key, self._trial_start + rt)
+        return self._response
+
+    def _emit(self, key: str, timeStamped) -> List:
+        self._answered = True
+        if timeStamped:
+            return [[key, timeStamped.getTime()]]
+        return [key]
+
+
+class _Responses(object):
+    """
+    Simulated counterpart of misc.responses.ResponseCollector.
+    """
+
+    def __init__(self, backend: HeadlessBackend, key_list):
+        self.backend = backend
+        self.key_list = list(key_list)
+        self._clock = _Clock(backend)
+
+    def reset_clock_on_flip(self, win: _Window) -> None:
+        win.callOnFlip(self._clock.reset)
+
+    def clear(self) -> None:
+        self.backend.event.clearEvents()
+
+    def get_keys(self) -> List[Tuple[str, float]]:
+        return [tuple(key) for key in self.backend.event.getKeys(keyList=self.key_list, timeStamped=self._clock)]
+
+    def wait_keys(self, max_wait: float) -> Optional[List[Tuple[str, float]]]:
+        keys = self.backend.event.waitKeys(maxWait=max_wait, keyList=self.key_list, timeStamped=self._clock)
+        return None if keys is None else [tuple(key) for key in keys]
+
+    def latency_stats(self) -> dict:
+        return dict()
+
+    def close(self) -> None:
+        pass
+
+
+class _Dlg(object):
+    def __init__(self, title: str = '', **kwargs):
+        self.title = title
+        self.texts = list()
+        self.OK = True
+
+    def addText(self, text: str, **kwargs) -> None:
+        self.texts.append(text)
+
+    def show(self) -> None:
+        print('{}: {}'.format(self.title, ' '.join(self.texts)), file=sys.stderr)
+
+
+class _Logging(object):
+    """
+    Subset of psychopy.logging: messages are buffered and written to LogFile targets on flush().
+    """
+    CRITICAL, ERROR, WARNING, DATA, EXP, INFO, DEBUG = 50, 40, 30, 25, 22, 20, 10
+    _NAMES = {50: 'CRITICAL', 40: 'ERROR', 30: 'WARNING', 25: 'DATA', 22: 'EXP', 20: 'INFO', 10: 'DEBUG'}
+
+    def __init__(self, backend: HeadlessBackend, echo=None):
+        self.backend = backend
+        self._messages: List[Tuple[float, int, str]] = list()
+        self._targets: List[Tuple[Any, int]] = list()
+        if echo is not None:
+            self._targets.append((echo, self.INFO))
+
+    def LogFile(self, f=None, level: int = 30, **kwargs) -> None:
+        self._targets.append((f, level))
+
+    def log(self, msg: str, level: int) -> None:
+        self._messages.append((self.backend.now(), level, str(msg)))
+
+    def critical(self, msg: str) -> None:
+        self.log(msg, self.CRITICAL)
+
+    def error(self, msg: str) -> None:
+        self.log(msg, self.ERROR)
+
+    def warning(self, msg: str) -> None:
+        self.log(msg, self.WARNING)
+
+    def data(self, msg: str) -> None:
+        self.log(msg, self.DATA)
+
+    def exp(self, msg: str) -> None:
+        self.log(msg, self.EXP)
+
+    def info(self, msg: str) -> None:
+        self.log(msg, self.INFO)
+
+    def debug(self, msg: str) -> None:
+        self.log(msg, self.DEBUG)
+
+    def flush(self) -> None:
+        for stream, level in self._targets:
+            for t, msg_level, msg in self._messages:
+                if msg_level >= level:
+                    stream.write('{:.4f} \t{} \t{}\n'.format(t, self._NAMES.get(msg_level, msg_level), msg))
+            stream.flush()
+        self._messages = list()
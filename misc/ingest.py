@@ -0,0 +1,205 @@
+"""
+Incremental ingest of results/*_beh.csv into a typed columnar store, and parallel analysis of it.
+
+    python -m misc.ingest ingest --results results --store store
+    python -m misc.ingest analyze --store store --out summary.csv
+
+Every participant gets one store/<PART_ID>.npy file with a structured array
+(misc.trial_record.RECORD_DTYPE plus a session column, memory-mapped on read).
+Only new or changed result files are read again, see store/manifest.json.
+A store of an older STORE_DTYPE (see its hash in a manifest) is rebuilt from scratch.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import glob
+import hashlib
+import json
+import os
+from collections import defaultdict
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join, basename
+from typing import Dict, List
+
+import numpy as np
+
+from misc.trial_record import COLUMNS, MISSING_CSV, RECORD_DTYPE, read_records
+
+MANIFEST = 'manifest.json'
+STORE_DTYPE = np.dtype(RECORD_DTYPE.descr + [('session', 'U64')])
+SCHEMA = hashlib.sha1(str(STORE_DTYPE.descr).encode()).hexdigest()  # Stored in a manifest
+
+
+def _convert(value: str, dtype: str, missing):
+    if value in ('', MISSING_CSV, 'nan'):
+        return missing
+    if dtype == '?':
+        return value == 'True'
+    if dtype.startswith('i'):
+        return int(float(value))
+    if dtype.startswith('f'):
+        return float(value)
+    return value
+
+
+def read_results(path: str) -> np.ndarray:
+    """
+    Args:
+        path: Path of a *_beh.csv file. If a *_beh.bin sidecar exists, it's read instead.
+            Columns absent in older CSV files are filled with missing values.
+
+    Returns:
+        Structured array with STORE_DTYPE.
+    """
+    session = basename(path)[:-len('_beh.csv')]
+    bin_path = path[:-len('.csv')] + '.bin'
+    if os.path.exists(bin_path):
+        records = read_records(bin_path)
+        data = np.zeros(len(records), dtype=STORE_DTYPE)
+        for field in RECORD_DTYPE.names:
+            data[field] = records[field]
+        data['session'] = session
+        return data
+
+    with open(path, encoding='utf-8', newline='') as beh_file:
+        reader = csv.reader(beh_file)
+        header = next(reader, [])
+        rows = [row for row in reader if row]
+    index = {name: i for i, name in enumerate(header)}
+    data = np.zeros(len(rows), dtype=STORE_DTYPE)
+    for column, field, dtype, missing in COLUMNS:
+        i = index.get(column)
+        if i is None:
+            data[field] = missing
+        else:
+            data[field] = [_convert(row[i] if i < len(row) else '', dtype, missing) for row in rows]
+    data['session'] = session
+    return data
+
+
+def ingest(results_dir: str, store_dir: str) -> List[str]:
+    """
+    Add new and changed result files to a store.
+
+    Args:
+        results_dir: Directory with *_beh.csv files.
+        store_dir: Store directory, created if needed.
+
+    Returns:
+        Names of files that were (re)ingested.
+    """
+    os.makedirs(store_dir, exist_ok=True)
+    manifest_path = join(store_dir, MANIFEST)
+    manifest = json.load(open(manifest_path, encoding='utf-8')) if os.path.exists(manifest_path) else dict()
+    if manifest.get('schema') != SCHEMA:  # Rows of an older dtype can't be merged with new ones
+        for path in glob.glob(join(store_dir, '*.npy')):
+            os.remove(path)
+        manifest = dict(schema=SCHEMA, files=dict())
+    files = manifest['files']
+
+    new = defaultdict(list)  # part_id -> arrays
+    ingested = list()
+    for path in sorted(glob.glob(join(results_dir, '*_beh.csv'))):
+        stat = os.stat(path)
+        if files.get(basename(path)) == [stat.st_size, stat.st_mtime]:
+            continue
+        data = read_results(path)
+        for part_id in np.unique(data['part_id']):
+            new[str(part_id)].append(data[data['part_id'] == part_id])
+        files[basename(path)] = [stat.st_size, stat.st_mtime]
+        ingested.append(basename(path))
+
+    for part_id, arrays in new.items():
+        part_path = join(store_dir, '{}.npy'.format(part_id))
+        sessions = np.unique(np.concatenate([data['session'] for data in arrays]))
+        if os.path.exists(part_path):
+            old = np.load(part_path)
+            arrays.insert(0, old[~np.isin(old['session'], sessions)])  # changed files replace their rows
+        tmp = part_path + '.tmp.npy'
+        np.save(tmp, np.concatenate(arrays))
+        os.replace(tmp, part_path)
+
+    tmp = manifest_path + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as manifest_file:
+        json.dump(manifest, manifest_file, indent=1)
+    os.replace(tmp, manifest_path)
+    return ingested
+
+
+def summarize_participant(path: str) -> List[Dict]:
+    """
+    Args:
+        path: Path of a participant file in a store.
+
+    Returns:
+        One dict per block type with threshold (mean stimulus time at reversals of
+        experimental staircases, in frames and in ms), accuracy, RT and saccade summaries of experimental trials.
+    """
+    data = np.load(path, mmap_mode='r')
+    summary = list()
+    for block_type in np.unique(data['block_type']):
+        exp = data[(data['trial_type'] == 'exp') & (data['block_type'] == block_type)]
+        if not len(exp):
+            continue
+        reversals = exp['stim_time'][exp['reversal'] == 1]
+        reversals_ms = exp['stim_time_ms'][exp['reversal'] == 1]  # comparable across refresh rates
+        answered = exp['rt'][exp['rt'] > 0]
+        saccades = exp[exp['sacc_corr'] >= 0]
+        summary.append(dict(part_id=str(exp['part_id'][0]), block_type=str(block_type), no_trials=len(exp),
+                            no_reversals=len(reversals),
+                            threshold=float(reversals.mean()) if len(reversals) else np.nan,
+                            threshold_sd=float(reversals.std()) if len(reversals) else np.nan,
+                            threshold_ms=float(reversals_ms.mean()) if len(reversals) else np.nan,
+                            accuracy=float(exp['corr'].mean()),
+                            rt_median=float(np.median(answered)) if len(answered) else np.nan,
+                            rt_mean=float(answered.mean()) if len(answered) else np.nan,
+                            no_answer=int((exp['rt'] <= 0).sum()),
+                            sacc_accuracy=float(saccades['sacc_corr'].mean()) if len(saccades) else np.nan,
+                            sacc_latency_median=float(np.median(saccades['sacc_latency_ms'])) if len(saccades)
+                            else np.nan))
+    return summary
+
+
+def analyze(store_dir: str, out_path: str, workers: int = None) -> int:
+    """
+    Summarize every participant of a store with a process pool and write one CSV.
+
+    Args:
+        store_dir: Store directory.
+        out_path: Output CSV path.
+        workers: No of worker processes, no of CPUs if None.
+
+    Returns:
+        No of summary rows.
+    """
+    paths = sorted(path for path in glob.glob(join(store_dir, '*.npy')) if not path.endswith('.tmp.npy'))
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        rows = [row for summary in pool.map(summarize_participant, paths, chunksize=16) for row in summary]
+    fields = ['part_id', 'block_type', 'no_trials', 'no_reversals', 'threshold', 'threshold_sd', 'threshold_ms',
+              'accuracy', 'rt_median', 'rt_mean', 'no_answer', 'sacc_accuracy', 'sacc_latency_median']
+    with open(out_path, 'w', encoding='utf-8', newline='') as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=fields)
+        writer.writeheader()
+        writer.writerows(rows)
+    return len(rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Ingest and analyze behavioral results.')
+    sub = parser.add_subparsers(dest='command', required=True)
+    ingest_parser = sub.add_parser('ingest', help='Add new result files to a store.')
+    ingest_parser.add_argument('--results', default='results')
+    ingest_parser.add_argument('--store', default='store')
+    analyze_parser = sub.add_parser('analyze', help='Summarize every participant in a store.')
+    analyze_parser.add_argument('--store', default='store')
+    analyze_parser.add_argument('--out', default='summary.csv')
+    analyze_parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    if args.command == 'ingest':
+        files = ingest(args.results, args.store)
+        print('Ingested {} file(s).'.format(len(files)))
+    else:
+        print('Summarized {} participant-block rows into {}.'.format(analyze(args.store, args.out, args.workers),
+                                                                      args.out))
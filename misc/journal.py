@@ -0,0 +1,291 @@
+"""
+Append-only binary journal of a session: every flip, key press, response and staircase step.
+
+    python -m misc.journal results/<session>_journal.bin --out rows.csv --stairs stairs.csv
+
+Records have a fixed size (JOURNAL_DTYPE) and are written straight into a
+memory-mapped file through preallocated column views, so a write is a few
+item assignments and no syscall. Session metadata needed to decode records
+(participant, letters, keys, frame rate) is kept as JSON in a fixed-size
+file header. Replay rebuilds result rows (without gaze columns, which need
+raw samples, and idle window columns) and staircase trajectories from the
+journal alone.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import json
+import mmap
+import struct
+import time
+from typing import List, Sequence, Tuple
+
+import numpy as np
+
+from misc import durations, frame_timing
+from misc.trial_record import TrialRecord, HEADER
+
+MAGIC = b'SACJOUR1'
+HEADER_SIZE = 4096  # Magic, length of JSON metadata, JSON metadata, zero padding
+JOURNAL_DTYPE = np.dtype([('t', 'f8'), ('kind', 'u1'), ('code', 'i1'), ('trial', 'i4'), ('a', 'i4'), ('b', 'i4'),
+                          ('c', 'i4'), ('d', 'i4'), ('x', 'f8'), ('y', 'f8')], align=True)
+
+# Event kinds; 0 marks unused space
+TRIAL_START, FLIP, KEY, RESPONSE, STAIR = range(1, 6)
+KINDS = {TRIAL_START: 'trial_start', FLIP: 'flip', KEY: 'key', RESPONSE: 'response', STAIR: 'stair'}
+TRIAL_TYPES = ('train', 'adaptive', 'intra_train', 'exp')
+BLOCK_TYPES = ('PS', 'AS')
+
+
+class Journal(object):
+    """
+    Writer of a journal file. Not thread safe, meant for the procedure thread only.
+
+    Payload of events (columns of JOURNAL_DTYPE):
+        TRIAL_START  code trial type, a block no (-1 none), b block type, c csi, d letter, x stim time
+        FLIP         code phase, x Python work before the flip in seconds
+        KEY          a key, x RT
+        RESPONSE     code correctness, a key (-1 none), b chosen letter (-1 none), x RT
+        STAIR        a level, b reversal, c revs count, d next value, x threshold estimate, y its se (nan unknown)
+    Letters and keys are indices into metadata 'letters' and 'keys'.
+    """
+
+    def __init__(self, path: str, meta: dict, capacity: int = 2 ** 18):
+        """
+        Args:
+            path: Journal file, overwritten.
+            meta: Session metadata, JSON serializable. Must have 'letters' and 'keys'; see replay_rows() for others.
+            capacity: Initial no of records, file grows by doubling when full.
+        """
+        header = json.dumps(meta).encode('utf-8')
+        assert len(MAGIC) + 4 + len(header) <= HEADER_SIZE, 'Journal metadata too long'
+        self.path = path
+        self.meta = meta
+        self._letters = {letter: i for i, letter in enumerate(meta['letters'])}
+        self._keys = {key: i for i, key in enumerate(meta['keys'])}
+        self._file = open(path, 'w+b')
+        self._file.write(MAGIC + struct.pack('<I', len(header)) + header)
+        self._n = 0
+        self._map(capacity)
+
+    def __len__(self) -> int:
+        return self._n
+
+    def trial_start(self, trial_no: int, t: float, trial_type: str, block_no: int | None, block_type: str, csi: int,
+                    letter: str, stim_time: int) -> None:
+        self._append(TRIAL_START, trial_no, t, TRIAL_TYPES.index(trial_type), -1 if block_no is None else block_no,
+                     BLOCK_TYPES.index(block_type), csi, self._letters[letter], stim_time)
+
+    def flips(self, trial_no: int, times: np.ndarray, phases: np.ndarray, work: np.ndarray) -> None:
+        """
+        Journal all flips of a trial at once, e.g. from FrameTimer after a trial.
+        """
+        n = len(times)
+        while self._n + n > self.capacity:
+            self._map(self.capacity * 2)
+        end = self._n + n
+        self._t[self._n:end] = times
+        self._kind[self._n:end] = FLIP
+        self._code[self._n:end] = phases
+        self._trial[self._n:end] = trial_no
+        self._x[self._n:end] = work
+        self._n = end
+
+    def key(self, trial_no: int, t: float, key: str, rt: float) -> None:
+        self._append(KEY, trial_no, t, 0, self._keys[key], x=rt)
+
+    def response(self, trial_no: int, t: float, key: str, choice: str, rt: float, corr: bool) -> None:
+        self._append(RESPONSE, trial_no, t, int(corr), self._keys.get(key, -1), self._letters.get(choice, -1), x=rt)
+
+    def stair(self, trial_no: int, t: float, level: int, reversal: int, revs_count: int, next_val: int,
+              thr_est: float | None, thr_se: float | None) -> None:
+        self._append(STAIR, trial_no, t, 0, level, reversal, revs_count, next_val,
+                     np.nan if thr_est is None else thr_est, np.nan if thr_se is None else thr_se)
+
+    def flush(self) -> None:
+        """
+        Write dirty pages to disk and wait for it (a synchronous msync). Blocks for as long as writing
+        records of all flips since the last flush takes, up to a few MB per block at 240 Hz.
+        Meant for block boundaries, not for timed phases of a trial.
+        """
+        self._mmap.flush()
+
+    def close(self) -> None:
+        """
+        Flush and trim unused space off the file.
+        """
+        if self._mmap is None:
+            return
+        self._mmap.flush()
+        self._release()
+        self._file.truncate(HEADER_SIZE + self._n * JOURNAL_DTYPE.itemsize)
+        self._file.close()
+
+    def _append(self, kind: int, trial: int, t: float, code: int = 0, a: int = 0, b: int = 0, c: int = 0,
+                d: int = 0, x: float = np.nan, y: float = np.nan) -> None:
+        n = self._n
+        if n == self.capacity:
+            self._map(self.capacity * 2)
+        self._t[n] = t
+        self._kind[n] = kind
+        self._code[n] = code
+        self._trial[n] = trial
+        self._a[n] = a
+        self._b[n] = b
+        self._c[n] = c
+        self._d[n] = d
+        self._x[n] = x
+        self._y[n] = y
+        self._n = n + 1
+
+    def _map(self, capacity: int) -> None:
+        if getattr(self, '_mmap', None) is not None:
+            self._mmap.flush()
+            self._release()
+        self.capacity = capacity
+        self._file.truncate(HEADER_SIZE + capacity * JOURNAL_DTYPE.itemsize)
+        self._mmap = mmap.mmap(self._file.fileno(), 0)
+        records = np.frombuffer(self._mmap, dtype=JOURNAL_DTYPE, offset=HEADER_SIZE, count=capacity)
+        self._t, self._kind, self._code, self._trial = records['t'], records['kind'], records['code'], records['trial']
+        self._a, self._b, self._c, self._d = records['a'], records['b'], records['c'], records['d']
+        self._x, self._y = records['x'], records['y']
+
+    def _release(self) -> None:
+        # Views must be gone before a map can be closed
+        self._t = self._kind = self._code = self._trial = self._a = self._b = self._c = self._d = None
+        self._x = self._y = None
+        self._mmap.close()
+        self._mmap = None
+
+
+def read_journal(path: str) -> Tuple[dict, np.ndarray]:
+    """
+    Args:
+        path: Journal file, also one of a session that crashed (unused space is skipped).
+
+    Returns:
+        (metadata, structured array of records with JOURNAL_DTYPE), records in order of writing.
+    """
+    with open(path, 'rb') as journal_file:
+        head = journal_file.read(HEADER_SIZE)
+    assert head[:len(MAGIC)] == MAGIC, 'Not a journal file: {}'.format(path)
+    size, = struct.unpack('<I', head[len(MAGIC):len(MAGIC) + 4])
+    meta = json.loads(head[len(MAGIC) + 4:len(MAGIC) + 4 + size].decode('utf-8'))
+    raw = np.fromfile(path, dtype=np.uint8, offset=HEADER_SIZE)
+    records = raw[:len(raw) - len(raw) % JOURNAL_DTYPE.itemsize].view(JOURNAL_DTYPE)
+    used = np.flatnonzero(records['kind'] == 0)
+    return meta, records[:used[0]] if len(used) else records
+
+
+def replay_rows(meta: dict, records: np.ndarray) -> List[TrialRecord]:
+    """
+    Rebuild result rows.
+
+    Args:
+        meta: Journal metadata, with 'part_id', 'letters', 'keys', 'frame_rate' and 'frame_budget'.
+        records: Journal records.
+
+    Returns:
+        One TrialRecord per trial. Gaze and idle window columns are missing.
+    """
+    frame_time = 1.0 / meta['frame_rate']
+    letters, keys = meta['letters'], meta['keys']
+    order = np.argsort(records['trial'], kind='stable')  # events of a trial together, in order of writing
+    records = records[order]
+    bounds = np.flatnonzero(np.diff(records['trial'])) + 1
+    rows = list()
+    for events in np.split(records, bounds):
+        kinds = events['kind']
+        start = events[kinds == TRIAL_START]
+        response = events[kinds == RESPONSE]
+        if not len(start) or not len(response):
+            continue  # trial interrupted
+        start, response = start[0], response[0]
+        record = TrialRecord(part_id=meta['part_id'], block_no=None if start['a'] < 0 else int(start['a']),
+                             trial_no=int(start['trial']), block_type=BLOCK_TYPES[start['b']],
+                             trial_type=TRIAL_TYPES[start['code']], csi=int(start['c']),
+                             stim_letter=letters[start['d']],
+                             key_pressed=keys[response['a']] if response['a'] >= 0 else 'no_key',
+                             letter_choose=letters[response['b']] if response['b'] >= 0 else 'no_letter',
+                             rt=float(response['x']), corr=bool(response['code']), stim_time=int(start['x']),
+                             frame_rate=meta['frame_rate'])
+        record.csi_ms = durations.to_ms(record.csi, meta['frame_rate'])
+        record.stim_time_ms = durations.to_ms(record.stim_time, meta['frame_rate'])
+        flips = events[kinds == FLIP]
+        times, phases = flips['t'], flips['code']
+        stim_dur, dropped = frame_timing.summarise_flips(times, phases, frame_time)
+        record.stim_dur_ms = None if stim_dur != stim_dur else stim_dur
+        for phase in frame_timing.TIMED_PHASES:
+            setattr(record, 'dropped_{}'.format(frame_timing.PHASES[phase]), int(dropped[phase]))
+        record.overrun_frames = int(((flips['x'] > meta['frame_budget'] * frame_time) &
+                                     (phases != frame_timing.RESP)).sum())
+        stair = events[kinds == STAIR]
+        if len(stair):
+            stair = stair[0]
+            record.level, record.reversal, record.revs_count = int(stair['a']), int(stair['b']), int(stair['c'])
+            record.thr_est = None if np.isnan(stair['x']) else float(stair['x'])
+            record.thr_se = None if np.isnan(stair['y']) else float(stair['y'])
+        rows.append(record)
+    return rows
+
+
+def staircase_trajectories(records: np.ndarray) -> List[Tuple[Tuple[str, int, str], np.ndarray]]:
+    """
+    Args:
+        records: Journal records.
+
+    Returns:
+        List of ((trial type, block no, block type), array of stim times tested by a staircase followed by
+        its last value), in order of a session. Consecutive staircase trials of the same block are one staircase.
+    """
+    starts = records[records['kind'] == TRIAL_START]
+    stairs = records[records['kind'] == STAIR]
+    start_of = {int(trial): i for i, trial in enumerate(starts['trial'])}
+    trajectories = list()
+    last_key = None
+    for trial_no, next_val in zip(stairs['trial'].tolist(), stairs['d'].tolist()):
+        start = starts[start_of[trial_no]]
+        key = (TRIAL_TYPES[start['code']], int(start['a']), BLOCK_TYPES[start['b']])
+        if key != last_key:
+            trajectories.append((key, [int(start['x'])]))
+            last_key = key
+        trajectory = trajectories[-1][1]
+        trajectory[-1] = int(start['x'])  # tested value, same as next value of a previous step
+        trajectory.append(next_val)
+    return [(key, np.array(values)) for key, values in trajectories]
+
+
+def _save_rows(path: str, rows: Sequence[TrialRecord]) -> None:
+    with open(path, 'w', encoding='utf-8', newline='') as out_file:
+        writer = csv.writer(out_file)
+        writer.writerow(HEADER)
+        writer.writerows(row.csv_row() for row in rows)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Replay a session journal.')
+    parser.add_argument('journal', help='Journal file, results/<session>_journal.bin')
+    parser.add_argument('--out', help='Write rebuilt result rows as CSV to this file.')
+    parser.add_argument('--stairs', help='Write staircase trajectories as CSV to this file.')
+    args = parser.parse_args()
+
+    start_time = time.perf_counter()
+    session_meta, journal_records = read_journal(args.journal)
+    result_rows = replay_rows(session_meta, journal_records)
+    trajectories = staircase_trajectories(journal_records)
+    elapsed = time.perf_counter() - start_time
+    print('Records: {}, trials: {}, staircases: {}, replay time: {:.1f} ms'.format(
+        len(journal_records), len(result_rows), len(trajectories), elapsed * 1000))
+    if args.out:
+        _save_rows(args.out, result_rows)
+    if args.stairs:
+        with open(args.stairs, 'w', encoding='utf-8', newline='') as stairs_file:
+            stairs_writer = csv.writer(stairs_file)
+            stairs_writer.writerow(['Trial_type', 'Block_no', 'Block_type', 'Step', 'Stim_time'])
+            for (trial_type, block_no, block_type), values in trajectories:
+                stairs_writer.writerows([trial_type, block_no, block_type, step, val] for step, val in
+                                        enumerate(values.tolist()))
+    if not args.out and not args.stairs:
+        for (trial_type, block_no, block_type), values in trajectories:
+            print('{} {} {}: {}'.format(trial_type, block_no, block_type, ' '.join(map(str, values.tolist()))))
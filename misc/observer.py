@@ -0,0 +1,70 @@
+"""
+Simulated observers used to drive adaptive procedures without a participant.
+"""
+from __future__ import annotations
+
+import numpy as np
+
+
+class PsychometricObserver(object):
+    """
+    Logistic psychometric function over stimulus time (in frames).
+
+    Probability of a correct answer for stimulus time x is
+    guess + (1 - guess - lapse) / (1 + exp(-(x - threshold) / slope)).
+    Every parameter may be a scalar or an array broadcastable against x,
+    so one object can stand for a whole population of observers.
+    """
+
+    def __init__(self, threshold=10.0, slope=2.0, guess=0.25, lapse=0.02):
+        """
+        Args:
+            threshold: Stimulus time at the inflection point of the function.
+            slope: Spread of the function, in frames. Lower is steeper.
+            guess: Chance level, 1 / no of letters for the saccade task.
+            lapse: Probability of an error regardless of stimulus time.
+        """
+        self.threshold = np.asarray(threshold, dtype=float)
+        self.slope = np.asarray(slope, dtype=float)
+        self.guess = np.asarray(guess, dtype=float)
+        self.lapse = np.asarray(lapse, dtype=float)
+        assert np.all(self.slope > 0), 'Slope must be positive'
+        assert np.all(self.guess + self.lapse < 1), 'Guess and lapse rates leave no room for a psychometric function'
+
+    def p_correct(self, stim_time):
+        """
+        Args:
+            stim_time: Stimulus time in frames, scalar or array.
+
+        Returns:
+            Probability of a correct answer, same shape as broadcast inputs.
+        """
+        x = np.asarray(stim_time, dtype=float)
+        return self.guess + (1 - self.guess - self.lapse) / (1 + np.exp(-(x - self.threshold) / self.slope))
+
+    def respond(self, stim_time, rng: np.random.Generator):
+        """
+        Draw correctness of answers for given stimulus times.
+
+        Args:
+            stim_time: Stimulus time in frames, scalar or array.
+            rng: Source of randomness.
+
+        Returns:
+            Boolean (array) of correct answers.
+        """
+        p = self.p_correct(stim_time)
+        return rng.random(p.shape) < p
+
+    def stim_time_at(self, p):
+        """
+        Inverse of p_correct, i.e. stimulus time at which observer reaches given accuracy.
+
+        Args:
+            p: Target probability of a correct answer.
+
+        Returns:
+            Stimulus time in frames (float or array).
+        """
+        q = (np.asarray(p, dtype=float) - self.guess) / (1 - self.guess - self.lapse)
+        return self.threshold + self.slope * np.log(q / (1 - q))
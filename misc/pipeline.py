@@ -0,0 +1,90 @@
+"""
+Work deferred from timed trial phases to idle windows (feedback, inter-trial interval).
+
+Saving results of a trial, preparing the next one, log flushing and garbage
+collection are queued with defer() and run in the next idle() window. What
+doesn't fit is run by drain() right before the next trial, so fixation of
+every trial starts with nothing pending. Automatic garbage collection is off
+while a scheduler is open, collections are run in idle windows only.
+"""
+from __future__ import annotations
+
+import gc
+import time
+from collections import deque
+from typing import Callable, Tuple
+
+
+class IdleScheduler(object):
+    """
+    FIFO of deferred tasks, run in idle windows.
+
+    Between two trials it counts time of idle windows, time of tasks run in
+    them and time of tasks left for drain(), see last_gap.
+    """
+
+    def __init__(self, wait: Callable[[float], None], full_gc_margin: float = 0.1):
+        """
+        Args:
+            wait: Waits a given no of seconds, e.g. core.wait.
+            full_gc_margin: Full garbage collection is run only if at least that much of an idle window is left,
+                in seconds. Otherwise only the youngest generation is collected.
+        """
+        self._wait = wait
+        self.full_gc_margin = full_gc_margin
+        self._tasks: deque = deque()
+        self._idle = self._work = self._late = 0.0
+        self.last_gap: Tuple[float, float, float] = (0.0, 0.0, 0.0)  # ms idle, ms of it used, ms of drain()
+        gc.collect()
+        gc.freeze()  # Objects made so far (stimuli, config, ...) are never scanned again
+        gc.disable()
+
+    def defer(self, task: Callable, *args) -> None:
+        """
+        Queue a task for the next idle window.
+
+        Args:
+            task: Function to call.
+            *args: Its arguments.
+        """
+        self._tasks.append((task, args))
+
+    def idle(self, secs: float) -> None:
+        """
+        Run queued tasks, collect garbage and wait for the rest of a window.
+
+        Args:
+            secs: Length of a window, in seconds.
+        """
+        start = time.perf_counter()
+        deadline = start + secs
+        while self._tasks and time.perf_counter() < deadline:
+            task, args = self._tasks.popleft()
+            task(*args)
+        if not self._tasks:
+            gc.collect(2 if deadline - time.perf_counter() >= self.full_gc_margin else 0)
+        used = time.perf_counter() - start
+        self._idle += secs
+        self._work += used
+        self._wait(max(0.0, secs - used))
+
+    def drain(self) -> None:
+        """
+        Run every task still queued. Meant for a moment right before fixation of a trial.
+        Closes the gap between trials, see last_gap.
+        """
+        start = time.perf_counter()
+        while self._tasks:
+            task, args = self._tasks.popleft()
+            task(*args)
+        self._late += time.perf_counter() - start
+        self.last_gap = tuple(round(val * 1000, 3) for val in (self._idle, self._work, self._late))
+        self._idle = self._work = self._late = 0.0
+
+    def close(self) -> None:
+        """
+        Run what's left and turn automatic garbage collection back on.
+        """
+        self.drain()
+        gc.enable()
+        gc.unfreeze()
@@ -0,0 +1,151 @@
+"""
+Keyboard responses with device timestamps, collected on a dedicated thread into a ring buffer.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from typing import List, Optional, Sequence, Tuple
+
+import numpy as np
+
+
+class ResponseCollector(object):
+    """
+    Reads keyboard through psychopy.hardware.keyboard, so every key press carries a
+    timestamp taken by a keyboard backend (psychtoolbox, when available) instead of
+    a time at which a trial loop happened to poll events.
+
+    With psychtoolbox a polling thread moves key presses from a device queue into
+    a preallocated ring buffer every **poll_interval**, and trial code only reads
+    the buffer. Without it (pyglet events can't be pumped from another thread)
+    the keyboard is polled directly on every query.
+    RTs are counted from a flip set with reset_clock_on_flip().
+    """
+
+    def __init__(self, key_list: Sequence[str], capacity: int = 256, poll_interval: float = 0.001,
+                 measure: bool = False):
+        """
+        Args:
+            key_list: Keys of interest, others are ignored.
+            capacity: Size of a ring buffer, i.e. max no of key presses waiting to be read.
+            poll_interval: Time between polls of a polling thread, in seconds.
+            measure: Record latency between a key press and the moment it was read, see latency_stats().
+        """
+        from psychopy.hardware import keyboard
+        from psychopy import core
+
+        self._core = core
+        self._kb = keyboard.Keyboard()
+        self.key_list = list(key_list)
+        self.capacity = capacity
+        self.poll_interval = poll_interval
+        self.measure = measure
+        self._keys = np.zeros(capacity, dtype=np.int16)
+        self._rts = np.zeros(capacity, dtype=np.float64)
+        self._t_down = np.zeros(capacity, dtype=np.float64)
+        self._t_polled = np.zeros(capacity, dtype=np.float64)
+        self._write = 0  # Only polling side moves it
+        self._read = 0  # Only reading side moves it
+        self._latencies: List[Tuple[float, float]] = list()  # (poll latency, read latency)
+        self._kb_lock = threading.Lock()  # A poll and clear() must not interleave
+        self._stop = threading.Event()
+        self._thread = None
+        if keyboard.havePTB:
+            self._thread = threading.Thread(target=self._run, name='ResponseCollector', daemon=True)
+            self._thread.start()
+
+    def reset_clock_on_flip(self, win) -> None:
+        """
+        Start counting RTs from the next flip of a window, e.g. a stimulus onset.
+        """
+        win.callOnFlip(self._kb.clock.reset)
+
+    def clear(self) -> None:
+        """
+        Drop every key press collected so far. Waits for a poll in progress, so none of its key presses
+        slips through with an RT counted from an earlier clock reset.
+        """
+        with self._kb_lock:
+            if self._thread is None:
+                self._kb.getKeys(keyList=self.key_list, waitRelease=False, clear=True)
+            self._kb.clearEvents()
+            self._read = self._write
+
+    def get_keys(self) -> List[Tuple[str, float]]:
+        """
+        Returns:
+            List of (key name, RT in seconds) of key presses since the last call, possibly empty. Never blocks.
+        """
+        if self._thread is None:
+            self._poll()
+        read, write = self._read, self._write
+        if read == write:
+            return []
+        now = self._core.getTime()
+        keys = list()
+        for i in range(read, write):
+            idx = i % self.capacity
+            keys.append((self.key_list[self._keys[idx]], float(self._rts[idx])))
+            if self.measure:
+                self._latencies.append((self._t_polled[idx] - self._t_down[idx], now - self._t_down[idx]))
+        self._read = write
+        return keys
+
+    def wait_keys(self, max_wait: float) -> Optional[List[Tuple[str, float]]]:
+        """
+        Args:
+            max_wait: Max time to wait, in seconds.
+
+        Returns:
+            Like get_keys(), or None if nothing was pressed in time.
+        """
+        deadline = time.perf_counter() + max_wait
+        while True:
+            keys = self.get_keys()
+            if keys:
+                return keys
+            if time.perf_counter() >= deadline:
+                return None
+            time.sleep(self.poll_interval)
+
+    def latency_stats(self) -> dict:
+        """
+        Returns:
+            Percentiles (in ms) of latency between key press timestamp and the moment it was taken
+            from keyboard (poll) and read by a procedure (read). Empty if measure was off or nothing pressed.
+        """
+        if not self._latencies:
+            return dict()
+        lat = np.asarray(self._latencies) * 1000
+        stats = dict(n=len(lat))
+        for col, name in enumerate(('poll', 'read')):
+            for q in (50, 95, 99, 100):
+                stats['{}_p{}_ms'.format(name, q)] = round(float(np.percentile(lat[:, col], q)), 3)
+        return stats
+
+    def close(self) -> None:
+        self._stop.set()
+        if self._thread is not None:
+            self._thread.join()
+
+    def _poll(self) -> None:
+        presses = self._kb.getKeys(keyList=self.key_list, waitRelease=False, clear=True)
+        if not presses:
+            return
+        now = self._core.getTime()
+        for press in presses:
+            if self._write - self._read >= self.capacity:
+                break  # buffer full, nobody reads; drop newest
+            idx = self._write % self.capacity
+            self._keys[idx] = self.key_list.index(press.name)
+            self._rts[idx] = press.rt
+            self._t_down[idx] = press.tDown
+            self._t_polled[idx] = now
+            self._write += 1
+
+    def _run(self) -> None:
+        while not self._stop.is_set():
+            with self._kb_lock:
+                self._poll()
+            time.sleep(self.poll_interval)
@@ -0,0 +1,145 @@
+"""
+Streaming, crash-safe writer of behavioral results.
+"""
+from __future__ import annotations
+
+import csv
+import io
+import os
+import queue
+import threading
+from typing import List, Any, Optional
+
+import numpy as np
+
+from misc.trial_record import TrialRecord, RECORD_DTYPE
+
+_ROW, _LOG, _SYNC, _CLOSE = range(4)
+
+
+class ResultsWriter(object):
+    """
+    Writes every trial row to disk as soon as it's appended.
+
+    Rows (and optionally psychopy log messages) are put on a queue and written
+    by a background thread, so the procedure never waits for the disk.
+    Each row is written and flushed to OS as one complete line, so the file is
+    always a valid CSV prefix. sync() additionally fsyncs files, it's meant to
+    be called on block boundaries. TrialRecord rows are converted on the writer
+    thread too, and may also be packed into a binary sidecar file, see
+    misc.trial_record.read_records().
+    """
+
+    def __init__(self, path: str, header: List[str], log_path: Optional[str] = None,
+                 binary_path: Optional[str] = None):
+        """
+        Args:
+            path: Path of CSV file with results.
+            header: Names of columns, written as a first row.
+            log_path: Optional path of a file for psychopy log messages, see log_stream().
+            binary_path: Optional path of a file for TrialRecord rows packed with RECORD_DTYPE.
+        """
+        self.path = path
+        self._queue: queue.Queue = queue.Queue()
+        self._beh_file = open(path, 'w', encoding='utf-8', newline='')
+        self._log_file = open(log_path, 'a', encoding='utf-8') if log_path else None
+        self._bin_file = open(binary_path, 'wb') if binary_path else None
+        self._error: Optional[BaseException] = None
+        self._thread = threading.Thread(target=self._run, name='ResultsWriter', daemon=True)
+        self._thread.start()
+        self.append(header)
+
+    def append(self, row: TrialRecord | List[Any]) -> None:
+        """
+        Schedule one row to be written. Never blocks.
+
+        Args:
+            row: Trial record, or list of values, one per column.
+
+        Raises:
+            Error of a writer thread, if it failed. Rows appended after that would never be written.
+        """
+        self._check()
+        self._queue.put((_ROW, row))
+
+    def sync(self) -> None:
+        """
+        Schedule flush and fsync of all files. Never blocks.
+
+        Raises:
+            Error of a writer thread, if it failed.
+        """
+        self._check()
+        self._queue.put((_SYNC, None))
+
+    def close(self) -> None:
+        """
+        Write everything still in the queue, sync and close files. Blocks until done.
+
+        Raises:
+            Error of a writer thread, also if it stopped before.
+        """
+        if self._thread.is_alive():
+            self._queue.put((_CLOSE, None))
+            self._thread.join()
+        self._check()
+
+    def _check(self) -> None:
+        if self._error is not None:
+            raise RuntimeError('Results writer failed, rows of {} are lost from then on'.format(self.path)) \
+                from self._error
+
+    def log_stream(self) -> _LogStream:
+        """
+        File-like object accepted by psychopy.logging.LogFile, that passes messages to a writer thread.
+
+        Returns:
+            Object with write() and flush() methods.
+        """
+        assert self._log_file is not None, 'ResultsWriter created without log_path'
+        return _LogStream(self._queue)
+
+    def _run(self) -> None:
+        buffer = io.StringIO()
+        writer = csv.writer(buffer)
+        files = [f for f in (self._beh_file, self._log_file, self._bin_file) if f is not None]
+        try:
+            while True:
+                kind, payload = self._queue.get()
+                if kind == _ROW:
+                    if isinstance(payload, TrialRecord):
+                        if self._bin_file is not None:
+                            self._bin_file.write(np.array(payload.as_tuple(), dtype=RECORD_DTYPE).tobytes())
+                            self._bin_file.flush()
+                        payload = payload.csv_row()
+                    writer.writerow(payload)
+                    self._beh_file.write(buffer.getvalue())  # whole line at once
+                    self._beh_file.flush()
+                    buffer.seek(0)
+                    buffer.truncate()
+                elif kind == _LOG:
+                    self._log_file.write(payload)
+                elif kind == _SYNC:
+                    for f in files:
+                        f.flush()
+                        os.fsync(f.fileno())
+                elif kind == _CLOSE:
+                    break
+        except BaseException as err:  # Reported on close(), thread must not die silently
+            self._error = err
+        finally:
+            for f in files:
+                f.flush()
+                os.fsync(f.fileno())
+                f.close()
+
+
+class _LogStream(object):
+    def __init__(self, target: queue.Queue):
+        self._target = target
+
+    def write(self, msg: str) -> None:
+        self._target.put((_LOG, msg))
+
+    def flush(self) -> None:
+        pass  # Flushing is done by a writer thread on sync()
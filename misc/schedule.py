@@ -0,0 +1,158 @@
+"""
+Seeded plan of a whole session, generated up front as a NumPy structured array.
+
+Durations (csi, jitter, stim_time of training trials) are in milliseconds, as in
+config.yaml, so a plan doesn't depend on a refresh rate of a display.
+"""
+from __future__ import annotations
+
+from collections import namedtuple
+from typing import List, Sequence
+
+import numpy as np
+
+SCHEDULE_DTYPE = np.dtype([('trial_type', 'U11'), ('block_no', 'i2'), ('block_type', 'U2'), ('csi', 'i2'),
+                           ('que_side', 'i1'), ('letter', 'U1'), ('mask', 'u1'), ('jitter', 'i2'),
+                           ('stim_time', 'i2')])
+Trial = namedtuple('Trial', SCHEDULE_DTYPE.names)
+ADAPTIVE_STIM_TIME = -1  # Stim time of trials driven by a staircase is decided during a session
+
+
+def new_seed() -> int:
+    """
+    Returns:
+        Fresh random 32 bit seed, drawn from OS entropy.
+    """
+    return int(np.random.SeedSequence().generate_state(1)[0])
+
+
+def build_schedule(conf: dict, seed: int) -> np.ndarray:
+    """
+    Plan every trial of a session: training, adaptive and experimental blocks, in order of presentation.
+
+    Blocks driven by a staircase have unknown length, so they get a pool of
+    SCHEDULE_POOL_SIZE trials (see block_trials()). Counterbalancing: cue side, CSI,
+    letter and mask are drawn in chunks that contain every possible value
+    equally often, so any block is balanced up to one incomplete chunk.
+    The same letter is never planned for two consecutive trials of a block. Staircase blocks
+    use only a part of their pool, or reuse it cyclically, so repeats at block boundaries and
+    pool wraps are removed while a session runs, see shown_trial().
+
+    Args:
+        conf: Procedure config.
+        seed: Seed of random generator, the same seed and config give the same schedule.
+
+    Returns:
+        Structured array with SCHEDULE_DTYPE.
+    """
+    rng = np.random.default_rng(seed)
+    plan = list()  # (trial_type, block_no, block_type, no_trials, stim_time)
+    for block_no, (no_trials, stim_time, block_type) in enumerate(conf['TRAINING_BLOCKS'], start=1):
+        plan.append(('train', block_no, block_type, no_trials, stim_time))
+    for block_no, block_type in enumerate(conf['ADAPTIVE_BLOCKS'], start=1):
+        plan.append(('adaptive', block_no, block_type, conf['SCHEDULE_POOL_SIZE'], ADAPTIVE_STIM_TIME))
+    exp_blocks = conf['EXP_BLOCKS'][rng.integers(len(conf['EXP_BLOCKS']))]  # Half of participants starts with PS
+    for block_no, block_type in enumerate(exp_blocks, start=1):
+        plan.append(('intra_train', block_no, block_type, conf['INTRA_BLOCK_TRAINING'], ADAPTIVE_STIM_TIME))
+        plan.append(('exp', block_no, block_type, conf['SCHEDULE_POOL_SIZE'], ADAPTIVE_STIM_TIME))
+
+    schedule = np.zeros(sum(block[3] for block in plan), dtype=SCHEDULE_DTYPE)
+    start = 0
+    last_letter = ''
+    for trial_type, block_no, block_type, no_trials, stim_time in plan:
+        rows = schedule[start:start + no_trials]
+        rows['trial_type'] = trial_type
+        rows['block_no'] = block_no
+        rows['block_type'] = block_type
+        rows['stim_time'] = stim_time
+        rows['que_side'] = _balanced(rng, [-1, 1], no_trials)
+        rows['csi'] = _balanced(rng, conf['CSI_POSSIBLE'], no_trials)
+        rows['mask'] = _balanced(rng, range(len(conf['MASK_IMAGES'])), no_trials)
+        rows['letter'] = letters = _balanced(rng, list(conf['STIM_LETTERS']), no_trials, last=last_letter)
+        rows['jitter'] = rng.integers(*conf['REST_TIME_RANGE'], size=no_trials)
+        last_letter = letters[-1] if no_trials else last_letter
+        start += no_trials
+    return schedule
+
+
+def exp_blocks_order(schedule: np.ndarray) -> List[str]:
+    """
+    Args:
+        schedule: Session schedule.
+
+    Returns:
+        Block types of experimental blocks, in order of presentation.
+    """
+    exp = schedule[schedule['trial_type'] == 'exp']
+    _, first = np.unique(exp['block_no'], return_index=True)
+    return [str(block_type) for block_type in exp['block_type'][first]]
+
+
+def block_trials(schedule: np.ndarray, trial_type: str, block_no: int) -> List[Trial]:
+    """
+    Rows of one block as plain tuples, so a trial loop doesn't touch NumPy at all.
+
+    Args:
+        schedule: Session schedule.
+        trial_type: One of 'train', 'adaptive', 'intra_train' and 'exp'.
+        block_no: No of block within its trial type, from 1.
+
+    Returns:
+        List of trials. For a block driven by a staircase, index it modulo its
+        length, as the staircase may outlive the pool.
+    """
+    rows = schedule[(schedule['trial_type'] == trial_type) & (schedule['block_no'] == block_no)]
+    return [Trial(*row) for row in rows.tolist()]
+
+
+def shown_trial(trials: List[Trial], idx: int, last_letter: str) -> Trial:
+    """
+    Trial of a block as it's shown: its letter is replaced if it's the letter shown last.
+
+    Args:
+        trials: Trials of a block, see block_trials().
+        idx: Index of a trial, taken modulo no of trials.
+        last_letter: Letter of the trial shown before, '' if none.
+
+    Returns:
+        Planned trial, or a copy of it with a letter other than **last_letter** and the letter planned next.
+    """
+    trial = trials[idx % len(trials)]
+    if trial.letter != last_letter:
+        return trial
+    planned_next = trials[(idx + 1) % len(trials)].letter
+    letters = sorted({other.letter for other in trials} - {last_letter, planned_next})
+    if not letters:
+        return trial  # A block of a single letter can't avoid repeats
+    return trial._replace(letter=letters[idx % len(letters)])
+
+
+def save_schedule(path: str, schedule: np.ndarray, seed: int) -> None:
+    """
+    Save schedule with its seed as .npz, load it back with numpy.load(path).
+
+    Args:
+        path: Output file path.
+        schedule: Session schedule.
+        seed: Seed the schedule was built with.
+    """
+    np.savez(path, schedule=schedule, seed=np.uint32(seed))
+
+
+def _balanced(rng: np.random.Generator, values: Sequence, size: int, last=None) -> np.ndarray:
+    """
+    Draw a sequence made of shuffled chunks, each chunk containing every value once.
+
+    If **last** is given, no value is repeated in two consecutive positions
+    (and the first one differs from **last**), values must be distinct then.
+    """
+    values = np.asarray(values)
+    chunks = list()
+    for _ in range(-(-size // len(values))):
+        chunk = rng.permutation(values)
+        if last is not None and len(values) > 1 and chunk[0] == last:
+            swap = rng.integers(1, len(values))
+            chunk[0], chunk[swap] = chunk[swap], chunk[0]
+        chunks.append(chunk)
+        last = chunk[-1] if last is not None else None
+    return np.concatenate(chunks)[:size] if chunks else values[:0]
@@ -1,45 +1,176 @@
+"""
+Screen resolution and frame rate of a display, with a calibration cache of frame rates.
+
+The display is queried on every launch (xrandr/xdpyinfo/win32api, milliseconds),
+so a window always gets the current resolution. The cache keeps a measured
+frame rate per display and mode (host, output, driver, resolution); with
+a cached rate only a short check is run instead of the full 200-frame
+measurement. The check runs synchronously on the procedure window: it has to
+flip a GL window on the main thread, and the window only exists after the
+info dialog is closed. What's left to overlap with it (decoding of assets)
+is shorter than the check itself.
+"""
+import glob
+import json
+import os
+import platform
+import re
+import subprocess
 from collections import OrderedDict
 
 from psychopy import logging
 
+CALIBRATION_CACHE = '.calibration_cache.json'
+FRAME_RATE_TOLERANCE = 1.0  # Hz, cached and quickly measured rates closer than that are the same rate
 
-def get_screen_res():
+_display = dict()  # Display queried by get_screen_res()
+
+
+def _run(*cmd):
     """
-    Function that check current screen resolution. Raise OSError if can't recognise OS!
-    * :return: (width, height) tuple with screen resolution.
+    Run a command without a shell.
+    * :return: Its stdout, or '' if it can't be run.
+    """
+    try:
+        return subprocess.run(cmd, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL, timeout=5,
+                              universal_newlines=True).stdout
+    except (OSError, subprocess.SubprocessError):
+        return ''
+
+
+def parse_xrandr(output):
+    """
+    Find current mode of a primary (or first connected) output in `xrandr --current` output.
+    * :return: dict with output name, width, height and refresh rate (None if not starred), or None.
+    """
+    modes = list()  # (is_primary, found)
+    name, primary = None, False
+    for line in output.splitlines():
+        if not line[:1].isspace():  # output header, e.g. "HDMI-1 connected primary 1920x1080+0+0 ..."
+            head = re.match(r'^(\S+) connected( primary)?', line)
+            name, primary = (head.group(1), bool(head.group(2))) if head else (None, False)
+            continue
+        mode = re.match(r'^\s+(\d{3,5})x(\d{3,5})\S*\s+(.*)$', line)
+        if name is not None and mode and '*' in mode.group(3):  # current mode is starred, e.g. "60.00*+"
+            rate = re.search(r'([\d.]+)\*', mode.group(3))
+            modes.append((primary, dict(output=name, width=int(mode.group(1)), height=int(mode.group(2)),
+                                        refresh=float(rate.group(1)) if rate else None)))
+    primaries = [found for is_primary, found in modes if is_primary]
+    return (primaries or [found for _, found in modes] or [None])[0]
+
+
+def parse_xdpyinfo(output):
+    """
+    * :return: (width, height) from `xdpyinfo` output, or None.
+    """
+    dims = re.search(r'dimensions:\s+(\d+)x(\d+) pixels', output)
+    return (int(dims.group(1)), int(dims.group(2))) if dims else None
+
+
+def _driver_name():
+    """
+    Name of a kernel graphics driver, read from sysfs. Changes of a driver invalidate calibration.
     """
-    import platform
+    try:
+        with open('/proc/driver/nvidia/version') as version_file:
+            return version_file.readline().strip()
+    except OSError:
+        pass
+    drivers = sorted({os.path.basename(os.path.realpath(path))
+                      for path in glob.glob('/sys/class/drm/card[0-9]/device/driver')})
+    return ','.join(drivers)
 
+
+def query_display():
+    """
+    Ask OS about a current display. Raise OSError if can't recognise OS!
+    * :return: dict with identity (host, output, driver), width, height and refresh rate (None if unknown).
+    """
     system = platform.system()
+    refresh = None
     if 'Linux' in system:
-        import subprocess
-        import re
-
-        output = subprocess.Popen('xrandr | grep "\*" | cut -d" " -f4', shell=True, stdout=subprocess.PIPE)
-        output = str(output.communicate()[0])[2:-3]
-        valid_res = lambda x: re.match('^\d{3,4}x\d{3,4}$', x)
-        if not valid_res(output):
-            output = subprocess.Popen('xdpyinfo | grep dimensions | cut -d" " -f7', shell=True, stdout=subprocess.PIPE)
-            output = str(output.communicate()[0])[2:-3]
-        if not valid_res(output):
-            logging.ERROR('OS ERROR - no way of determine screen res')
-            raise OSError(
-                "Humanity need more time to come up with efficient way of checking screen resolution of your hamster")
-        width, height = map(int, output.split('x'))
+        found = parse_xrandr(_run('xrandr', '--current'))
+        if found:
+            output, width, height, refresh = found['output'], found['width'], found['height'], found['refresh']
+        else:
+            dims = parse_xdpyinfo(_run('xdpyinfo'))
+            if not dims:
+                logging.error('OS ERROR - no way of determine screen res')
+                raise OSError(
+                    "Humanity need more time to come up with efficient way of checking screen resolution of your "
+                    "hamster")
+            output, (width, height) = 'default', dims
+        driver = _driver_name()
     elif 'Windows' in system:
         from win32api import GetSystemMetrics
 
         width = int(GetSystemMetrics(0))
         height = int(GetSystemMetrics(1))
+        output, driver = 'default', ''
     else:  # can't recognise OS
-        logging.ERROR('OS ERROR - no way of determine screen res')
+        logging.error('OS ERROR - no way of determine screen res')
         raise OSError("get_screen_res function can't recognise your OS")
+    identity = '{}|{}|{}'.format(platform.node(), output, driver)
+    return dict(identity=identity, width=width, height=height, refresh=refresh)
+
+
+def _load_cache():
+    try:
+        with open(CALIBRATION_CACHE, encoding='utf-8') as cache_file:
+            return json.load(cache_file)
+    except (OSError, ValueError):
+        return dict()
+
+
+def _save_cache(cache):
+    tmp = CALIBRATION_CACHE + '.tmp'
+    with open(tmp, 'w', encoding='utf-8') as cache_file:
+        json.dump(cache, cache_file, indent=2)
+    os.replace(tmp, CALIBRATION_CACHE)
+
+
+def get_screen_res():
+    """
+    Function that check current screen resolution. Raise OSError if can't recognise OS!
+    Display is always queried, it takes milliseconds.
+    * :return: (width, height) tuple with screen resolution.
+    """
+    _display.clear()
+    _display.update(query_display())
+    width, height = _display['width'], _display['height']
     logging.info('Screen res set as: {}x{}'.format(width, height))
     return OrderedDict(width=width, height=height)
 
 
 def get_frame_rate(win, legal_frame_rates=None):
-    frame_rate = int(round(win.getActualFrameRate(nIdentical=30, nMaxFrames=200)))
+    """
+    Frame rate of a window. Cached rate of a current display is accepted after a short check,
+    the full measurement is run only without cached rate or if the check disagrees with it.
+    * :return: Frame rate, in frames per second.
+    """
+    display = dict(_display) or query_display()
+    mode = '{}|{}x{}'.format(display['identity'], display['width'], display['height'])  # new mode, new calibration
+    cache = _load_cache()
+    entry = cache.get('displays', dict()).get(mode)
+    last = cache.get('last', dict()).get(platform.node())
+    if last not in (None, mode):
+        logging.warning('Display changed since last launch: {} -> {}'.format(last, mode))
+
+    frame_rate = None
+    if entry:
+        quick = win.getActualFrameRate(nIdentical=10, nMaxFrames=60, nWarmUpFrames=10, threshold=1)
+        if quick is not None and abs(quick - entry['frame_rate']) < FRAME_RATE_TOLERANCE and \
+                (display['refresh'] is None or abs(display['refresh'] - entry['frame_rate']) < FRAME_RATE_TOLERANCE):
+            frame_rate = entry['frame_rate']
+            logging.info("Frame rate taken from calibration cache, verified: {:.2f}.".format(quick))
+        else:
+            logging.warning("Cached frame rate {} not verified ({}), recalibrating.".format(entry['frame_rate'],
+                                                                                           quick))
+    if frame_rate is None:
+        frame_rate = int(round(win.getActualFrameRate(nIdentical=30, nMaxFrames=200)))
+        cache.setdefault('displays', dict())[mode] = dict(frame_rate=frame_rate)
+    cache.setdefault('last', dict())[platform.node()] = mode
+    _save_cache(cache)
     logging.info("Detected framerate: {} frames per sec.".format(frame_rate))
     if legal_frame_rates:
         assert frame_rate in legal_frame_rates, 'Illegal frame rate : {}.'.format(frame_rate)
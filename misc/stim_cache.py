@@ -0,0 +1,141 @@
+"""
+Stimuli built once per session, so trials only pick ready to draw objects.
+"""
+from __future__ import annotations
+
+import time
+from typing import Dict, Hashable, Callable, Any
+
+from misc.assets import AssetManager
+from misc.backend import visual, logging
+
+
+class StimulusCache(object):
+    """
+    Holds every stimulus object used in trials, each one already at its final text and position.
+
+    Changing text or position of a psychopy stimulus makes it re-layout (and for
+    text, re-render texture), so instead of mutating a few shared objects
+    the cache keeps a separate object for every letter/side, cue position and
+    feedback message. Requests for objects that weren't built up front are
+    still served (and kept), but counted as misses.
+    """
+
+    def __init__(self, win: visual.Window, conf: dict, assets: AssetManager, feedback_color: str = 'black'):
+        """
+        Args:
+            win: Procedure main window.
+            conf: Procedure config.
+            assets: Preloaded session assets, source of mask images.
+            feedback_color: Color of a feedback letters.
+        """
+        self.win = win
+        self.conf = conf
+        self.assets = assets
+        self.feedback_color = feedback_color
+        self.hits = 0
+        self.misses = 0
+        self.missed_keys = list()
+        self._stims: Dict[Hashable, Any] = dict()
+        self._building = True
+
+        start = time.perf_counter()
+        self.fix_cross = visual.TextStim(win, text='+', height=100, color=conf['FIX_CROSS_COLOR'])
+        separator = [' ' * conf['REACTION_KEYS_SEP']] * len(conf['REACTION_KEYS'])
+        self.question_frame = visual.TextStim(win, text="".join(["".join(x) for x in zip(conf['STIM_LETTERS'],
+                                                                                         separator)]),
+                                              height=30, pos=(100, -300), color=conf['FIX_CROSS_COLOR'],
+                                              wrapWidth=10000)
+        self.question_label = visual.TextStim(win, text="".join(["".join(x) for x in zip(conf['REACTION_KEYS'],
+                                                                                         separator)]),
+                                              height=30, pos=(100, -330), color=conf['FIX_CROSS_COLOR'],
+                                              wrapWidth=10000)
+        for side in (-conf['STIM_SHIFT'], conf['STIM_SHIFT']):
+            for letter in conf['STIM_LETTERS']:
+                self.letter(letter, side)
+            for image in conf['MASK_IMAGES']:
+                self.mask(side, image)
+            for blink in range(2):
+                self.cue(side, blink)
+        for corr in (True, False):
+            self.feedback(corr)
+        # Draw everything once on back buffer, so textures are on GPU before the first trial
+        for stim in [self.fix_cross, self.question_frame, self.question_label, *self._stims.values()]:
+            stim.draw()
+        win.clearBuffer()
+        self.build_time = time.perf_counter() - start
+        self._building = False
+
+    def letter(self, letter: str, x: int) -> visual.TextStim:
+        """
+        Args:
+            letter: One of STIM_LETTERS.
+            x: Horizontal position of letter.
+
+        Returns:
+            Stimulus with given letter at given position.
+        """
+        return self._get(('letter', letter, x),
+                         lambda: visual.TextStim(self.win, text=letter, pos=(x, 0), height=self.conf['STIM_SIZE'],
+                                                 color=self.conf['STIM_COLOR']))
+
+    def mask(self, x: int, image: str) -> visual.ImageStim:
+        """
+        Args:
+            x: Horizontal position of mask.
+            image: File name of mask image, one of MASK_IMAGES.
+
+        Returns:
+            Mask at given position.
+        """
+        return self._get(('mask', image, x),
+                         lambda: visual.ImageStim(self.win, image=self.assets.images[image], pos=(x, 0),
+                                                  size=(self.conf['STIM_SIZE'], self.conf['STIM_SIZE'])))
+
+    def cue(self, que_pos: int, blink: int) -> visual.Circle:
+        """
+        Cue is blinking and moving around its position, it's shifted right on even blinks and left on odd ones.
+
+        Args:
+            que_pos: Horizontal position of cue.
+            blink: No of blink.
+
+        Returns:
+            Cue for given blink.
+        """
+        shift = self.conf['QUE_SHIFT'] if blink % 2 == 0 else -self.conf['QUE_SHIFT']
+        return self._get(('cue', que_pos, blink % 2),
+                         lambda: visual.Circle(self.win, radius=self.conf['QUE_RADIUS'], pos=(que_pos + shift, 0),
+                                               fillColor=self.conf['QUE_COLOR'], lineColor=self.conf['QUE_COLOR']))
+
+    def feedback(self, corr: bool) -> visual.TextStim:
+        """
+        Args:
+            corr: Trial correctness.
+
+        Returns:
+            Feedback message for given correctness.
+        """
+        return self._get(('feedback', corr),
+                         lambda: visual.TextStim(self.win, text="Poprawnie" if corr else "Niepoprawnie", height=50,
+                                                 color=self.feedback_color))
+
+    def stats(self) -> dict:
+        """
+        Returns:
+            Dict with no of cached objects, hits, misses, keys that missed and build time in ms.
+        """
+        return dict(size=len(self._stims), hits=self.hits, misses=self.misses, missed_keys=list(self.missed_keys),
+                    build_time_ms=round(self.build_time * 1000, 1))
+
+    def _get(self, key: Hashable, build: Callable[[], Any]) -> Any:
+        stim = self._stims.get(key)
+        if stim is None:
+            if not self._building:
+                self.misses += 1
+                self.missed_keys.append(key)
+                logging.warning('Stimulus cache miss: {}'.format(key))
+            stim = self._stims[key] = build()
+        else:
+            self.hits += 1
+        return stim
@@ -0,0 +1,244 @@
+"""
+Design sweep: simulated sessions for every combination of config.yaml overrides.
+
+    python -m misc.sweep sweep.yaml --out sweep.csv --cache sweep_cache --workers 8
+
+A sweep file (see sweep.yaml) lists values of config keys (OVERRIDES, in
+config.yaml units), simulated observers (OBSERVERS) and no of SESSIONS.
+Every combination of overrides is run against every observer: SESSIONS
+sessions laid out as in main(), i.e. training blocks, an adaptive staircase
+per ADAPTIVE_BLOCKS, then for every experimental block its intra block
+training and an experimental staircase starting from the value the adaptive
+one ended with. Sessions of a combination run at once, every staircase of
+a session plan is one NUpNDownBatch of SESSIONS staircases. Staircases are
+always NUpNDown, whatever ADAPTIVE_METHOD says.
+
+Reported per combination and observer: no of trials and session length
+(mean and sd, instructions and breaks not counted), and for every block type
+the threshold estimate (mean stim time at reversals of experimental
+staircases, as in misc.ingest) against stim time at which an observer
+reaches the accuracy a staircase converges to: bias, sd and RMSE, in ms.
+
+Results are cached per combination and observer in --cache, keyed by a hash
+of an effective config, observer and sweep settings, so a repeated or
+extended sweep only simulates what's new.
+"""
+from __future__ import annotations
+
+import argparse
+import csv
+import hashlib
+import itertools
+import json
+import os
+import time
+from concurrent.futures import ProcessPoolExecutor
+from os.path import join
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+import yaml
+
+from Adaptives.NUpNDownBatch import NUpNDownBatch
+from misc import durations
+from misc.observer import PsychometricObserver
+
+SWEEP_VERSION = 1  # Part of cache keys, change it with the simulation
+FEEDBACK_MS = 1000  # As in show_feedback()
+
+
+def target_accuracy(n_up: int, n_down: int) -> float:
+    """
+    Accuracy a staircase converges to: the one where a run of n_up correct answers (step down) comes
+    before a run of n_down errors (step up) with probability 0.5.
+
+    Args:
+        n_up: N_UP of a staircase.
+        n_down: N_DOWN of a staircase.
+
+    Returns:
+        Probability of a correct answer, e.g. 0.707 for 2 and 1.
+    """
+    low, high = 0.0, 1.0
+    for _ in range(50):
+        p = (low + high) / 2
+        q = 1 - p
+        first = p ** (n_up - 1) * (1 - q ** n_down) / (p ** (n_up - 1) + q ** (n_down - 1) -
+                                                       p ** (n_up - 1) * q ** (n_down - 1))
+        low, high = (p, high) if first < 0.5 else (low, p)
+    return (low + high) / 2
+
+
+def run_staircases(batch: NUpNDownBatch, observer: PsychometricObserver, rng: np.random.Generator,
+                   max_iters: Optional[int] = None) -> Tuple[np.ndarray, np.ndarray]:
+    """
+    Run every staircase of a batch to its end, like NUpNDownBatch.simulate(), but with a cap like NUpNDownMaxIters.
+
+    Args:
+        batch: Staircases, one per simulated session.
+        observer: Observer answering them.
+        rng: Source of randomness.
+        max_iters: Max no of trials of a staircase, None for no cap.
+
+    Returns:
+        No of trials and sum of stim times (frames) of every staircase.
+    """
+    cap = np.inf if max_iters is None else max_iters
+    trials = np.zeros(batch.size, dtype=np.int64)
+    stim_sum = np.zeros(batch.size)
+    for val in batch:
+        batch.active &= trials < cap
+        if not batch.active.any():
+            break
+        trials += batch.active
+        stim_sum += val * batch.active
+        batch.set_corr(observer.respond(val, rng))
+    return trials, stim_sum
+
+
+def simulate_sessions(conf: dict, observer: dict, sessions: int, seed: int, rt: float = 600) -> Dict[str, float]:
+    """
+    Args:
+        conf: Procedure config, durations in frames (see misc.durations.frames_config()).
+        observer: PS and AS (stim time at the middle of a psychometric function, ms), SLOPE (ms) and LAPSE.
+        sessions: No of simulated sessions.
+        seed: Seed of a random generator.
+        rt: Mean reaction time from stimulus onset, ms.
+
+    Returns:
+        Summary of sessions, see module docstring.
+    """
+    rng = np.random.default_rng(seed)
+    frame_ms = 1000 / conf['FRAME_RATE']
+    observers = {block_type: PsychometricObserver(threshold=observer[block_type] / frame_ms,
+                                                  slope=observer['SLOPE'] / frame_ms,
+                                                  guess=1 / len(conf['STIM_LETTERS']), lapse=observer['LAPSE'])
+                 for block_type in ('PS', 'AS')}
+    # Time of a trial without its stimulus: fixation, mean CSI, cue, mask and answer
+    trial_ms = (conf['FIX_CROSS_TIME'] + conf['QUE_FREQ'] * conf['QUE_SPEED'] + conf['MASK_TIME']) * frame_ms + \
+        np.mean(conf['CSI_POSSIBLE']) + max(0.0, rt - conf['MASK_TIME'] * frame_ms)
+    iti_ms = np.mean(conf['REST_TIME_RANGE'])
+    staircase = dict(n_up=conf['N_UP'], n_down=conf['N_DOWN'], step_up=conf['STAIR_STEP'],
+                     step_down=conf['STAIR_STEP'], min_revs=conf['STOP_MIN_REVS'])
+
+    no_trials = np.zeros(sessions)
+    length_ms = np.zeros(sessions)
+
+    def add(trials, stim_sum, pause_ms: float) -> None:
+        nonlocal no_trials, length_ms
+        no_trials = no_trials + trials
+        length_ms = length_ms + trials * (trial_ms + pause_ms) + stim_sum * frame_ms
+
+    for block_trials, stim_time, _ in conf['TRAINING_BLOCKS']:
+        add(block_trials, block_trials * stim_time, FEEDBACK_MS)
+    start_stim_times = dict()
+    for block_type in conf['ADAPTIVE_BLOCKS']:
+        batch = NUpNDownBatch(sessions, max_revs=conf['MAX_REVS_TRAIN'],
+                              start_val=conf[f'START_STIM_TIME_{block_type}'], **staircase)
+        add(*run_staircases(batch, observers[block_type], rng, conf['MAX_TRIALS_TRAIN']), FEEDBACK_MS)
+        start_stim_times[block_type] = batch.get_curr_val().copy()
+    revs_sum = {block_type: np.zeros(sessions) for block_type in ('PS', 'AS')}
+    revs_count = {block_type: np.zeros(sessions) for block_type in ('PS', 'AS')}
+    for block_type in conf['EXP_BLOCKS'][0]:  # Both orders have the same blocks
+        intra = conf['INTRA_BLOCK_TRAINING']
+        add(intra, intra * (1.5 * start_stim_times[block_type]).astype(int), FEEDBACK_MS + iti_ms)
+        batch = NUpNDownBatch(sessions, max_revs=conf['MAX_REVS_EXP'], start_val=start_stim_times[block_type],
+                              max_se=conf['STOP_MAX_SE'], **staircase)
+        add(*run_staircases(batch, observers[block_type], rng, conf['MAX_TRIALS_EXP']), iti_ms)
+        revs_sum[block_type] += batch.revs_mean * batch.revs_count
+        revs_count[block_type] += batch.revs_count
+
+    summary = dict(trials_mean=no_trials.mean(), trials_sd=no_trials.std(),
+                   session_min_mean=length_ms.mean() / 60000, session_min_sd=length_ms.std() / 60000)
+    target = target_accuracy(conf['N_UP'], conf['N_DOWN'])
+    for block_type in ('PS', 'AS'):
+        found = revs_count[block_type] > 0
+        estimate = revs_sum[block_type][found] / revs_count[block_type][found] * frame_ms
+        true = float(observers[block_type].stim_time_at(target)) * frame_ms
+        summary.update({f'true_ms_{block_type}': true,
+                        f'bias_ms_{block_type}': estimate.mean() - true if len(estimate) else np.nan,
+                        f'sd_ms_{block_type}': estimate.std() if len(estimate) else np.nan,
+                        f'rmse_ms_{block_type}': np.sqrt(np.mean((estimate - true) ** 2)) if len(estimate) else np.nan,
+                        f'no_estimate_{block_type}': 1 - found.mean()})
+    return {key: round(float(val), 4) for key, val in summary.items()}
+
+
+def _task(args: Tuple[dict, dict, int, int, float]) -> Dict[str, float]:
+    return simulate_sessions(*args)
+
+
+def task_key(conf: dict, observer: dict, sessions: int, seed: int, rt: float) -> str:
+    """
+    Returns:
+        Cache key of a combination: hash of everything its result depends on.
+    """
+    blob = json.dumps([SWEEP_VERSION, conf, observer, sessions, seed, rt], sort_keys=True, default=str)
+    return hashlib.sha1(blob.encode()).hexdigest()
+
+
+def run_sweep(spec: dict, base_conf: dict, cache_dir: str, workers: Optional[int] = None) -> Tuple[List[Dict], int]:
+    """
+    Args:
+        spec: Sweep file contents, see sweep.yaml.
+        base_conf: Procedure config the overrides are applied to, durations in ms.
+        cache_dir: Directory of cached results.
+        workers: No of worker processes, no of CPUs if None.
+
+    Returns:
+        One row per combination and observer, with overrides, observer and its summary,
+        and no of combinations simulated (not taken from cache).
+    """
+    os.makedirs(cache_dir, exist_ok=True)
+    keys = sorted(spec['OVERRIDES'])
+    tasks, rows = list(), list()
+    for values in itertools.product(*(spec['OVERRIDES'][key] for key in keys)):
+        overrides = dict(zip(keys, values))
+        conf = durations.frames_config(dict(base_conf, **overrides), spec['FRAME_RATE'])
+        for observer in spec['OBSERVERS']:
+            observer = dict(dict(SLOPE=33.3, LAPSE=0.02), **observer)
+            key = task_key(conf, observer, spec['SESSIONS'], spec['SEED'], spec['RT'])
+            rows.append(dict(overrides, **{f'obs_{name}': val for name, val in observer.items()}, _key=key))
+            tasks.append((key, (conf, observer, spec['SESSIONS'], int(key[:15], 16) ^ spec['SEED'], spec['RT'])))
+
+    results = dict()
+    for key, _ in tasks:
+        path = join(cache_dir, key + '.json')
+        if os.path.exists(path):
+            with open(path, encoding='utf-8') as cached:
+                results[key] = json.load(cached)
+    todo = list({key: args for key, args in tasks if key not in results}.items())
+    if todo:
+        with ProcessPoolExecutor(max_workers=workers) as pool:
+            chunksize = max(1, len(todo) // (4 * (workers or os.cpu_count() or 1)))
+            for (key, _), summary in zip(todo, pool.map(_task, [args for _, args in todo], chunksize=chunksize)):
+                results[key] = summary
+                tmp = join(cache_dir, key + '.tmp')
+                with open(tmp, 'w', encoding='utf-8') as cached:
+                    json.dump(summary, cached)
+                os.replace(tmp, join(cache_dir, key + '.json'))
+    for row in rows:
+        row.update(results[row.pop('_key')])
+    return rows, len(todo)
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Simulated sessions for a grid of config overrides.')
+    parser.add_argument('sweep', help='Sweep file, see sweep.yaml.')
+    parser.add_argument('--config', default='config.yaml')
+    parser.add_argument('--out', default='sweep.csv')
+    parser.add_argument('--cache', default='sweep_cache')
+    parser.add_argument('--workers', type=int, default=None)
+    args = parser.parse_args()
+
+    spec = dict(SESSIONS=200, SEED=0, FRAME_RATE=60, RT=600, OBSERVERS=[dict(PS=167, AS=333)])
+    spec.update(yaml.load(open(args.sweep, encoding='utf-8'), Loader=yaml.SafeLoader))
+    base_conf = yaml.load(open(args.config, encoding='utf-8'), Loader=yaml.SafeLoader)
+    start = time.perf_counter()
+    rows, simulated = run_sweep(spec, base_conf, args.cache, args.workers)
+    with open(args.out, 'w', encoding='utf-8', newline='') as out_file:
+        writer = csv.DictWriter(out_file, fieldnames=list(rows[0]))
+        writer.writeheader()
+        writer.writerows({key: json.dumps(val) if isinstance(val, (list, dict)) else val for key, val in row.items()}
+                         for row in rows)
+    print('{} rows ({} simulated, {} cached) written to {} in {:.1f} s.'.format(
+        len(rows), simulated, len(rows) - simulated, args.out, time.perf_counter() - start))
@@ -0,0 +1,157 @@
+"""
+Trial timeline: phases declared in config, compiled into a per-frame list and run in one loop.
+
+TRIAL_TIMELINE in config.yaml is a list of phases, shown one after another:
+
+    - { phase: que, frames: [ QUE_FREQ, QUE_SPEED ], draw: [ cue ] }
+
+phase: one of misc.frame_timing.PHASES (except resp), recorded with every flip.
+frames: no of frames, as a number, a config key, a trial value (see TRIAL_VALUES)
+    or a list of them multiplied together.
+draw: names of stimuli drawn on every frame of a phase, see DRAWABLES.
+on_start: names of actions run before the first frame of a phase, see ACTIONS.
+poll_keys: if true, keys are polled before every frame and a key press ends the timeline.
+"""
+from __future__ import annotations
+
+from typing import Callable, Dict, List, Sequence, Tuple
+
+from misc import frame_timing
+
+TRIAL_VALUES = ('csi', 'stim_time')
+PHASE_IDS = {name: phase for phase, name in enumerate(frame_timing.PHASES)}
+
+
+class TrialContext(object):
+    """
+    Everything a drawable or an action of one trial may need.
+    """
+
+    def __init__(self, win, conf: dict, stims, responses, que_pos: int, stim_pos: int, letter: str, mask: str):
+        self.win = win
+        self.conf = conf
+        self.stims = stims
+        self.responses = responses
+        self.que_pos = que_pos
+        self.stim_pos = stim_pos
+        self.letter = letter
+        self.mask = mask
+
+
+def _cue(ctx: TrialContext, frame: int):
+    return ctx.stims.cue(ctx.que_pos, frame // ctx.conf['QUE_SPEED'])  # moves every QUE_SPEED frames
+
+
+def _start_rt(ctx: TrialContext) -> None:
+    ctx.responses.reset_clock_on_flip(ctx.win)  # RT is counted from the next flip
+    ctx.responses.clear()
+
+
+# name -> function(context, frame no within phase) returning a stimulus
+DRAWABLES: Dict[str, Callable] = dict(fix_cross=lambda ctx, frame: ctx.stims.fix_cross,
+                                      cue=_cue,
+                                      stim=lambda ctx, frame: ctx.stims.letter(ctx.letter, ctx.stim_pos),
+                                      mask=lambda ctx, frame: ctx.stims.mask(ctx.stim_pos, ctx.mask))
+# name -> function(context)
+ACTIONS: Dict[str, Callable] = dict(start_rt=_start_rt)
+
+
+class Timeline(object):
+    """
+    Compiled trial: for every frame a tuple of (draw methods, phase, actions, poll flag).
+    """
+
+    def __init__(self, frames: List[Tuple[tuple, int, tuple, bool]]):
+        self.frames = frames
+
+    def __len__(self) -> int:
+        return len(self.frames)
+
+    def run(self, frame_timer: frame_timing.FrameTimer, poll_keys: Callable[[], List]) -> List:
+        """
+        Show every frame.
+
+        Args:
+            frame_timer: Flips a window and records flips.
+            poll_keys: Called before frames of poll_keys phases, returns list of key presses.
+
+        Returns:
+            Key presses that ended the timeline, empty list if it ran to the end.
+        """
+        flip = frame_timer.flip
+        for draws, phase, actions, poll in self.frames:
+            for action in actions:
+                action()
+            if poll:
+                keys = poll_keys()
+                if keys:
+                    return keys
+            for draw in draws:
+                draw()
+            flip(phase)
+        return []
+
+
+def no_frames(spec, conf: dict, values: Dict[str, int]) -> int:
+    """
+    Args:
+        spec: frames entry of a phase.
+        conf: Procedure config.
+        values: Trial values, see TRIAL_VALUES.
+
+    Returns:
+        No of frames.
+    """
+    if isinstance(spec, (list, tuple)):
+        total = 1
+        for part in spec:
+            total *= no_frames(part, conf, values)
+        return total
+    if isinstance(spec, int):
+        return spec
+    if spec in values:
+        return int(values[spec])
+    if spec in conf:
+        return int(conf[spec])
+    raise ValueError('Unknown no of frames in TRIAL_TIMELINE: {}'.format(spec))
+
+
+def check_timeline(phases: Sequence[dict]) -> None:
+    """
+    Fail early, before a session starts, on a misspelled timeline.
+
+    Args:
+        phases: TRIAL_TIMELINE from config.
+    """
+    for phase in phases:
+        unknown = set(phase) - {'phase', 'frames', 'draw', 'on_start', 'poll_keys'}
+        if unknown or phase.get('phase') not in PHASE_IDS or phase['phase'] == 'resp' or 'frames' not in phase:
+            raise ValueError('Illegal TRIAL_TIMELINE phase: {}'.format(phase))
+        for name in phase.get('draw', []):
+            if name not in DRAWABLES:
+                raise ValueError('Unknown drawable in TRIAL_TIMELINE: {}'.format(name))
+        for name in phase.get('on_start', []):
+            if name not in ACTIONS:
+                raise ValueError('Unknown action in TRIAL_TIMELINE: {}'.format(name))
+
+
+def compile_trial(phases: Sequence[dict], ctx: TrialContext, values: Dict[str, int]) -> Timeline:
+    """
+    Args:
+        phases: TRIAL_TIMELINE from config.
+        ctx: Trial context.
+        values: Trial values, see TRIAL_VALUES.
+
+    Returns:
+        Timeline ready to run.
+    """
+    frames = list()
+    for phase in phases:
+        phase_id = PHASE_IDS[phase['phase']]
+        drawables = [DRAWABLES[name] for name in phase.get('draw', [])]
+        actions = tuple(lambda action=ACTIONS[name]: action(ctx) for name in phase.get('on_start', []))
+        poll = bool(phase.get('poll_keys', False))
+        for frame in range(no_frames(phase['frames'], ctx.conf, values)):
+            draws = tuple(drawable(ctx, frame).draw for drawable in drawables)
+            frames.append((draws, phase_id, actions if frame == 0 else (), poll))
+    return Timeline(frames)
@@ -0,0 +1,152 @@
+"""
+Typed record of one trial, the single row format of behavioral results.
+
+Durations are in frames (CSI, Stimulus Time) with nominal ms next to them.
+
+Every column has a name in the CSV header, an attribute of TrialRecord and a
+NumPy dtype (RECORD_DTYPE) for binary export. None marks a missing value,
+written as '-' to CSV and as a typed sentinel (MISSING) to binary files.
+"""
+from __future__ import annotations
+
+from typing import List, Optional
+
+import numpy as np
+
+from misc import frame_timing
+
+MISSING_INT = -1  # Binary value of a missing integer
+MISSING_LEVEL = -128  # Level and Sacc_dir are -1, 0 or 1, so they need a different sentinel
+MISSING_CSV = '-'
+
+PART_ID_MAX_LEN = 32  # Longer ones would be cut short in binary files, main() rejects them
+
+# (CSV column, attribute, dtype, binary missing value)
+COLUMNS = [('PART_ID', 'part_id', 'U{}'.format(PART_ID_MAX_LEN), ''),
+           ('Block_no', 'block_no', 'i2', MISSING_INT),
+           ('Trial_no', 'trial_no', 'i4', MISSING_INT),
+           ('Block_type', 'block_type', 'U2', ''),
+           ('Trial_type', 'trial_type', 'U11', ''),
+           ('CSI', 'csi', 'i2', MISSING_INT),
+           ('CSI_ms', 'csi_ms', 'f4', np.nan),
+           ('Stim_letter', 'stim_letter', 'U1', ''),
+           ('Key_pressed', 'key_pressed', 'U8', ''),
+           ('letter_choose', 'letter_choose', 'U9', ''),
+           ('Rt', 'rt', 'f8', np.nan),
+           ('Corr', 'corr', '?', False),
+           ('Stimulus Time', 'stim_time', 'i2', MISSING_INT),
+           ('Stim_time_ms', 'stim_time_ms', 'f4', np.nan),
+           ('Frame_rate', 'frame_rate', 'i2', MISSING_INT),
+           ('Level', 'level', 'i1', MISSING_LEVEL),
+           ('Reversal', 'reversal', 'i1', MISSING_INT),
+           ('Revs_count', 'revs_count', 'i2', MISSING_INT),
+           ('Thr_est', 'thr_est', 'f4', np.nan),
+           ('Thr_se', 'thr_se', 'f4', np.nan),
+           ('Gaze_samples', 'gaze_samples', 'i4', MISSING_INT),
+           ('Sacc_latency_ms', 'sacc_latency_ms', 'f4', np.nan),
+           ('Sacc_dir', 'sacc_dir', 'i1', MISSING_LEVEL),
+           ('Sacc_corr', 'sacc_corr', 'i1', MISSING_INT),
+           ('Idle_ms', 'idle_ms', 'f4', np.nan),
+           ('Idle_used_ms', 'idle_used_ms', 'f4', np.nan),
+           ('Late_work_ms', 'late_work_ms', 'f4', np.nan),
+           # frame_timing.HEADER
+           ('Stim_dur_ms', 'stim_dur_ms', 'f4', np.nan),
+           ('Dropped_fix', 'dropped_fix', 'i2', MISSING_INT),
+           ('Dropped_csi', 'dropped_csi', 'i2', MISSING_INT),
+           ('Dropped_que', 'dropped_que', 'i2', MISSING_INT),
+           ('Dropped_stim', 'dropped_stim', 'i2', MISSING_INT),
+           ('Dropped_mask', 'dropped_mask', 'i2', MISSING_INT),
+           ('Overrun_frames', 'overrun_frames', 'i2', MISSING_INT)]
+HEADER = [column for column, _, _, _ in COLUMNS]
+FIELDS = [field for _, field, _, _ in COLUMNS]
+MISSING = [missing for _, _, _, missing in COLUMNS]
+RECORD_DTYPE = np.dtype([(field, dtype) for _, field, dtype, _ in COLUMNS])
+TIMING_FIELDS = [column.lower() for column in frame_timing.HEADER]
+assert HEADER[-len(frame_timing.HEADER):] == frame_timing.HEADER, 'Frame timing columns out of date'
+
+
+class TrialRecord(object):
+    """
+    One row of results. Attributes not given on creation are missing (None).
+    """
+    __slots__ = FIELDS
+    part_id: str
+    block_no: Optional[int]
+    trial_no: int
+    block_type: str
+    trial_type: str
+    csi: int
+    csi_ms: Optional[float]
+    stim_letter: str
+    key_pressed: str
+    letter_choose: str
+    rt: float
+    corr: bool
+    stim_time: int
+    stim_time_ms: Optional[float]
+    frame_rate: Optional[int]
+    level: Optional[int]
+    reversal: Optional[int]
+    revs_count: Optional[int]
+    thr_est: Optional[float]
+    thr_se: Optional[float]
+    gaze_samples: Optional[int]
+    sacc_latency_ms: Optional[float]
+    sacc_dir: Optional[int]
+    sacc_corr: Optional[int]
+    idle_ms: Optional[float]
+    idle_used_ms: Optional[float]
+    late_work_ms: Optional[float]
+    stim_dur_ms: Optional[float]
+    dropped_fix: Optional[int]
+    dropped_csi: Optional[int]
+    dropped_que: Optional[int]
+    dropped_stim: Optional[int]
+    dropped_mask: Optional[int]
+    overrun_frames: Optional[int]
+
+    def __init__(self, **values):
+        for field in FIELDS:
+            setattr(self, field, values.pop(field, None))
+        assert not values, 'Unknown fields: {}'.format(', '.join(values))
+
+    def csv_row(self) -> List:
+        """
+        Returns:
+            Values in HEADER order, MISSING_CSV for missing ones.
+        """
+        return [MISSING_CSV if val is None else val for val in (getattr(self, field) for field in FIELDS)]
+
+    def as_tuple(self) -> tuple:
+        """
+        Returns:
+            Values in RECORD_DTYPE order, sentinels for missing ones.
+        """
+        return tuple(miss if val is None else val
+                     for val, miss in zip((getattr(self, field) for field in FIELDS), MISSING))
+
+    def __repr__(self) -> str:
+        return 'TrialRecord({})'.format(', '.join('{}={!r}'.format(field, getattr(self, field)) for field in FIELDS))
+
+
+def to_array(records: List[TrialRecord]) -> np.ndarray:
+    """
+    Args:
+        records: Trial records.
+
+    Returns:
+        Structured array with RECORD_DTYPE.
+    """
+    return np.array([record.as_tuple() for record in records], dtype=RECORD_DTYPE)
+
+
+def read_records(path: str) -> np.ndarray:
+    """
+    Args:
+        path: Binary file written by ResultsWriter (records packed back to back with RECORD_DTYPE).
+
+    Returns:
+        Structured array with RECORD_DTYPE. A partially written last record, e.g. after a crash, is skipped.
+    """
+    raw = np.fromfile(path, dtype=np.uint8)
+    return raw[:len(raw) - len(raw) % RECORD_DTYPE.itemsize].view(RECORD_DTYPE)
@@ -0,0 +1,46 @@
+"""
+Letters of consecutive trials, in a plan and in whole headless sessions.
+"""
+import csv
+import glob
+import shutil
+import subprocess
+import sys
+from os.path import abspath, dirname, join
+
+import pytest
+import yaml
+
+from misc.schedule import block_trials, build_schedule, shown_trial
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+
+def _conf() -> dict:
+    return yaml.load(open(join(ROOT, 'config.yaml'), encoding='utf-8'), Loader=yaml.SafeLoader)
+
+
+def test_shown_trial_breaks_repeats_at_pool_wrap():
+    trials = block_trials(build_schedule(_conf(), seed=7), 'exp', 1)
+    last = ''
+    for idx in range(3 * len(trials)):  # staircase outliving its pool twice
+        trial = shown_trial(trials, idx, last)
+        assert trial.letter != last
+        last = trial.letter
+
+
+@pytest.mark.parametrize('seed', [1, 2, 3])
+def test_headless_session_has_no_letter_repeats(tmp_path, seed):
+    for name in ('messages', 'images'):
+        shutil.copytree(join(ROOT, name), join(tmp_path, name))
+    with open(join(tmp_path, 'config.yaml'), 'w', encoding='utf-8') as conf_file:
+        yaml.safe_dump(dict(_conf(), SEED=seed), conf_file, allow_unicode=True)
+    subprocess.run([sys.executable, join(ROOT, 'main.py'), '--headless', '--part-id', 'T{}'.format(seed)],
+                   cwd=tmp_path, env=dict(PYTHONPATH=ROOT), check=True, stdout=subprocess.DEVNULL)
+
+    beh_path, = glob.glob(join(tmp_path, 'results', '*_beh.csv'))
+    with open(beh_path, encoding='utf-8', newline='') as beh_file:
+        rows = list(csv.DictReader(beh_file))
+    assert len(rows) > 100
+    repeats = [row['Trial_no'] for prev, row in zip(rows, rows[1:]) if prev['Stim_letter'] == row['Stim_letter']]
+    assert not repeats, 'Letter repeated in trials {}'.format(repeats)
@@ -0,0 +1,39 @@
+"""
+Participant ids in binary results, and rejection of ones too long for them.
+"""
+import os
+import shutil
+import subprocess
+import sys
+from os.path import abspath, dirname, join
+
+from misc.trial_record import PART_ID_MAX_LEN, TrialRecord, to_array
+
+ROOT = dirname(dirname(abspath(__file__)))
+
+
+def test_longest_part_id_kept_in_binary_records():
+    part_id = 'P' * (PART_ID_MAX_LEN - 3) + 'M20'
+    assert to_array([TrialRecord(part_id=part_id, trial_no=1)])['part_id'][0] == part_id
+
+
+def _headless(tmp_path, part_id: str) -> subprocess.CompletedProcess:
+    for name in ('messages', 'images'):
+        shutil.copytree(join(ROOT, name), join(tmp_path, name))
+    shutil.copy(join(ROOT, 'config.yaml'), tmp_path)
+    return subprocess.run([sys.executable, join(ROOT, 'main.py'), '--headless', '--part-id', part_id],
+                          cwd=tmp_path, env=dict(PYTHONPATH=ROOT), stdout=subprocess.DEVNULL,
+                          stderr=subprocess.PIPE, universal_newlines=True)
+
+
+def test_too_long_part_id_rejected(tmp_path):
+    part_id = 'P' * (PART_ID_MAX_LEN - 2)  # with sex and age one character too long
+    run = _headless(tmp_path, part_id)
+    assert run.returncode != 0
+    assert 'too long' in run.stderr
+    assert not os.path.exists(join(tmp_path, 'results'))  # rejected before any file is written
+
+
+def test_longest_part_id_accepted(tmp_path):
+    run = _headless(tmp_path, 'P' * (PART_ID_MAX_LEN - 3))
+    assert run.returncode == 0, run.stderr